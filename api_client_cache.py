@@ -0,0 +1,115 @@
+import logging
+import threading
+from lazy_module import LazyModule
+
+service_account = LazyModule('google.oauth2.service_account')
+storage = LazyModule('google.cloud.storage')
+bigquery = LazyModule('google.cloud.bigquery')
+discovery = LazyModule('googleapiclient.discovery')
+
+
+def build(service_name: str, service_version: str, **kwargs):
+    return discovery.build(service_name, service_version, **kwargs)
+
+
+class ApiClientCache:
+    """Process wide cache of credentials, API services, storage and BigQuery clients and bucket handles.
+
+    Credentials are shared by every client built from the same key file and scopes. google-auth refreshes
+    the access token in place once it has expired, so a cached credential only costs a token request when
+    the previous token is no longer valid. Discovery services wrap a httplib2.Http, which is not thread
+    safe, so services are cached per thread and reuse their HTTP connection between calls.
+    """
+
+    _shared_cache = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = {}
+        self._services = {}
+        self._storage_clients = {}
+        self._bigquery_clients = {}
+        self._buckets = {}
+
+    @staticmethod
+    def shared():
+        with ApiClientCache._shared_lock:
+            if ApiClientCache._shared_cache is None:
+                ApiClientCache._shared_cache = ApiClientCache()
+            return ApiClientCache._shared_cache
+
+    @staticmethod
+    def _scopes_key(scopes) -> tuple:
+        if scopes is None:
+            return ()
+        if isinstance(scopes, str):
+            return scopes,
+        return tuple(scopes)
+
+    def get_credentials(self, service_account_file: str, scopes=None):
+        key = (self._scopes_key(scopes), service_account_file)
+        with self._lock:
+            credentials = self._credentials.get(key)
+            if credentials is None:
+                if scopes:
+                    credentials = service_account.Credentials.from_service_account_file(service_account_file,
+                                                                                        scopes=scopes)
+                else:
+                    credentials = service_account.Credentials.from_service_account_file(service_account_file)
+                self._credentials[key] = credentials
+            return credentials
+
+    def get_service(self, service_name: str, service_version: str, scopes, service_account_file: str):
+        key = (service_name, service_version, self._scopes_key(scopes), service_account_file,
+               threading.get_ident())
+        with self._lock:
+            service = self._services.get(key)
+        if service is None:
+            credentials = self.get_credentials(service_account_file=service_account_file, scopes=scopes)
+            service = build(service_name, service_version, credentials=credentials, cache_discovery=False)
+            logging.debug('Created ' + service_name + ' ' + service_version + ' service for ' + service_account_file)
+            with self._lock:
+                service = self._services.setdefault(key, service)
+        return service
+
+    def get_storage_client(self, service_account_file: str, project: str):
+        key = (service_account_file, project)
+        with self._lock:
+            client = self._storage_clients.get(key)
+        if client is None:
+            credentials = self.get_credentials(service_account_file=service_account_file)
+            client = storage.Client(credentials=credentials, project=project)
+            with self._lock:
+                client = self._storage_clients.setdefault(key, client)
+        return client
+
+    def get_bigquery_client(self, service_account_file: str, project: str):
+        key = (service_account_file, project)
+        with self._lock:
+            client = self._bigquery_clients.get(key)
+        if client is None:
+            credentials = self.get_credentials(service_account_file=service_account_file)
+            client = bigquery.Client(credentials=credentials, project=project)
+            with self._lock:
+                client = self._bigquery_clients.setdefault(key, client)
+        return client
+
+    def get_bucket(self, service_account_file: str, project: str, bucket_name: str):
+        key = (service_account_file, project, bucket_name)
+        with self._lock:
+            bucket = self._buckets.get(key)
+        if bucket is None:
+            client = self.get_storage_client(service_account_file=service_account_file, project=project)
+            bucket = client.get_bucket(bucket_name)
+            with self._lock:
+                bucket = self._buckets.setdefault(key, bucket)
+        return bucket
+
+    def clear(self):
+        with self._lock:
+            self._credentials.clear()
+            self._services.clear()
+            self._storage_clients.clear()
+            self._bigquery_clients.clear()
+            self._buckets.clear()
@@ -0,0 +1,195 @@
+import logging
+import random
+import socket
+import threading
+import time
+from lazy_module import LazyModule
+from run_metrics import RunMetrics
+
+googleapiclient_errors = LazyModule('googleapiclient.errors')
+api_core_exceptions = LazyModule('google.api_core.exceptions')
+requests_exceptions = LazyModule('requests.exceptions')
+httplib2 = LazyModule('httplib2')
+
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+def get_retryable_api_core_exceptions() -> tuple:
+    return (api_core_exceptions.TooManyRequests,
+            api_core_exceptions.InternalServerError,
+            api_core_exceptions.BadGateway,
+            api_core_exceptions.ServiceUnavailable,
+            api_core_exceptions.GatewayTimeout)
+
+
+def get_retryable_transport_exceptions() -> tuple:
+    """Connection resets and timeouts of google-cloud-storage (requests) and googleapiclient (httplib2), neither
+    derives from the builtin ConnectionError."""
+    return (ConnectionError, socket.timeout,
+            requests_exceptions.ConnectionError,
+            requests_exceptions.Timeout,
+            httplib2.HttpLib2Error)
+
+
+def is_retryable(exception: Exception, idempotent: bool = True) -> bool:
+    """Non idempotent calls, e.g. deleting rows, are only retried when the request was rejected by quota."""
+    if isinstance(exception, googleapiclient_errors.HttpError):
+        status = int(exception.resp.status)
+        return status == 429 or (idempotent and status in RETRYABLE_STATUS_CODES)
+    if isinstance(exception, api_core_exceptions.TooManyRequests):
+        return True
+    return idempotent and isinstance(exception, get_retryable_api_core_exceptions() +
+                                     get_retryable_transport_exceptions())
+
+
+class TokenBucket:
+    """Allows capacity requests at once and refills refill_per_second tokens every second."""
+
+    def __init__(self, capacity: float, refill_per_second: float, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_per_second)
+        self._updated_at = now
+
+    def acquire(self) -> float:
+        """Take one token, waiting for it when the bucket is empty. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait_seconds = (1 - self._tokens) / self.refill_per_second
+            self._sleep(wait_seconds)
+            waited += wait_seconds
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: attempt n sleeps uniform(0, min(max_delay, initial_delay * 2 ** n))."""
+
+    def __init__(self, max_attempts: int = 6, initial_delay: float = 1.0, max_delay: float = 64.0,
+                 multiplier: float = 2.0):
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.initial_delay * self.multiplier ** attempt))
+
+
+class ApiCallStats:
+
+    COUNTERS = ['calls', 'retries', 'failures', 'throttled', 'throttle_wait_seconds']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def increment(self, api: str, counter: str, value: float = 1):
+        with self._lock:
+            api_counters = self._counters.setdefault(api, dict.fromkeys(ApiCallStats.COUNTERS, 0))
+            api_counters[counter] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {api: dict(counters) for api, counters in self._counters.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+    def summary(self) -> str:
+        return ', '.join(api + ' : ' + ' '.join(counter + '=' + ('%.1f' % value if isinstance(value, float)
+                                                                  else str(value))
+                                                 for counter, value in counters.items())
+                         for api, counters in sorted(self.snapshot().items()))
+
+
+class ApiRateLimiter:
+    """Shared token buckets per (api, credential) plus retries with backoff for every Google API call.
+
+    The Sheets API allows 60 read and 60 write requests per minute per user, a single service account used
+    by many concurrent profiles therefore shares one bucket. A bucket holds one token, requests are spread evenly
+    so no 60 seconds window sees more than requests_per_minute of them. APIs without a limit are only retried.
+    """
+
+    DEFAULT_REQUESTS_PER_MINUTE = {'sheets': 60, 'drive': 600}
+    # A bucket holding a whole minute of tokens would allow twice the quota in the first minute.
+    BURST_REQUESTS = 1
+
+    _shared_limiter = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, requests_per_minute: dict = None, retry_policy: RetryPolicy = None, stats: ApiCallStats = None,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.requests_per_minute = dict(ApiRateLimiter.DEFAULT_REQUESTS_PER_MINUTE)
+        self.requests_per_minute.update(requests_per_minute or {})
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.stats = stats or ApiCallStats()
+        self._sleep = sleep
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+        # Runs a single request, e.g. AsyncIOEngine.execute schedules it on the event loop.
+        self.call_runner = None
+
+    @staticmethod
+    def shared():
+        with ApiRateLimiter._shared_lock:
+            if ApiRateLimiter._shared_limiter is None:
+                ApiRateLimiter._shared_limiter = ApiRateLimiter()
+            return ApiRateLimiter._shared_limiter
+
+    def configure(self, api: str, requests_per_minute: float):
+        with self._lock:
+            self.requests_per_minute[api] = requests_per_minute
+            for key in [key for key in self._buckets if key[0] == api]:
+                del self._buckets[key]
+
+    def _get_bucket(self, api: str, credential_key: str):
+        requests_per_minute = self.requests_per_minute.get(api)
+        if not requests_per_minute:
+            return None
+        with self._lock:
+            key = (api, credential_key)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(capacity=ApiRateLimiter.BURST_REQUESTS,
+                                                 refill_per_second=requests_per_minute / 60.0, clock=self._clock,
+                                                 sleep=self._sleep)
+            return self._buckets[key]
+
+    def execute(self, api: str, credential_key: str, call, retryable: bool = True, idempotent: bool = True):
+        bucket = self._get_bucket(api, credential_key)
+        run_metrics = RunMetrics.current()
+        max_attempts = self.retry_policy.max_attempts if retryable else 1
+        for attempt in range(max_attempts):
+            if bucket is not None:
+                waited = bucket.acquire()
+                if waited > 0:
+                    self.stats.increment(api, 'throttled')
+                    self.stats.increment(api, 'throttle_wait_seconds', waited)
+            self.stats.increment(api, 'calls')
+            run_metrics.count_api_call(api, 'calls')
+            try:
+                return call() if self.call_runner is None else self.call_runner(call)
+            except Exception as exception:
+                if not is_retryable(exception, idempotent=idempotent) or attempt + 1 >= max_attempts:
+                    self.stats.increment(api, 'failures')
+                    run_metrics.count_api_call(api, 'failures')
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                self.stats.increment(api, 'retries')
+                run_metrics.count_api_call(api, 'retries')
+                logging.warning('Retry ' + api + ' call in %.1f seconds (attempt %d/%d) after : %s' %
+                                (delay, attempt + 1, max_attempts, exception))
+                self._sleep(delay)
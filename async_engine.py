@@ -0,0 +1,152 @@
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from api_rate_limiter import ApiRateLimiter
+from lazy_module import LazyModule
+from run_metrics import RunMetrics
+
+asyncio = LazyModule('asyncio')
+
+_routing = threading.local()
+
+
+class AsyncIOEngine:
+    """One asyncio event loop scheduling the Sheets and GCS calls of every profile it drives.
+
+    googleapiclient (httplib2) and google-cloud-storage (requests) only have blocking transports, a call runs in
+    the engine's thread pool through run_in_executor and the loop decides what is in flight. A semaphore caps the
+    calls in flight over all profiles, independent calls such as the schema and the data upload are awaited
+    together. While the engine is active, the API calls of routed threads go through it, the calls made inside
+    an engine call, e.g. the parts of a composite upload, run directly so a call never waits for a second slot.
+    """
+
+    DEFAULT_MAX_CONCURRENCY = 16
+
+    _active_engine = None
+
+    def __init__(self, max_concurrency: int = None):
+        self.max_concurrency = max_concurrency or AsyncIOEngine.DEFAULT_MAX_CONCURRENCY
+        self._executor = None
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+
+    @staticmethod
+    def active():
+        return AsyncIOEngine._active_engine
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='async-io')
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='async-io-loop', daemon=True)
+        self._thread.start()
+        self._semaphore = self.run(self._create_semaphore())
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _create_semaphore(self):
+        # Created on the loop thread, a Python 3.7 semaphore binds the loop of the thread creating it.
+        return asyncio.Semaphore(self.max_concurrency)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
+
+    @contextmanager
+    def activate(self):
+        """Start the loop and route the API calls of the calling thread and of routed() functions through it."""
+        rate_limiter = ApiRateLimiter.shared()
+        previous_engine = AsyncIOEngine._active_engine
+        previous_call_runner = rate_limiter.call_runner
+        self.start()
+        AsyncIOEngine._active_engine = self
+        rate_limiter.call_runner = self.execute
+        try:
+            with AsyncIOEngine.routing():
+                yield self
+        finally:
+            AsyncIOEngine._active_engine = previous_engine
+            rate_limiter.call_runner = previous_call_runner
+            self.close()
+
+    @staticmethod
+    @contextmanager
+    def routing(enabled: bool = True):
+        previous = getattr(_routing, 'enabled', False)
+        _routing.enabled = enabled
+        try:
+            yield
+        finally:
+            _routing.enabled = previous
+
+    def routed(self, func):
+        def routed_func(*args, **kwargs):
+            with AsyncIOEngine.routing():
+                return func(*args, **kwargs)
+        return routed_func
+
+    @staticmethod
+    def in_call() -> bool:
+        return getattr(_routing, 'in_call', False)
+
+    @staticmethod
+    def _run_unrouted(func):
+        _routing.in_call = True
+        try:
+            with AsyncIOEngine.routing(enabled=False):
+                return func()
+        finally:
+            _routing.in_call = False
+
+    def call(self, func, *args, **kwargs):
+        """Coroutine running func(*args, **kwargs) in the thread pool once a slot is free.
+
+        The run metrics of the thread creating the coroutine are bound here, the coroutine itself runs on the
+        loop thread.
+        """
+        return self._call(RunMetrics.current().bind(functools.partial(func, *args, **kwargs)))
+
+    async def _call(self, func):
+        async with self._semaphore:
+            return await asyncio.get_event_loop().run_in_executor(self._executor, self._run_unrouted, func)
+
+    def run(self, coroutine):
+        """Result of coroutine run on the engine loop, called from any thread but the loop thread."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def run_calls(self, calls: []) -> []:
+        """Results of the independent calls in order, the calls overlap within the concurrency cap."""
+        return self.run(self.gather(*[self.call(call) for call in calls]))
+
+    @staticmethod
+    async def gather(*coroutines) -> []:
+        return list(await asyncio.gather(*coroutines))
+
+    def execute(self, call):
+        """ApiRateLimiter call runner, one API request of a routed thread takes one slot of the engine."""
+        if not getattr(_routing, 'enabled', False):
+            return call()
+        return self.run(self.call(call))
+
+    async def run_routed(self, func, args_list: [], workers: int) -> []:
+        """func(*args) for every args of args_list in at most workers threads whose API calls go through the
+        engine, e.g. one profile export per thread."""
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='async-profile') as executor:
+            return list(await asyncio.gather(*[loop.run_in_executor(executor, functools.partial(self.routed(func),
+                                                                                                *args))
+                                               for args in args_list]))
+
+
+def run_independent(calls: []) -> []:
+    """Results of calls in order, overlapped on the active AsyncIOEngine, one after the other without one
+    or inside an engine call, which already holds a slot."""
+    engine = AsyncIOEngine.active()
+    if engine is None or AsyncIOEngine.in_call():
+        return [call() for call in calls]
+    return engine.run_calls(calls)
@@ -0,0 +1,219 @@
+import logging
+import os
+import time
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from global_constant import GlobalConstant
+import main
+from api_rate_limiter import ApiRateLimiter
+from async_engine import AsyncIOEngine
+from profile_model import ProfileCache, ProfileModel
+from run_metrics import RunMetrics, STATUS_SUCCESS, STATUS_FAILED, DEFAULT_PUSHGATEWAY_JOB, export_run_reports
+
+PROFILE_EXTENSIONS = ('.yaml', '.yml')
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+EXECUTOR_ASYNCIO = 'asyncio'
+
+
+def read_args(parser_args: ArgumentParser) -> Namespace:
+    required = parser_args.add_argument_group('required arguments')
+    required.add_argument('-p', '--profiles', nargs='+',
+                          help='Profile files (.yaml) or directories containing profile files')
+    required.add_argument('-mode', '--mode',
+                          help='daily or hourly mode input')
+    optional = parser_args.add_argument_group('option argument')
+    optional.add_argument('-clean', '--clean_sheet',
+                          default="False",
+                          help='Clean sheet after uploading data from google sheets, flag True or False')
+    optional.add_argument('-w', '--workers', type=int,
+                          default=4,
+                          help='Number of profiles exported at the same time')
+    optional.add_argument('-e', '--executor',
+                          default=EXECUTOR_THREAD, choices=[EXECUTOR_THREAD, EXECUTOR_PROCESS, EXECUTOR_ASYNCIO],
+                          help='Run profiles in a thread pool (shares API clients), a process pool or a thread pool '
+                               'whose API calls share one asyncio loop')
+    optional.add_argument('--io_concurrency', type=int,
+                          default=AsyncIOEngine.DEFAULT_MAX_CONCURRENCY,
+                          help='API calls in flight at most over all profiles with the asyncio executor')
+    optional.add_argument('--sheets_requests_per_minute', type=float,
+                          default=ApiRateLimiter.DEFAULT_REQUESTS_PER_MINUTE['sheets'],
+                          help='Sheets API requests per minute allowed per service account, with the process '
+                               'executor every worker process gets its share of the limit')
+    optional.add_argument('--metrics_json',
+                          help='Write the per stage report of every profile run as JSON to this file')
+    optional.add_argument('--metrics_textfile',
+                          help='Write the run metrics in Prometheus text format to this file (node exporter textfile)')
+    optional.add_argument('--metrics_pushgateway',
+                          help='Push the run metrics to this Prometheus pushgateway URL')
+    optional.add_argument('--metrics_job',
+                          default=DEFAULT_PUSHGATEWAY_JOB,
+                          help='Pushgateway job name')
+    optional.add_argument('--validate_profiles', '--validate-profiles', action='store_true',
+                          help='Only check that every profile parses and is complete, no API is called')
+    return parser_args.parse_args()
+
+
+def validate_args(parser: ArgumentParser, arguments: Namespace):
+    if not arguments.profiles:
+        logging.error("Please specific -p or --profiles for profile paths")
+        parser.print_help()
+        exit(1)
+
+    if not arguments.validate_profiles and \
+            arguments.mode not in [GlobalConstant.MODE_DAILY, GlobalConstant.MODE_HOURLY]:
+        logging.error("Please specific mode -mode or --mode with daily or hourly")
+        parser.print_help()
+        exit(1)
+
+    if arguments.workers < 1:
+        logging.error("Please specific -w or --workers greater than 0")
+        parser.print_help()
+        exit(1)
+
+    if arguments.io_concurrency < 1:
+        logging.error("Please specific --io_concurrency greater than 0")
+        parser.print_help()
+        exit(1)
+
+    arguments.clean_sheet = arguments.clean_sheet.__str__().lower() in ['true']
+
+
+def collect_profile_paths(profiles: []) -> []:
+    profile_paths = []
+    for profile in profiles:
+        if os.path.isdir(profile):
+            for file_name in sorted(os.listdir(profile)):
+                if file_name.endswith(PROFILE_EXTENSIONS):
+                    profile_paths.append(os.path.join(profile, file_name))
+        else:
+            profile_paths.append(profile)
+    return profile_paths
+
+
+def validate_profiles(profile_paths: []) -> dict:
+    """Error of every profile that cannot be loaded by path, valid profiles stay compiled in ProfileCache."""
+    profile_errors = {}
+    for profile_path in profile_paths:
+        try:
+            ProfileCache.shared().load(profile_path)
+        except Exception as exception:
+            profile_errors[profile_path] = str(exception)
+    return profile_errors
+
+
+class ProfileRunResult:
+
+    def __init__(self, profile_path: str, status: str, row_count: int = 0, output_bytes: int = 0,
+                 elapsed_seconds: float = 0.0, error: str = '', metrics: dict = None):
+        self.profile_path = profile_path
+        self.status = status
+        self.row_count = row_count
+        self.output_bytes = output_bytes
+        self.elapsed_seconds = elapsed_seconds
+        self.error = error
+        # RunMetrics report as a dict, so results can come back from a process pool.
+        self.metrics = metrics
+
+
+def run_profile_path(profile_path: str, mode: str, is_clean_sheet: bool,
+                     profile_model: ProfileModel = None) -> ProfileRunResult:
+    start_time = time.time()
+    run_metrics = RunMetrics(name=profile_path, labels={'mode': mode})
+    try:
+        profile_item = main.ProfileItem(config_path=profile_path, mode=mode, is_clean_sheet=is_clean_sheet,
+                                        profile_model=profile_model)
+        export_result = main.run_profile(profile_item=profile_item, run_metrics=run_metrics)
+        return ProfileRunResult(profile_path=profile_path, status=STATUS_SUCCESS,
+                                row_count=export_result.row_count, output_bytes=export_result.output_bytes,
+                                elapsed_seconds=time.time() - start_time, metrics=run_metrics.to_dict())
+    except (Exception, SystemExit) as exception:
+        # GoogleDocAPIMGMT exits on empty ranges, one profile must not stop the whole batch.
+        logging.error('Profile ' + profile_path + ' failed : ' + repr(exception))
+        if run_metrics.status is None:
+            run_metrics.finish(status=STATUS_FAILED)
+        return ProfileRunResult(profile_path=profile_path, status=STATUS_FAILED,
+                                elapsed_seconds=time.time() - start_time, error=repr(exception),
+                                metrics=run_metrics.to_dict())
+
+
+def process_worker_requests_per_minute(workers: int) -> dict:
+    """Share of every rate limit for one of workers processes, each process has its own ApiRateLimiter."""
+    return {api: requests_per_minute / workers
+            for api, requests_per_minute in ApiRateLimiter.shared().requests_per_minute.items() if requests_per_minute}
+
+
+def configure_process_worker(requests_per_minute: dict):
+    for api, api_requests_per_minute in requests_per_minute.items():
+        ApiRateLimiter.shared().configure(api=api, requests_per_minute=api_requests_per_minute)
+
+
+def run_batch(profile_paths: [], mode: str, is_clean_sheet: bool, workers: int = 4,
+              executor_type: str = EXECUTOR_THREAD, io_concurrency: int = None) -> []:
+    if executor_type == EXECUTOR_ASYNCIO:
+        # Profiles still run in worker threads, their API calls are scheduled on one loop under one global cap.
+        with AsyncIOEngine(max_concurrency=io_concurrency).activate() as engine:
+            return engine.run(engine.run_routed(run_profile_path, [(profile_path, mode, is_clean_sheet)
+                                                                   for profile_path in profile_paths],
+                                                workers=workers))
+    if executor_type == EXECUTOR_PROCESS:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=configure_process_worker,
+                                       initargs=(process_worker_requests_per_minute(workers),))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        futures = [executor.submit(run_profile_path, profile_path, mode, is_clean_sheet)
+                   for profile_path in profile_paths]
+        return [future.result() for future in futures]
+
+
+def format_summary(results: []) -> str:
+    header = ('PROFILE', 'STATUS', 'ROWS', 'BYTES', 'SECONDS', 'ERROR')
+    rows = [header] + [(result.profile_path, result.status, str(result.row_count), str(result.output_bytes),
+                        '%.2f' % result.elapsed_seconds, result.error) for result in results]
+    widths = [max(len(row[index]) for row in rows) for index in range(len(header))]
+    lines = ['  '.join(value.ljust(widths[index]) for index, value in enumerate(row)).rstrip() for row in rows]
+    succeeded = len([result for result in results if result.status == STATUS_SUCCESS])
+    lines.append('Total : ' + str(len(results)) + ', succeeded : ' + str(succeeded) + ', failed : ' +
+                 str(len(results) - succeeded) + ', rows : ' + str(sum(result.row_count for result in results)) +
+                 ', bytes : ' + str(sum(result.output_bytes for result in results)))
+    api_summary = ApiRateLimiter.shared().stats.summary()
+    if api_summary:
+        lines.append('API calls : ' + api_summary)
+    return '\n'.join(lines)
+
+
+def batch_main():
+    parser = ArgumentParser()
+    args = read_args(parser)
+    validate_args(parser=parser, arguments=args)
+    profile_paths = collect_profile_paths(args.profiles)
+    profile_errors = validate_profiles(profile_paths)
+    for profile_path, error in profile_errors.items():
+        logging.error(error)
+    if args.validate_profiles:
+        print('Profiles : ' + str(len(profile_paths)) + ', valid : ' + str(len(profile_paths) - len(profile_errors)) +
+              ', invalid : ' + str(len(profile_errors)))
+        exit(1 if profile_errors else 0)
+    ApiRateLimiter.shared().configure(api='sheets', requests_per_minute=args.sheets_requests_per_minute)
+    # Invalid profiles fail without a run, the others are exported from their already compiled profile.
+    valid_results = iter(run_batch(profile_paths=[profile_path for profile_path in profile_paths
+                                                  if profile_path not in profile_errors],
+                                   mode=args.mode, is_clean_sheet=args.clean_sheet, workers=args.workers,
+                                   executor_type=args.executor, io_concurrency=args.io_concurrency))
+    results = [ProfileRunResult(profile_path=profile_path, status=STATUS_FAILED, error=profile_errors[profile_path])
+               if profile_path in profile_errors else next(valid_results) for profile_path in profile_paths]
+    print(format_summary(results))
+    export_run_reports([result.metrics for result in results if result.metrics], json_path=args.metrics_json,
+                       textfile_path=args.metrics_textfile, pushgateway_url=args.metrics_pushgateway,
+                       pushgateway_job=args.metrics_job)
+    if any(result.status == STATUS_FAILED for result in results):
+        exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(threadName)s - %(name)s - %(levelname)-7s - %(message)s'
+    )
+    batch_main()
@@ -0,0 +1,221 @@
+import base64
+import io
+import json
+import random
+import struct
+from datetime import datetime, timedelta
+from google_storage_mgmt import load_crc32c_extend
+from sheet_range import SheetRange
+
+
+class SyntheticSheet:
+    """Deterministic sheet rows generated on demand, so 1M row sheets do not have to be held in memory.
+
+    Column 0 is always filled (rows with an empty first column are skipped by the export). dirty_ratio of
+    the mobile cells are not numeric and the same ratio of timestamps are written without zero padding,
+    which still parses, so strict timestamp conversion keeps working.
+    """
+
+    def __init__(self, row_count: int, column_count: int = 10, mobile_columns: [] = (1,),
+                 timestamp_columns: [] = (0,), dirty_ratio: float = 0.0, empty_row_ratio: float = 0.0,
+                 timestamp_format: str = '%m/%d/%Y %H:%M:%S', seed: int = 42):
+        self.row_count = row_count
+        self.column_count = column_count
+        self.mobile_columns = list(mobile_columns)
+        self.timestamp_columns = list(timestamp_columns)
+        self.dirty_ratio = dirty_ratio
+        self.empty_row_ratio = empty_row_ratio
+        self.timestamp_format = timestamp_format
+        self.seed = seed
+        self.start_time = datetime(2018, 8, 9)
+
+    def get_row(self, row_index: int) -> []:
+        """Row by 1-based sheet row number, row 1 is the header."""
+        if row_index == 1:
+            return ['column_' + str(column) for column in range(self.column_count)]
+        rng = random.Random(self.seed * 1000003 + row_index)
+        if rng.random() < self.empty_row_ratio:
+            return []
+        row = []
+        for column in range(self.column_count):
+            is_dirty = rng.random() < self.dirty_ratio
+            if column in self.timestamp_columns:
+                value = self.start_time + timedelta(seconds=row_index * 37)
+                if is_dirty:
+                    row.append('%d/%d/%d %d:%02d:%02d' % (value.month, value.day, value.year, value.hour,
+                                                          value.minute, value.second))
+                else:
+                    row.append(value.strftime(self.timestamp_format))
+            elif column in self.mobile_columns:
+                row.append('n/a' if is_dirty else str(800000000 + rng.randint(0, 99999999)))
+            else:
+                row.append('value_' + str(row_index) + '_' + str(column))
+        return row
+
+    def get_values(self, sheet_range: SheetRange) -> []:
+        last_row = min(sheet_range.end_row or self.row_count + 1, self.row_count + 1)
+        start_col = SheetRange.column_to_index(sheet_range.start_col)
+        end_col = SheetRange.column_to_index(sheet_range.end_col)
+        values = [self.get_row(row_index)[start_col:end_col + 1]
+                  for row_index in range(sheet_range.start_row, last_row + 1)]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+
+class FakeRequest:
+
+    def __init__(self, response, simulate_json: bool = True):
+        self.response = response
+        self.simulate_json = simulate_json
+
+    def execute(self):
+        if self.simulate_json:
+            # The real client decodes a JSON body, keep that cost in the measurement.
+            return json.loads(json.dumps(self.response))
+        return self.response
+
+
+class FakeSheetsService:
+    """In-process stand-in for the spreadsheets().values() / spreadsheets() parts of the Sheets v4 service."""
+
+    def __init__(self, sheet: SyntheticSheet, simulate_json: bool = True):
+        self.sheet = sheet
+        self.simulate_json = simulate_json
+        self.call_counts = {}
+        self.batch_update_bodies = []
+
+    def _count(self, name: str):
+        self.call_counts[name] = self.call_counts.get(name, 0) + 1
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        self._count('batchGet')
+        value_ranges = []
+        for range_name in ([ranges] if isinstance(ranges, str) else ranges):
+            sheet_range = SheetRange.parse(range_name)
+            value_range = {'range': sheet_range.to_a1(), 'majorDimension': 'ROWS'}
+            values = self.sheet.get_values(sheet_range)
+            if values:
+                value_range['values'] = values
+            value_ranges.append(value_range)
+        return FakeRequest({'spreadsheetId': spreadsheetId, 'valueRanges': value_ranges}, self.simulate_json)
+
+    def get(self, spreadsheetId, **kwargs):
+        self._count('get')
+        return FakeRequest({'sheets': [{'properties': {'gridProperties': {'rowCount': self.sheet.row_count + 1}}}]},
+                           self.simulate_json)
+
+    def batchUpdate(self, spreadsheetId, body):
+        self._count('batchUpdate')
+        self.batch_update_bodies.append(body)
+        return FakeRequest({'spreadsheetId': spreadsheetId, 'replies': [{} for _ in body['requests']]},
+                           self.simulate_json)
+
+    def batchClear(self, spreadsheetId, body):
+        self._count('batchClear')
+        return FakeRequest({'spreadsheetId': spreadsheetId, 'clearedRanges': body['ranges']}, self.simulate_json)
+
+
+class FakeBlob:
+    """Consumes uploads like google.cloud.storage.Blob, only keeping their size (or content when asked)."""
+
+    def __init__(self, name: str, bucket, keep_content: bool = False):
+        self.name = name
+        self.bucket = bucket
+        self.keep_content = keep_content
+        self.chunk_size = None
+        self.content_encoding = None
+        self.content_type = None
+        self.size = 0
+        self.content = b''
+
+    def _consume(self, file_obj, size=None):
+        read_size = self.chunk_size or 1024 * 1024
+        remaining = size
+        while remaining is None or remaining > 0:
+            part = file_obj.read(read_size if remaining is None else min(read_size, remaining))
+            if not part:
+                break
+            self.size += len(part)
+            if remaining is not None:
+                remaining -= len(part)
+            if self.keep_content:
+                self.content += part
+        self.bucket.blobs[self.name] = self
+
+    def upload_from_file(self, file_obj, size=None, content_type=None, **kwargs):
+        self.content_type = content_type
+        self._consume(file_obj, size=size)
+
+    def upload_from_filename(self, filename, content_type=None, **kwargs):
+        self.content_type = content_type
+        with open(filename, 'rb') as file_obj:
+            self._consume(file_obj)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        self._check_generation_match(if_generation_match)
+        self.content_type = content_type
+        self._consume(io.BytesIO(data.encode('utf-8') if isinstance(data, str) else data))
+
+    def _check_generation_match(self, if_generation_match):
+        if if_generation_match == 0 and self.name in self.bucket.blobs:
+            from google.api_core.exceptions import PreconditionFailed
+            raise PreconditionFailed('gs://' + self.bucket.name + '/' + self.name + ' already exists')
+
+    def exists(self, **kwargs):
+        return self.name in self.bucket.blobs
+
+    def rewrite(self, source, token=None, if_generation_match=None, **kwargs):
+        self._check_generation_match(if_generation_match)
+        stored = self.bucket.blobs[source.name]
+        self.size = stored.size
+        self.content = stored.content
+        self.content_type = stored.content_type
+        self.content_encoding = stored.content_encoding
+        self.bucket.blobs[self.name] = self
+        return None, self.size, self.size
+
+    def compose(self, sources, **kwargs):
+        self.size = sum(source.size for source in sources)
+        self.content = b''.join(source.content for source in sources)
+        self.bucket.compose_calls += 1
+        self.bucket.blobs[self.name] = self
+
+    def reload(self, **kwargs):
+        stored = self.bucket.blobs[self.name]
+        self.size = stored.size
+        self.content = stored.content
+
+    def delete(self, **kwargs):
+        if self.name not in self.bucket.blobs:
+            from google.api_core.exceptions import NotFound
+            raise NotFound('gs://' + self.bucket.name + '/' + self.name + ' does not exist')
+        del self.bucket.blobs[self.name]
+
+    @property
+    def crc32c(self):
+        # Only meaningful with keep_content, like Blob.crc32c it is the base64 big endian CRC32C.
+        crc32c_extend = load_crc32c_extend()
+        crc = crc32c_extend(0, self.content) if crc32c_extend else 0
+        return base64.b64encode(struct.pack('>I', crc)).decode('utf-8')
+
+
+class FakeBucket:
+
+    def __init__(self, name: str = 'benchmark_bucket', keep_content: bool = False):
+        self.name = name
+        self.keep_content = keep_content
+        self.blobs = {}
+        self.compose_calls = 0
+
+    def get_blob(self, blob_name: str):
+        return self.blobs.get(blob_name)
+
+    def blob(self, blob_name: str):
+        return FakeBlob(name=blob_name, bucket=self, keep_content=self.keep_content)
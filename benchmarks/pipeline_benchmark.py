@@ -0,0 +1,224 @@
+"""Offline benchmark of the sheet export pipeline against in-process Sheets and GCS fakes.
+
+Every row count runs in its own interpreter, so the reported peak RSS belongs to that size only:
+
+    python -m benchmarks.pipeline_benchmark --rows 1000 10000 100000 1000000 --output bench.json
+    python -m benchmarks.pipeline_benchmark --rows 1000 10000 100000 --baseline bench.json --tolerance 0.2
+"""
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from api_rate_limiter import ApiRateLimiter
+from benchmarks.fake_backends import SyntheticSheet, FakeSheetsService, FakeBucket
+from global_constant import GlobalConstant
+from google_doc_api_mgmt import GoogleDocAPIMGMT
+from google_storage_mgmt import GoogleCloudStorageClient
+from lazy_module import LazyModule
+from output_writers import OutputWriter
+from transform_inputs import TransformInputs
+
+SHEET_RANGE = 'A2:Z'
+SHEET_TIMESTAMP_FORMAT = '%m/%d/%Y %H:%M:%S'
+STAGES = ['fetch', 'transform', 'serialize', 'upload', 'end_to_end']
+
+
+class BenchmarkDocAPI(GoogleDocAPIMGMT):
+
+    def __init__(self, service: FakeSheetsService):
+        GoogleDocAPIMGMT.__init__(self, scopes=[], service_account_file='benchmark_service_account.json')
+        self.service = service
+
+    def _create_api_service(self, service_type):
+        return self.service
+
+
+class BenchmarkStorageClient(GoogleCloudStorageClient):
+
+    def __init__(self, bucket: FakeBucket):
+        GoogleCloudStorageClient.__init__(self, service_account_path='benchmark_service_account.json',
+                                          project='benchmark')
+        self.bucket = bucket
+
+    def _get_bucket(self, bucket_name: str):
+        return self.bucket
+
+
+def read_args(parser_args: ArgumentParser) -> Namespace:
+    parser_args.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                             help='Sheet sizes to benchmark')
+    parser_args.add_argument('--columns', type=int, default=10, help='Columns per row')
+    parser_args.add_argument('--mobile_columns', type=int, nargs='*', default=[1], help='Mobile column indices')
+    parser_args.add_argument('--timestamp_columns', type=int, nargs='*', default=[0],
+                             help='Timestamp column indices')
+    parser_args.add_argument('--dirty_ratio', type=float, default=0.05, help='Ratio of dirty mobile/timestamp cells')
+    parser_args.add_argument('--chunk_rows', type=int, default=None, help='Benchmark the chunked download path')
+    parser_args.add_argument('--output_format', default='csv', help='Output writer used by the serialize stage')
+    parser_args.add_argument('--output', help='Write the results as JSON to this file')
+    parser_args.add_argument('--baseline', help='JSON results of a previous run to compare throughput against')
+    parser_args.add_argument('--tolerance', type=float, default=0.2,
+                             help='Allowed throughput drop against the baseline before failing')
+    parser_args.add_argument('--single', action='store_true',
+                             help='Run the first size in this process and print its JSON result')
+    return parser_args.parse_args()
+
+
+def get_peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak_rss / 1024.0 / (1024.0 if sys.platform == 'darwin' else 1.0)
+
+
+def timed(results: dict, stage: str, func):
+    start_time = time.perf_counter()
+    value = func()
+    results[stage] = time.perf_counter() - start_time
+    return value
+
+
+def create_schema(column_count: int, timestamp_columns: []) -> []:
+    return [{'name': 'column_' + str(column), 'mode': 'NULLABLE',
+             'type': 'TIMESTAMP' if column in timestamp_columns else 'STRING'} for column in range(column_count)]
+
+
+def benchmark_size(row_count: int, args: Namespace) -> dict:
+    ApiRateLimiter.shared().configure(api='sheets', requests_per_minute=None)
+    # pandas and the API clients are imported on first use, which must not be timed as the fetch stage.
+    LazyModule.load_all()
+    sheet = SyntheticSheet(row_count=row_count, column_count=args.columns, mobile_columns=args.mobile_columns,
+                           timestamp_columns=args.timestamp_columns, dirty_ratio=args.dirty_ratio,
+                           timestamp_format=SHEET_TIMESTAMP_FORMAT)
+    service = FakeSheetsService(sheet)
+    drive_mgmt = BenchmarkDocAPI(service)
+    bucket = FakeBucket()
+    google_storage = BenchmarkStorageClient(bucket)
+    transform_inputs = TransformInputs()
+    transform_inputs.convert_transform_inputs(mobile_column_inputs=args.mobile_columns,
+                                              timestamp_column_inputs=args.timestamp_columns)
+    transform_inputs.set_column_count(args.columns)
+    output_writer = OutputWriter.for_format(args.output_format)
+    schema = create_schema(args.columns, args.timestamp_columns)
+    seconds = {}
+
+    def fetch():
+        response = drive_mgmt._execute(service.spreadsheets().values().batchGet(spreadsheetId='benchmark',
+                                                                                ranges=SHEET_RANGE))
+        value_range = response['valueRanges'][0]
+        data = GoogleDocAPIMGMT.create_dataframe(values=value_range['values'],
+                                                 start_row=GoogleDocAPIMGMT.get_start_row(value_range))
+        return data[data[0].notnull()]
+
+    data = timed(seconds, 'fetch', fetch)
+    data = timed(seconds, 'transform', lambda: GoogleDocAPIMGMT.transform_columns(
+        data=data, transform_inputs=transform_inputs, sheet_timestamp=SHEET_TIMESTAMP_FORMAT))
+    payload = timed(seconds, 'serialize', lambda: b''.join(output_writer.serialize_chunks([data], schema)))
+    timed(seconds, 'upload', lambda: google_storage.upload_data_to_gcs(
+        bucket_name=bucket.name, gcs_file_name='benchmark.' + args.output_format, data=payload,
+        content_type=output_writer.content_type or 'text/csv', content_encoding=output_writer.content_encoding))
+    del data, payload
+
+    output_path = os.path.join(tempfile.mkdtemp(), 'benchmark.csv')
+
+    def end_to_end():
+        drive_mgmt.download_sheets_ranges_csv(file_id='benchmark', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                                              ranges=SHEET_RANGE, output_path=output_path,
+                                              sheet_timestamp=SHEET_TIMESTAMP_FORMAT,
+                                              transform_inputs=transform_inputs, chunk_rows=args.chunk_rows)
+        google_storage.upload_file_to_gcs(bucket_name=bucket.name, gcs_file_name='benchmark.csv',
+                                          local_file_path=output_path, content_type='text/csv')
+
+    timed(seconds, 'end_to_end', end_to_end)
+    output_bytes = os.path.getsize(output_path)
+    os.remove(output_path)
+    return {
+        'rows': row_count,
+        'columns': args.columns,
+        'chunk_rows': args.chunk_rows,
+        'output_format': args.output_format,
+        'seconds': seconds,
+        'rows_per_second': {stage: row_count / value if value > 0 else None for stage, value in seconds.items()},
+        'output_bytes': output_bytes,
+        'sheets_calls': service.call_counts,
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+
+
+def run_in_subprocess(row_count: int, argv: []) -> dict:
+    command = [sys.executable, '-m', 'benchmarks.pipeline_benchmark', '--single', '--rows', str(row_count)] + argv
+    output = subprocess.check_output(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def strip_size_args(argv: []) -> []:
+    stripped = []
+    skip = False
+    for value in argv:
+        if value in ['--rows', '--output', '--baseline', '--tolerance']:
+            skip = True
+            continue
+        if skip and value.startswith('--'):
+            skip = False
+        if not skip:
+            stripped.append(value)
+    return stripped
+
+
+def format_results(results: []) -> str:
+    lines = ['%10s %10s %10s %10s %10s %12s %14s %10s' % ('ROWS', 'FETCH', 'TRANSFORM', 'SERIALIZE', 'UPLOAD',
+                                                        'END_TO_END', 'ROWS/S (E2E)', 'PEAK MB')]
+    for result in results:
+        seconds = result['seconds']
+        lines.append('%10d %10.3f %10.3f %10.3f %10.3f %12.3f %14.0f %10.1f' % (
+            result['rows'], seconds['fetch'], seconds['transform'], seconds['serialize'], seconds['upload'],
+            seconds['end_to_end'], result['rows_per_second']['end_to_end'] or 0, result['peak_rss_mb']))
+    return '\n'.join(lines)
+
+
+def find_regressions(results: [], baseline: [], tolerance: float) -> []:
+    regressions = []
+    baseline_by_rows = {result['rows']: result for result in baseline}
+    for result in results:
+        previous = baseline_by_rows.get(result['rows'])
+        if previous is None:
+            continue
+        for stage in STAGES:
+            current_rate = result['rows_per_second'].get(stage)
+            previous_rate = previous['rows_per_second'].get(stage)
+            if current_rate and previous_rate and current_rate < previous_rate * (1 - tolerance):
+                regressions.append('%d rows, %s : %.0f rows/s, baseline %.0f rows/s' %
+                                   (result['rows'], stage, current_rate, previous_rate))
+    return regressions
+
+
+def benchmark_main():
+    parser = ArgumentParser()
+    args = read_args(parser)
+    if args.single:
+        print(json.dumps(benchmark_size(args.rows[0], args)))
+        return
+
+    results = [run_in_subprocess(row_count, strip_size_args(sys.argv[1:])) for row_count in args.rows]
+    print(format_results(results))
+    if args.output:
+        with open(args.output, 'wt') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'rt') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            logging.error('Throughput regression : ' + regression)
+        if regressions:
+            exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)-7s - %(message)s'
+    )
+    benchmark_main()
@@ -0,0 +1,98 @@
+"""Cold start time of the CLI entry paths, each measured in a fresh interpreter.
+
+    python -m benchmarks.startup_benchmark --repeat 10 --output startup.json
+    python -m benchmarks.startup_benchmark --baseline startup.json --tolerance 0.3
+"""
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['pandas', 'numpy', 'googleapiclient.discovery', 'google.cloud.storage', 'google.oauth2',
+                 'ruamel.yaml']
+ENTRY_PATHS = [
+    ('import main', ['-c', 'import main']),
+    ('import batch_runner', ['-c', 'import batch_runner']),
+    ('main.py --help', ['main.py', '--help']),
+    ('main.py invalid args', ['main.py']),
+    ('batch_runner.py --help', ['batch_runner.py', '--help']),
+]
+
+
+def read_args(parser_args: ArgumentParser) -> Namespace:
+    parser_args.add_argument('--repeat', type=int, default=5, help='Runs per entry path, the median is reported')
+    parser_args.add_argument('--output', help='Write the results as JSON to this file')
+    parser_args.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    parser_args.add_argument('--tolerance', type=float, default=0.3,
+                             help='Allowed slow down against the baseline before failing')
+    return parser_args.parse_args()
+
+
+def time_entry_path(arguments: [], repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.call([sys.executable] + arguments, cwd=PACKAGE_DIR, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start_time)
+    return statistics.median(durations)
+
+
+def find_loaded_heavy_modules(module_name: str) -> []:
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import sys, json, ' + module_name + '; print(json.dumps([name for name in ' +
+         repr(HEAVY_MODULES) + ' if name in sys.modules]))'], cwd=PACKAGE_DIR)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def benchmark_startup(repeat: int) -> []:
+    baseline_seconds = time_entry_path(['-c', 'pass'], repeat)
+    results = []
+    for name, arguments in ENTRY_PATHS:
+        seconds = time_entry_path(arguments, repeat)
+        results.append({'entry_path': name, 'seconds': seconds, 'import_seconds': seconds - baseline_seconds})
+    return results
+
+
+def find_regressions(results: [], baseline: [], tolerance: float) -> []:
+    baseline_by_path = {result['entry_path']: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_path.get(result['entry_path'])
+        if previous is not None and result['seconds'] > previous['seconds'] * (1 + tolerance):
+            regressions.append('%s : %.3fs, baseline %.3fs' % (result['entry_path'], result['seconds'],
+                                                               previous['seconds']))
+    return regressions
+
+
+def benchmark_main():
+    parser = ArgumentParser()
+    args = read_args(parser)
+    results = benchmark_startup(args.repeat)
+    print('%-24s %10s %14s' % ('ENTRY PATH', 'SECONDS', 'OVER PYTHON'))
+    for result in results:
+        print('%-24s %10.3f %14.3f' % (result['entry_path'], result['seconds'], result['import_seconds']))
+    print('Heavy modules loaded by import main : ' + (', '.join(find_loaded_heavy_modules('main')) or 'none'))
+    if args.output:
+        with open(args.output, 'wt') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'rt') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            logging.error('Start up regression : ' + regression)
+        if regressions:
+            exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)-7s - %(message)s'
+    )
+    benchmark_main()
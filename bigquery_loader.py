@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import threading
+import uuid
+from api_client_cache import ApiClientCache
+from api_rate_limiter import ApiRateLimiter
+from lazy_module import LazyModule
+from run_metrics import RunMetrics
+
+bigquery = LazyModule('google.cloud.bigquery')
+api_core_exceptions = LazyModule('google.api_core.exceptions')
+
+WRITE_DISPOSITIONS = ['WRITE_APPEND', 'WRITE_TRUNCATE', 'WRITE_EMPTY']
+PARTITION_TYPES = ['HOUR', 'DAY', 'MONTH', 'YEAR']
+
+
+class BigQueryLoadRequest:
+    """Load of one uploaded GCS object into table_id (project.dataset.table) with the fields of schema_content.
+
+    Object names are per time slot, a later run of the slot uploads the same name again, so every request gets its
+    own load_id and only the retries of one request share the job id.
+    """
+
+    def __init__(self, source_uri: str, table_id: str, schema: [], source_format: str,
+                 write_disposition: str = None, partition_type: str = None, partition_field: str = None,
+                 load_id: str = None):
+        self.source_uri = source_uri
+        self.table_id = table_id
+        self.schema = schema
+        self.source_format = source_format
+        self.write_disposition = write_disposition or WRITE_DISPOSITIONS[0]
+        self.partition_type = partition_type
+        self.partition_field = partition_field
+        self.load_id = load_id or uuid.uuid4().hex
+        # The CSV writers put the column header in the first row.
+        self.skip_leading_rows = 1 if source_format == 'CSV' else 0
+
+    @property
+    def job_id(self) -> str:
+        """Same id for every submission of the request, a retry finds the job instead of loading twice."""
+        return 'sheet_export_' + hashlib.sha256('|'.join([self.source_uri, self.table_id, self.write_disposition,
+                                                          self.load_id]).encode('utf-8')).hexdigest()[:40]
+
+
+class BigQueryLoader:
+    """Loads uploaded objects into BigQuery, load() returns the job id and the number of loaded rows."""
+
+    def load(self, load_request: BigQueryLoadRequest) -> dict:
+        raise NotImplementedError
+
+
+class GoogleBigQueryLoader(BigQueryLoader):
+    """Submits a load job with google-cloud-bigquery and waits for it, a failed job raises."""
+
+    API_NAME = 'bigquery'
+
+    def __init__(self, service_account_file: str, project: str, timeout: float = None):
+        self.service_account_file = service_account_file
+        self.project = project
+        self.timeout = timeout
+
+    @staticmethod
+    def create_job_config(load_request: BigQueryLoadRequest):
+        job_config = bigquery.LoadJobConfig()
+        job_config.source_format = load_request.source_format
+        job_config.write_disposition = load_request.write_disposition
+        job_config.schema = [bigquery.SchemaField(field['name'], field['type'].upper(),
+                                                  mode=field.get('mode', 'NULLABLE').upper())
+                             for field in load_request.schema]
+        if load_request.skip_leading_rows:
+            job_config.skip_leading_rows = load_request.skip_leading_rows
+        if load_request.partition_type:
+            job_config.time_partitioning = bigquery.TimePartitioning(type_=load_request.partition_type,
+                                                                     field=load_request.partition_field)
+        return job_config
+
+    def load(self, load_request: BigQueryLoadRequest) -> dict:
+        with RunMetrics.current().stage('auth'):
+            client = ApiClientCache.shared().get_bigquery_client(service_account_file=self.service_account_file,
+                                                                 project=self.project)
+        job_config = GoogleBigQueryLoader.create_job_config(load_request)
+
+        def submit():
+            try:
+                return client.load_table_from_uri(load_request.source_uri, load_request.table_id,
+                                                  job_id=load_request.job_id, job_config=job_config)
+            except api_core_exceptions.Conflict:
+                # Submitted by an earlier attempt of this load whose response was lost.
+                return client.get_job(load_request.job_id)
+
+        with RunMetrics.current().stage('load'):
+            load_job = ApiRateLimiter.shared().execute(api=GoogleBigQueryLoader.API_NAME,
+                                                       credential_key=self.service_account_file, call=submit)
+            load_job.result(timeout=self.timeout)
+        output_rows = load_job.output_rows or 0
+        RunMetrics.current().record('load', rows=output_rows)
+        logging.info('Loaded ' + load_request.source_uri + ' into ' + load_request.table_id + ' : ' +
+                     str(output_rows) + ' rows, job ' + load_job.job_id)
+        return {'job_id': load_job.job_id, 'output_rows': output_rows}
+
+
+class LocalBigQueryLoader(BigQueryLoader):
+    """In process stand-in keeping every load request, for tests and runs without BigQuery."""
+
+    def __init__(self):
+        self.load_requests = []
+        self._lock = threading.Lock()
+
+    def load(self, load_request: BigQueryLoadRequest) -> dict:
+        with self._lock:
+            self.load_requests.append(load_request)
+        logging.info('Local load of ' + load_request.source_uri + ' into ' + load_request.table_id)
+        return {'job_id': load_request.job_id, 'output_rows': None}
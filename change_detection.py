@@ -0,0 +1,80 @@
+import hashlib
+import logging
+import os
+from export_state import ExportStateStore
+from lazy_module import LazyModule
+
+pandas = LazyModule('pandas')
+
+
+def hash_dataframes(chunks: []) -> str:
+    """Hash of the transformed rows in order, the same whether the range was read at once or in chunks."""
+    digest = hashlib.sha256()
+    for data in chunks:
+        if data.empty:
+            continue
+        digest.update(pandas.util.hash_pandas_object(data, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+class ChangeDetector:
+    """Skips exports of sheets that did not change since their last export.
+
+    The Drive version and modifiedTime of the document are checked before anything is read, a quiet sheet
+    costs one metadata request. When the document did change, e.g. another tab was edited, the content
+    hash of the transformed range is compared before it is serialized and uploaded. Every state_key, e.g. the
+    hourly and the daily run of one profile, keeps its own state in the state document of the sheet.
+    """
+
+    CHANGE_DETECTION_KEY = 'change_detection'
+    DRIVE_REVISION_KEY = 'drive_revision'
+    CONTENT_HASH_KEY = 'content_hash'
+
+    def __init__(self, export_state_store: ExportStateStore, drive_mgmt, google_doc_id: str, google_sheet_id,
+                 state_key: str):
+        self.export_state_store = export_state_store
+        self.drive_mgmt = drive_mgmt
+        self.google_doc_id = google_doc_id
+        self.google_sheet_id = google_sheet_id
+        self.state_key = state_key
+        self.state = self._load_states().get(state_key, {})
+        self.revision = None
+        self.content_hash = None
+
+    @staticmethod
+    def create_state_key(profile_path: str, mode: str) -> str:
+        return mode + ':' + os.path.abspath(profile_path)
+
+    def _load_states(self) -> dict:
+        return self.export_state_store.load(self.google_doc_id, self.google_sheet_id).get(
+            ChangeDetector.CHANGE_DETECTION_KEY, {})
+
+    def read_revision(self):
+        try:
+            self.revision = self.drive_mgmt.get_drive_revision(file_id=self.google_doc_id)
+        except Exception as exception:
+            # e.g. the credential misses a Drive scope, fall back to the content hash.
+            logging.warning('Cannot read Drive revision of ' + self.google_doc_id + ' : ' + repr(exception))
+            self.revision = None
+        return self.revision
+
+    def is_revision_unchanged(self) -> bool:
+        return self.read_revision() is not None and \
+            self.state.get(ChangeDetector.DRIVE_REVISION_KEY) == self.revision
+
+    def is_content_unchanged(self, chunks: []) -> bool:
+        self.content_hash = hash_dataframes(chunks)
+        return self.state.get(ChangeDetector.CONTENT_HASH_KEY) == self.content_hash
+
+    def save(self, is_sheet_cleaned: bool = False):
+        if is_sheet_cleaned:
+            # The revision read after the delete would also cover rows appended during the run. The next run
+            # decides on the content, which is empty unless rows were appended or kept by a verified clean.
+            self.revision = None
+            self.content_hash = hash_dataframes([])
+        states = self._load_states()
+        states[self.state_key] = {key: value for key, value in [(ChangeDetector.DRIVE_REVISION_KEY, self.revision),
+                                                                (ChangeDetector.CONTENT_HASH_KEY, self.content_hash)]
+                                  if value is not None}
+        self.export_state_store.update(self.google_doc_id, self.google_sheet_id,
+                                       **{ChangeDetector.CHANGE_DETECTION_KEY: states})
@@ -0,0 +1,211 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class ExportCacheEntry:
+    """Uploads of one time slot of a profile: the cached objects, their GCS destination and the row metadata
+    needed to clean the sheet afterwards."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_UPLOADED = 'uploaded'
+
+    def __init__(self, entry_path: str, metadata: dict):
+        self.entry_path = entry_path
+        self.metadata = metadata
+
+    @property
+    def objects(self) -> []:
+        return self.metadata['objects']
+
+    @property
+    def status(self) -> str:
+        return self.metadata['status']
+
+    @property
+    def created_at(self) -> float:
+        return self.metadata['created_at']
+
+    @property
+    def is_pending(self) -> bool:
+        return self.status == ExportCacheEntry.STATUS_PENDING
+
+
+class ExportCache:
+    """Local copies of the exported files of every time slot, stored by their SHA-256 so unchanged schema and data
+    files are kept once.
+
+    An entry stays pending until all of its uploads succeeded, a pending entry is uploaded again from the cache
+    without reading the sheet. Uploaded entries are evicted oldest first once the objects exceed max_bytes, every
+    entry older than max_age_seconds is evicted. Storing and evicting hold a lock file of cache_dir, so profiles
+    of other threads and processes sharing the directory never evict an object whose entry is being written.
+    """
+
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+    DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 3600
+    READ_BLOCK_SIZE = 1024 * 1024
+    LOCK_FILE_NAME = '.lock'
+
+    def __init__(self, cache_dir: str, max_bytes: int = None, max_age_seconds: float = None, clock=time.time):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes or ExportCache.DEFAULT_MAX_BYTES
+        self.max_age_seconds = max_age_seconds or ExportCache.DEFAULT_MAX_AGE_SECONDS
+        self._clock = clock
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+
+    @staticmethod
+    def profile_key(profile_path: str) -> str:
+        return hashlib.sha256(os.path.abspath(profile_path).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def file_sha256(local_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(local_path, 'rb') as file_obj:
+            for block in iter(lambda: file_obj.read(ExportCache.READ_BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, ExportCache.LOCK_FILE_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _put_object(self, local_path: str, digest: str):
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temporary_path = object_path + '.' + uuid.uuid4().hex + '.tmp'
+            try:
+                # The export file is deleted after the run, a hard link keeps its content without a copy.
+                os.link(local_path, temporary_path)
+            except OSError:
+                shutil.copyfile(local_path, temporary_path)
+            os.replace(temporary_path, object_path)
+
+    def _entry_path(self, profile_key: str, slot_name: str) -> str:
+        return os.path.join(self.entries_dir, profile_key,
+                            hashlib.sha256(slot_name.encode('utf-8')).hexdigest()[:16] + '.json')
+
+    def _write_entry(self, entry: ExportCacheEntry):
+        os.makedirs(os.path.dirname(entry.entry_path), exist_ok=True)
+        with open(entry.entry_path + '.tmp', 'wt') as entry_file:
+            json.dump(entry.metadata, entry_file, sort_keys=True)
+        os.replace(entry.entry_path + '.tmp', entry.entry_path)
+
+    def store(self, profile_key: str, slot_name: str, uploads: [], metadata: dict = None) -> ExportCacheEntry:
+        """Cache the files of uploads, dicts of bucket, name, local_path, content_type and content_encoding,
+        as a pending entry of the slot."""
+        objects = [{'bucket': upload['bucket'], 'name': upload['name'],
+                    'sha256': ExportCache.file_sha256(upload['local_path']),
+                    'size': os.path.getsize(upload['local_path']), 'content_type': upload['content_type'],
+                    'content_encoding': upload.get('content_encoding')} for upload in uploads]
+        entry = ExportCacheEntry(entry_path=self._entry_path(profile_key, slot_name),
+                                 metadata=dict(metadata or {}, slot_name=slot_name, created_at=self._clock(),
+                                               status=ExportCacheEntry.STATUS_PENDING, objects=objects))
+        # An object without its entry is unreferenced, an eviction must not run in between.
+        with self._locked():
+            for upload, cached_object in zip(uploads, objects):
+                self._put_object(upload['local_path'], cached_object['sha256'])
+            self._write_entry(entry)
+        return entry
+
+    def mark_uploaded(self, entry: ExportCacheEntry):
+        entry.metadata['status'] = ExportCacheEntry.STATUS_UPLOADED
+        with self._locked():
+            self._write_entry(entry)
+        self.evict()
+
+    def _load_entries(self, entries_dir: str) -> []:
+        entries = []
+        for file_name in sorted(os.listdir(entries_dir)) if os.path.isdir(entries_dir) else []:
+            if not file_name.endswith('.json'):
+                continue
+            entry_path = os.path.join(entries_dir, file_name)
+            try:
+                with open(entry_path, 'rt') as entry_file:
+                    entries.append(ExportCacheEntry(entry_path=entry_path, metadata=json.load(entry_file)))
+            except (OSError, ValueError) as exception:
+                # Removed by another process evicting, or written by a run that crashed.
+                logging.warning('Cannot read export cache entry ' + entry_path + ' : ' + repr(exception))
+        return entries
+
+    def entries(self, profile_key: str, pending_only: bool = False) -> []:
+        """Cached entries of the profile, oldest first."""
+        entries = self._load_entries(os.path.join(self.entries_dir, profile_key))
+        return sorted([entry for entry in entries if entry.is_pending or not pending_only],
+                      key=lambda entry: entry.created_at)
+
+    def all_entries(self) -> []:
+        profile_keys = sorted(os.listdir(self.entries_dir)) if os.path.isdir(self.entries_dir) else []
+        return sorted([entry for profile_key in profile_keys for entry in self.entries(profile_key)],
+                      key=lambda entry: entry.created_at)
+
+    def replay(self, entry: ExportCacheEntry, google_storage, upload_name=lambda name: name):
+        """Upload the cached objects of entry again, upload_name maps a final name to the name uploaded to."""
+        for cached_object in entry.objects:
+            google_storage.upload_file_to_gcs(bucket_name=cached_object['bucket'],
+                                              gcs_file_name=upload_name(cached_object['name']),
+                                              local_file_path=self.object_path(cached_object['sha256']),
+                                              content_type=cached_object['content_type'],
+                                              content_encoding=cached_object['content_encoding'])
+
+    @staticmethod
+    def _referenced_bytes(entries: []) -> int:
+        return sum({cached_object['sha256']: cached_object['size']
+                    for entry in entries for cached_object in entry.objects}.values())
+
+    def evict(self):
+        with self._locked():
+            entries = self.all_entries()
+            expired_before = self._clock() - self.max_age_seconds
+            kept = []
+            for entry in entries:
+                if entry.created_at < expired_before:
+                    if entry.is_pending:
+                        logging.warning('Evict pending export ' + entry.metadata['slot_name'] + ', it was never '
+                                        'uploaded')
+                    self._remove_entry(entry)
+                else:
+                    kept.append(entry)
+            # Pending entries are the ones a replay needs, only uploaded entries are evicted for space.
+            for entry in [entry for entry in kept if not entry.is_pending]:
+                if ExportCache._referenced_bytes(kept) <= self.max_bytes:
+                    break
+                self._remove_entry(entry)
+                kept.remove(entry)
+            if ExportCache._referenced_bytes(kept) > self.max_bytes:
+                logging.warning('Export cache ' + self.cache_dir + ' exceeds its size limit with pending exports')
+            self._remove_unreferenced_objects(kept)
+
+    @staticmethod
+    def _remove_entry(entry: ExportCacheEntry):
+        try:
+            os.remove(entry.entry_path)
+        except FileNotFoundError:
+            pass
+
+    def _remove_unreferenced_objects(self, entries: []):
+        referenced = {cached_object['sha256'] for entry in entries for cached_object in entry.objects}
+        for directory, _, file_names in os.walk(self.objects_dir):
+            for file_name in file_names:
+                # Temporary files may belong to a store in progress.
+                if file_name not in referenced and not file_name.endswith('.tmp'):
+                    try:
+                        os.remove(os.path.join(directory, file_name))
+                    except FileNotFoundError:
+                        pass
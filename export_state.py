@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import os
+from api_client_cache import ApiClientCache
+
+GCS_PREFIX = 'gs://'
+
+
+class SheetWatermark:
+    """Last exported sheet row, identified by its 1-based row number and a hash of its raw cell values."""
+
+    def __init__(self, row_index: int, row_hash: str):
+        self.row_index = row_index
+        self.row_hash = row_hash
+
+    @staticmethod
+    def hash_row(row_values: []) -> str:
+        return hashlib.sha256(json.dumps(row_values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def from_row(row_values: [], row_index: int):
+        return SheetWatermark(row_index=row_index, row_hash=SheetWatermark.hash_row(row_values))
+
+    def matches(self, row_values: []) -> bool:
+        return self.row_hash == SheetWatermark.hash_row(row_values)
+
+    def to_dict(self) -> dict:
+        return {'row_index': self.row_index, 'row_hash': self.row_hash}
+
+    @staticmethod
+    def from_dict(state: dict):
+        if not state:
+            return None
+        return SheetWatermark(row_index=int(state['row_index']), row_hash=state['row_hash'])
+
+
+class ExportStateStore:
+    """One small JSON document per google_doc_id/google_sheet_id, in a local directory or under gs://bucket/prefix."""
+
+    WATERMARK_KEY = 'watermark'
+
+    def __init__(self, state_path: str, service_account_file: str = None, project: str = None):
+        self.state_path = state_path.rstrip('/')
+        self.service_account_file = service_account_file
+        self.project = project
+
+    def _state_name(self, google_doc_id: str, google_sheet_id) -> str:
+        return google_doc_id + '_' + str(google_sheet_id) + '.json'
+
+    def _is_gcs(self) -> bool:
+        return self.state_path.startswith(GCS_PREFIX)
+
+    def _get_blob(self, name: str):
+        bucket_name, _, prefix = self.state_path[len(GCS_PREFIX):].partition('/')
+        bucket = ApiClientCache.shared().get_bucket(service_account_file=self.service_account_file,
+                                                    project=self.project, bucket_name=bucket_name)
+        return bucket.blob(prefix + '/' + name if prefix else name)
+
+    def load(self, google_doc_id: str, google_sheet_id) -> dict:
+        name = self._state_name(google_doc_id, google_sheet_id)
+        if self._is_gcs():
+            blob = self._get_blob(name)
+            if not blob.exists():
+                return {}
+            return json.loads(blob.download_as_string().decode('utf-8'))
+        local_path = os.path.join(self.state_path, name)
+        if not os.path.exists(local_path):
+            return {}
+        with open(local_path, 'rt') as state_file:
+            return json.load(state_file)
+
+    def save(self, google_doc_id: str, google_sheet_id, state: dict):
+        name = self._state_name(google_doc_id, google_sheet_id)
+        content = json.dumps(state, sort_keys=True)
+        if self._is_gcs():
+            self._get_blob(name).upload_from_string(content, content_type='application/json')
+        else:
+            if not os.path.exists(self.state_path):
+                os.makedirs(self.state_path)
+            local_path = os.path.join(self.state_path, name)
+            with open(local_path + '.tmp', 'wt') as state_file:
+                state_file.write(content)
+            os.replace(local_path + '.tmp', local_path)
+        logging.info('Saved export state ' + name + ' : ' + content)
+
+    def update(self, google_doc_id: str, google_sheet_id, **values):
+        state = self.load(google_doc_id, google_sheet_id)
+        for key, value in values.items():
+            if value is None:
+                state.pop(key, None)
+            else:
+                state[key] = value
+        self.save(google_doc_id, google_sheet_id, state)
+
+    def load_watermark(self, google_doc_id: str, google_sheet_id):
+        return SheetWatermark.from_dict(self.load(google_doc_id, google_sheet_id).get(ExportStateStore.WATERMARK_KEY))
+
+    def save_watermark(self, google_doc_id: str, google_sheet_id, watermark: SheetWatermark):
+        self.update(google_doc_id, google_sheet_id,
+                    **{ExportStateStore.WATERMARK_KEY: watermark.to_dict() if watermark else None})
@@ -5,3 +5,5 @@ class GlobalConstant:
     GOOGLE_SHEETS_TYPE = 'google_doc'
     MODE_DAILY = 'daily'
     MODE_HOURLY = 'hourly'
+    UPLOAD_MODE_FILE = 'file'
+    UPLOAD_MODE_MEMORY = 'memory'
@@ -1,33 +1,122 @@
+from __future__ import annotations
 import logging
-from google.oauth2 import service_account
-import io
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+import os
+from concurrent.futures import ThreadPoolExecutor
 from global_constant import GlobalConstant
-import pandas
+from lazy_module import LazyModule
 from datetime import datetime
 from transform_inputs import TransformInputs
+from transform_engine import VectorizedTransformEngine, TransformReport
+from sheet_range import SheetRange
+from api_client_cache import ApiClientCache
+from export_state import SheetWatermark
+from row_fingerprints import SheetRowFingerprints
+from api_rate_limiter import ApiRateLimiter
+from run_metrics import RunMetrics
+
+pandas = LazyModule('pandas')
+googleapiclient_http = LazyModule('googleapiclient.http')
+
+class SheetExportStats:
+
+    def __init__(self, watermark: SheetWatermark = None, row_fingerprints: SheetRowFingerprints = None):
+        self.row_count = 0
+        self.chunk_count = 0
+        self.incremental = watermark is not None
+        self.watermark = watermark
+        self.row_fingerprints = row_fingerprints
+
+    def add_chunk(self, row_count: int):
+        self.row_count += row_count
+        self.chunk_count += 1
+
+    def track_values(self, values: [], start_row: int):
+        if values:
+            self.watermark = SheetWatermark.from_row(row_values=values[-1], row_index=start_row + len(values) - 1)
+            if self.row_fingerprints is not None:
+                self.row_fingerprints.track_values(values=values, start_row=start_row)
+
+    def deleted_row_index_end(self) -> int:
+        if self.incremental:
+            # Every row up to the watermark has been exported by this or a previous run.
+            return self.watermark.row_index if self.watermark else 0
+        return self.row_count + GoogleDocAPIMGMT.DELETE_ROW_INDEX_START
+
+
+class DownloadChunkBuffer:
+    """Write target of MediaIoBaseDownload keeping only the bytes of the chunks not taken yet."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
 
 class GoogleDocAPIMGMT:
 
     CLEAR_RANGES = 'A2:Z'
+    DOWNLOAD_CHUNK_SIZE = 10 * 1024 * 1024
     DELETE_ROW_INDEX_START = 1
+    VERIFY_BATCH_RANGES = 100
+    TYPED_VALUE_RENDER_OPTIONS = {'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'SERIAL_NUMBER'}
     DEFAULT_BQ_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
 
-    def __init__(self, scopes: str, service_account_file: str):
+    def __init__(self, scopes: str, service_account_file: str, download_chunk_size: int = None):
         self.scopes = scopes
         self.service_account = service_account_file
+        self.download_chunk_size = download_chunk_size or GoogleDocAPIMGMT.DOWNLOAD_CHUNK_SIZE
 
 
     def _create_api_service(self, service_type):
         scopes = self.scopes
         service_account_file = self.service_account
         google_service_type , google_service_version = self.generate_service_type(service_type)
-        credentials = service_account.Credentials.from_service_account_file(
-            service_account_file, scopes=scopes)
-        drive_api_service = build(google_service_type, google_service_version, credentials=credentials, cache_discovery=False)
+        with RunMetrics.current().stage('auth'):
+            drive_api_service = ApiClientCache.shared().get_service(service_name=google_service_type,
+                                                                    service_version=google_service_version,
+                                                                    scopes=scopes,
+                                                                    service_account_file=service_account_file)
         return drive_api_service
 
+    def _execute(self, request, service_type: str = GlobalConstant.GOOGLE_SHEETS_TYPE, idempotent: bool = True,
+                 stage: str = 'fetch'):
+        google_service_type, _ = self.generate_service_type(service_type)
+        with RunMetrics.current().stage(stage):
+            return ApiRateLimiter.shared().execute(api=google_service_type, credential_key=self.service_account,
+                                                   call=request.execute, idempotent=idempotent)
+
+    def batch_get_values(self, file_id: str, ranges, service_type: str = GlobalConstant.GOOGLE_SHEETS_TYPE,
+                         render_options: dict = None, stage: str = 'fetch') -> dict:
+        service = self._create_api_service(service_type)
+        return self._execute(service.spreadsheets().values().batchGet(spreadsheetId=file_id, ranges=ranges,
+                                                                      **(render_options or {})),
+                             service_type=service_type, stage=stage)
+
+    def batch_update(self, file_id: str, requests: [], service_type: str = GlobalConstant.GOOGLE_SHEETS_TYPE,
+                     stage: str = 'clean') -> dict:
+        service = self._create_api_service(service_type)
+        return self._execute(service.spreadsheets().batchUpdate(spreadsheetId=file_id, body={"requests": requests}),
+                             service_type=service_type, idempotent=False, stage=stage)
+
+    @staticmethod
+    def record_fetched_values(values: []):
+        if values:
+            RunMetrics.current().record('fetch', rows=len(values), cells=sum(len(row) for row in values))
+
+    @staticmethod
+    def value_render_options(transform_inputs: TransformInputs) -> dict:
+        """batchGet options of the fetch, a typed fetch skips the locale formatting of numbers and dates."""
+        if transform_inputs is not None and transform_inputs.typed_schema is not None:
+            return dict(GoogleDocAPIMGMT.TYPED_VALUE_RENDER_OPTIONS)
+        return {}
+
     @staticmethod
     def generate_service_type(service_type):
         if service_type == GlobalConstant.GOOGLE_DRIVE_TYPE:
@@ -37,39 +126,97 @@ class GoogleDocAPIMGMT:
         else:
             raise ValueError('Service Type does not match :' + service_type )
 
-    def download_sheet_file(self, file_id: str, mime_type: str, output_path: str, service_type: str) -> str:
-        service = self._create_api_service(service_type)
-        request = service.files().export_media(fileId=file_id,
-                                                     mimeType=mime_type)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
+    def iter_sheet_file_chunks(self, file_id: str, mime_type: str, service_type: str,
+                               chunk_size: int = None):
+        """Bytes of the Drive export of file_id one chunk at a time, e.g. as data of upload_data_to_gcs.
 
+        Every chunk is a ranged request, a chunk failing with a transient error is retried by ApiRateLimiter
+        from the last received byte.
+        """
+        service = self._create_api_service(service_type)
+        request = service.files().export_media(fileId=file_id, mimeType=mime_type)
+        chunk_buffer = DownloadChunkBuffer()
+        chunk_size = chunk_size or self.download_chunk_size
+        downloader = googleapiclient_http.MediaIoBaseDownload(chunk_buffer, request, chunksize=chunk_size)
+        api = self.generate_service_type(service_type)[0]
         done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            print("Create file : "+ output_path +" progress: %d%%. " % int(status.progress() * 100))
-            with open(output_path, 'wb') as file_obj:
-                file_obj.write(fh.getvalue())
+        while not done:
+            with RunMetrics.current().stage('fetch'):
+                status, done = ApiRateLimiter.shared().execute(api=api, credential_key=self.service_account,
+                                                               call=downloader.next_chunk)
+            chunk = chunk_buffer.take()
+            RunMetrics.current().record('fetch', bytes=len(chunk))
+            logging.debug('Download ' + file_id + ' : %d of %s bytes' % (status.resumable_progress,
+                                                                      status.total_size or 'unknown'))
+            yield chunk
+
+    def download_sheet_file(self, file_id: str, mime_type: str, output_path: str, service_type: str,
+                            chunk_size: int = None) -> str:
+        with open(output_path, 'wb') as file_obj:
+            for chunk in self.iter_sheet_file_chunks(file_id=file_id, mime_type=mime_type,
+                                                     service_type=service_type, chunk_size=chunk_size):
+                file_obj.write(chunk)
+        logging.info('Create file : ' + output_path)
         return output_path
 
-    def download_sheets_ranges_csv(self, file_id: str, service_type: str, ranges: str, output_path: str, sheet_timestamp : str, transform_inputs: TransformInputs):
+    def get_drive_revision(self, file_id: str) -> dict:
+        """Drive version and modifiedTime of the document, both change with every edit of any of its tabs."""
+        service = self._create_api_service(GlobalConstant.GOOGLE_DRIVE_TYPE)
+        response = self._execute(service.files().get(fileId=file_id, fields='modifiedTime,version',
+                                                     supportsAllDrives=True),
+                                 service_type=GlobalConstant.GOOGLE_DRIVE_TYPE, stage='change_check')
+        return {'version': response.get('version'), 'modified_time': response.get('modifiedTime')}
+
+    def download_sheets_ranges_csv(self, file_id: str, service_type: str, ranges: str, output_path: str, sheet_timestamp : str, transform_inputs: TransformInputs,
+                                   chunk_rows: int = None, export_stats: SheetExportStats = None):
+        export_stats = export_stats if export_stats is not None else SheetExportStats()
+        if chunk_rows:
+            return self.download_sheets_ranges_csv_chunked(file_id=file_id, service_type=service_type, ranges=ranges,
+                                                           output_path=output_path, sheet_timestamp=sheet_timestamp,
+                                                           transform_inputs=transform_inputs, chunk_rows=chunk_rows,
+                                                           export_stats=export_stats)
+        data, deleted_row_index_end = self.fetch_sheets_ranges_dataframe(file_id=file_id, service_type=service_type,
+                                                                         ranges=ranges, sheet_timestamp=sheet_timestamp,
+                                                                         transform_inputs=transform_inputs,
+                                                                         export_stats=export_stats)
+        with RunMetrics.current().stage('serialize'):
+            data.to_csv(output_path, index=False)
+        RunMetrics.current().record('serialize', bytes=os.path.getsize(output_path))
+        return output_path, deleted_row_index_end
+
+    def fetch_sheets_ranges_dataframe(self, file_id: str, service_type: str, ranges: str, sheet_timestamp: str,
+                                      transform_inputs: TransformInputs, export_stats: SheetExportStats = None,
+                                      allow_empty: bool = False):
+        """allow_empty returns an empty DataFrame for a range without values instead of exiting."""
+        export_stats = export_stats if export_stats is not None else SheetExportStats()
         service = self._create_api_service(service_type)
-        ranges_name = ranges
+        render_options = GoogleDocAPIMGMT.value_render_options(transform_inputs)
+        ranges_name = self.resolve_incremental_range(service=service, file_id=file_id, ranges=ranges,
+                                                     export_stats=export_stats, render_options=render_options)
+        if ranges_name is None:
+            return pandas.DataFrame(), export_stats.deleted_row_index_end()
 
         request = service.spreadsheets().values().batchGet(
-            spreadsheetId=file_id, ranges=ranges_name)
+            spreadsheetId=file_id, ranges=ranges_name, **render_options)
 
-        response = request.execute()
+        response = self._execute(request)
 
         try:
-            response_values = response.get('valueRanges')[0]['values']
-            data = pandas.DataFrame(response_values)
+            value_range = response.get('valueRanges')[0]
+            if export_stats.incremental and 'values' not in value_range:
+                logging.info('No new rows after watermark row ' + str(export_stats.watermark.row_index))
+                return pandas.DataFrame(), export_stats.deleted_row_index_end()
+            if allow_empty and 'values' not in value_range:
+                return pandas.DataFrame(), export_stats.deleted_row_index_end()
+            start_row = GoogleDocAPIMGMT.get_start_row(value_range)
+            GoogleDocAPIMGMT.record_fetched_values(value_range['values'])
+            export_stats.track_values(values=value_range['values'], start_row=start_row)
+            data = GoogleDocAPIMGMT.create_dataframe(values=value_range['values'], start_row=start_row)
             data = data[data[0].notnull()]
-            data = GoogleDocAPIMGMT.transform_mobile_column(data=data, transform_inputs=transform_inputs)
-            data = GoogleDocAPIMGMT.transform_timestamp_column(data=data, transform_inputs=transform_inputs, sheet_timestamp=sheet_timestamp)
-            data.to_csv(output_path, index=False)
-            deleted_row_index_end = data.shape[0] + GoogleDocAPIMGMT.DELETE_ROW_INDEX_START
-            return output_path, deleted_row_index_end
+            data = GoogleDocAPIMGMT.conform_columns(data=data, ranges=ranges_name, transform_inputs=transform_inputs)
+            data = GoogleDocAPIMGMT.transform_columns(data=data, transform_inputs=transform_inputs, sheet_timestamp=sheet_timestamp)
+            export_stats.add_chunk(row_count=data.shape[0])
+            return data, export_stats.deleted_row_index_end()
         except KeyError as key_exception:
             logging.error('No Data found in range :' + ranges )
             logging.error(key_exception)
@@ -77,11 +224,215 @@ class GoogleDocAPIMGMT:
         except Exception as exception:
             raise exception
 
+    def fetch_sheets_multi_ranges_dataframes(self, file_id: str, service_type: str, range_specs: [], workers: int = 4,
+                                             export_stats_list: [] = None):
+        """Fetch several ranges with one batchGet and transform them concurrently.
+
+        range_specs holds (ranges, sheet_timestamp, transform_inputs) tuples, the result holds one
+        (data, deleted_row_index_end) tuple per range in the same order. export_stats_list optionally holds
+        one SheetExportStats per range tracking the fetched rows.
+        """
+        export_stats_list = export_stats_list or [SheetExportStats() for _ in range_specs]
+        render_options_list = [GoogleDocAPIMGMT.value_render_options(transform_inputs)
+                               for _, _, transform_inputs in range_specs]
+        if any(render_options != render_options_list[0] for render_options in render_options_list):
+            raise ValueError('google_sheet_typed_fetch must be the same for all ranges fetched with one batchGet')
+        response = self.batch_get_values(file_id=file_id, ranges=[ranges for ranges, _, _ in range_specs],
+                                         service_type=service_type,
+                                         render_options=render_options_list[0] if render_options_list else None)
+
+        def transform_value_range(value_range: dict, range_spec: tuple, export_stats: SheetExportStats):
+            ranges, sheet_timestamp, transform_inputs = range_spec
+            if 'values' not in value_range:
+                logging.warning('No Data found in range :' + ranges)
+                return pandas.DataFrame(), GoogleDocAPIMGMT.DELETE_ROW_INDEX_START
+            GoogleDocAPIMGMT.record_fetched_values(value_range['values'])
+            start_row = GoogleDocAPIMGMT.get_start_row(value_range)
+            export_stats.track_values(values=value_range['values'], start_row=start_row)
+            data = GoogleDocAPIMGMT.create_dataframe(values=value_range['values'], start_row=start_row)
+            data = data[data[0].notnull()]
+            # Every export has the width of its own schema.
+            data = GoogleDocAPIMGMT.conform_columns(data=data, ranges=ranges, transform_inputs=transform_inputs)
+            data = GoogleDocAPIMGMT.transform_columns(data=data, transform_inputs=transform_inputs,
+                                                      sheet_timestamp=sheet_timestamp)
+            return data, data.shape[0] + GoogleDocAPIMGMT.DELETE_ROW_INDEX_START
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(RunMetrics.current().bind(transform_value_range), value_range, range_spec,
+                                       export_stats)
+                       for value_range, range_spec, export_stats in zip(response.get('valueRanges'), range_specs,
+                                                                        export_stats_list)]
+            return [future.result() for future in futures]
+
+    def resolve_incremental_range(self, service, file_id: str, ranges: str, export_stats: SheetExportStats,
+                                  render_options: dict = None):
+        """Range of the rows after the watermark, the full range when the watermark row has changed.
+
+        Returns None when the watermark already is the last row of a bounded range.
+        """
+        watermark = export_stats.watermark
+        if watermark is None:
+            return ranges
+        sheet_range = SheetRange.parse(ranges)
+        if watermark.row_index < sheet_range.start_row:
+            return ranges
+        watermark_range = sheet_range.with_rows(start_row=watermark.row_index, end_row=watermark.row_index)
+        response = self._execute(service.spreadsheets().values().batchGet(spreadsheetId=file_id,
+                                                                          ranges=watermark_range.to_a1(),
+                                                                          **(render_options or {})))
+        values = response.get('valueRanges')[0].get('values')
+        if not values or not watermark.matches(values[0]):
+            logging.warning('Watermark row ' + str(watermark.row_index) + ' has changed, reading whole range ' + ranges)
+            export_stats.watermark = None
+            return ranges
+        if sheet_range.end_row and watermark.row_index >= sheet_range.end_row:
+            return None
+        return sheet_range.with_rows(start_row=watermark.row_index + 1, end_row=sheet_range.end_row).to_a1()
+
+    def download_sheets_ranges_csv_chunked(self, file_id: str, service_type: str, ranges: str, output_path: str,
+                                           sheet_timestamp: str, transform_inputs: TransformInputs, chunk_rows: int,
+                                           export_stats: SheetExportStats = None):
+        export_stats = export_stats if export_stats is not None else SheetExportStats()
+        with open(output_path, 'wt', newline='') as file_obj:
+            for data in self.iter_transformed_range_chunks(file_id=file_id, service_type=service_type, ranges=ranges,
+                                                           sheet_timestamp=sheet_timestamp,
+                                                           transform_inputs=transform_inputs, chunk_rows=chunk_rows,
+                                                           export_stats=export_stats):
+                start_position = file_obj.tell()
+                with RunMetrics.current().stage('serialize'):
+                    data.to_csv(file_obj, index=False, header=export_stats.chunk_count == 1)
+                RunMetrics.current().record('serialize', bytes=file_obj.tell() - start_position)
+                logging.info('Appended ' + str(data.shape[0]) + ' rows to ' + output_path)
+        return output_path, export_stats.deleted_row_index_end()
+
+    def iter_sheets_ranges_dataframes(self, file_id: str, service_type: str, ranges: str, sheet_timestamp: str,
+                                      transform_inputs: TransformInputs, export_stats: SheetExportStats,
+                                      chunk_rows: int = None, allow_empty: bool = False):
+        """Yield the transformed range as one DataFrame, or one per chunk when chunk_rows is set.
+
+        An empty range exits unless allow_empty, e.g. to compare a cleaned sheet with its last export.
+        """
+        if not chunk_rows:
+            data, deleted_row_index_end = self.fetch_sheets_ranges_dataframe(file_id=file_id,
+                                                                             service_type=service_type, ranges=ranges,
+                                                                             sheet_timestamp=sheet_timestamp,
+                                                                             transform_inputs=transform_inputs,
+                                                                             export_stats=export_stats,
+                                                                             allow_empty=allow_empty)
+            if not data.empty or not (export_stats.incremental or allow_empty):
+                yield data
+            return
+        for data in self.iter_transformed_range_chunks(file_id=file_id, service_type=service_type, ranges=ranges,
+                                                       sheet_timestamp=sheet_timestamp,
+                                                       transform_inputs=transform_inputs, chunk_rows=chunk_rows,
+                                                       export_stats=export_stats, allow_empty=allow_empty):
+            yield data
+
+    def iter_transformed_range_chunks(self, file_id: str, service_type: str, ranges: str, sheet_timestamp: str,
+                                      transform_inputs: TransformInputs, chunk_rows: int,
+                                      export_stats: SheetExportStats, allow_empty: bool = False):
+        service = self._create_api_service(service_type)
+        render_options = GoogleDocAPIMGMT.value_render_options(transform_inputs)
+        ranges_name = self.resolve_incremental_range(service=service, file_id=file_id, ranges=ranges,
+                                                     export_stats=export_stats, render_options=render_options)
+        if ranges_name is None:
+            return
+        has_values = False
+        for data in self.iter_sheets_range_chunks(service=service, file_id=file_id, ranges=ranges_name,
+                                                  chunk_rows=chunk_rows, export_stats=export_stats,
+                                                  render_options=render_options):
+            has_values = True
+            data = data[data[0].notnull()]
+            if data.empty:
+                continue
+            # Every chunk has the width of the header written with the first one.
+            data = GoogleDocAPIMGMT.conform_columns(data=data, ranges=ranges_name, transform_inputs=transform_inputs)
+            data = GoogleDocAPIMGMT.transform_columns(data=data, transform_inputs=transform_inputs,
+                                                      sheet_timestamp=sheet_timestamp)
+            export_stats.add_chunk(row_count=data.shape[0])
+            yield data
+
+        if not has_values and not export_stats.incremental and not allow_empty:
+            logging.error('No Data found in range :' + ranges)
+            exit(2)
+
+    def iter_sheets_range_chunks(self, service, file_id: str, ranges: str, chunk_rows: int,
+                                 export_stats: SheetExportStats = None, render_options: dict = None):
+        sheet_range = SheetRange.parse(ranges)
+        last_row = sheet_range.end_row or self.get_sheet_row_count(service=service, file_id=file_id, ranges=ranges)
+        for window in sheet_range.split_rows(chunk_rows=chunk_rows, last_row=last_row):
+            response = self._execute(service.spreadsheets().values().batchGet(spreadsheetId=file_id,
+                                                                              ranges=window.to_a1(),
+                                                                              **(render_options or {})))
+            values = response.get('valueRanges')[0].get('values')
+            GoogleDocAPIMGMT.record_fetched_values(values)
+            if values:
+                if export_stats is not None:
+                    export_stats.track_values(values=values, start_row=window.start_row)
+                yield GoogleDocAPIMGMT.create_dataframe(values=values, start_row=window.start_row)
+
+    def get_sheet_row_count(self, service, file_id: str, ranges: str) -> int:
+        response = self._execute(service.spreadsheets().get(spreadsheetId=file_id, ranges=ranges,
+                                                            fields='sheets(properties(gridProperties(rowCount)))'))
+        return response['sheets'][0]['properties']['gridProperties']['rowCount']
+
+    @staticmethod
+    def get_start_row(value_range: dict) -> int:
+        try:
+            return SheetRange.parse(value_range['range']).start_row
+        except (KeyError, ValueError):
+            return GoogleDocAPIMGMT.DELETE_ROW_INDEX_START + 1
+
+    @staticmethod
+    def create_dataframe(values: [], start_row: int) -> pandas.DataFrame:
+        with RunMetrics.current().stage('dataframe'):
+            data = pandas.DataFrame(values)
+        data.index = range(start_row, start_row + data.shape[0])
+        return data
+
+    @staticmethod
+    def output_column_count(ranges: str, transform_inputs: TransformInputs) -> int:
+        """Columns of the output, the schema fields when known, else the columns of the range."""
+        if transform_inputs.column_count:
+            return transform_inputs.column_count
+        if transform_inputs.typed_schema:
+            return len(transform_inputs.typed_schema)
+        try:
+            return SheetRange.parse(ranges).column_count()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def conform_columns(data: pandas.DataFrame, ranges: str, transform_inputs: TransformInputs) -> pandas.DataFrame:
+        column_count = GoogleDocAPIMGMT.output_column_count(ranges, transform_inputs)
+        if column_count is None:
+            return data
+        if data.shape[1] > column_count:
+            extra = data.iloc[:, column_count:]
+            if (extra.notnull() & (extra != '')).values.any():
+                logging.warning('Values beyond the ' + str(column_count) + ' output columns of ' + ranges +
+                                ' are not exported')
+        return data.reindex(columns=range(column_count))
+
+    @staticmethod
+    def transform_columns(data : pandas.DataFrame, transform_inputs : TransformInputs, sheet_timestamp : str):
+        engine = VectorizedTransformEngine(sheet_timestamp=sheet_timestamp,
+                                           output_timestamp_format=GoogleDocAPIMGMT.DEFAULT_BQ_TIMESTAMP_FORMAT)
+        try:
+            with RunMetrics.current().stage('transform', rows=data.shape[0], cells=data.size):
+                data, report = engine.transform(data=data, transform_inputs=transform_inputs)
+            if report.mobile_unconverted_rows:
+                logging.info(report.summary())
+            return data
+        except KeyError as key_exception:
+            logging.error("Transform at Column Index : " + key_exception.__str__() + " => Error or out of range")
+            exit(1)
+
     @staticmethod
     def transform_mobile_column(data : pandas.DataFrame, transform_inputs : TransformInputs):
         try:
             for mobile_cols in transform_inputs.transform_mobile_number_column_indices:
-                data[mobile_cols] = data[mobile_cols].apply(GoogleDocAPIMGMT.convert_mobile_number)
+                data[mobile_cols] = VectorizedTransformEngine.transform_mobile_series(data[mobile_cols])
             return data
         except KeyError as key_exception:
             logging.error("Transform at Mobile Column Index : " + key_exception.__str__() + " => Error or out of range")
@@ -89,9 +440,14 @@ class GoogleDocAPIMGMT:
 
     @staticmethod
     def transform_timestamp_column(data : pandas.DataFrame, transform_inputs : TransformInputs, sheet_timestamp : str):
+        engine = VectorizedTransformEngine(sheet_timestamp=sheet_timestamp,
+                                           output_timestamp_format=GoogleDocAPIMGMT.DEFAULT_BQ_TIMESTAMP_FORMAT)
+        report = TransformReport()
         try:
             for timestamp_cols in transform_inputs.transform_timestamp_column_indices:
-                data[timestamp_cols] = data[timestamp_cols].apply(GoogleDocAPIMGMT.convert_date_time, input_format=sheet_timestamp)
+                data[timestamp_cols] = engine.transform_timestamp_series(data[timestamp_cols], column=timestamp_cols,
+                                                                         report=report)
+            engine.check_report(report)
             return data
         except KeyError as key_exception:
             logging.error("Transform at Timestamp Column Index :" + key_exception.__str__() + " => Error or out of range")
@@ -128,13 +484,14 @@ class GoogleDocAPIMGMT:
 
         request = service.spreadsheets().values().batchClear(spreadsheetId=file_id,
                                                              body=batch_clear_values_request_body)
-        response = request.execute()
+        response = self._execute(request, stage='clean')
         logging.info(response)
 
     def delete_sheets_rows_by_index(self, file_id: str, service_type: str, sheet_id: str, end_index : int):
         service = self._create_api_service(service_type)
         start_index = GoogleDocAPIMGMT.DELETE_ROW_INDEX_START
-        if end_index > 0:
+        # A zero width deleteDimension is rejected by the API.
+        if end_index > start_index:
             requests = [{
                 "deleteDimension": {
                     "range": {
@@ -147,7 +504,46 @@ class GoogleDocAPIMGMT:
             }]
 
             request_body = {"requests" : requests}
-            response = service.spreadsheets().batchUpdate(spreadsheetId=file_id, body=request_body).execute()
+            response = self._execute(service.spreadsheets().batchUpdate(spreadsheetId=file_id, body=request_body),
+                                     idempotent=False, stage='clean')
             logging.info(response)
         else:
             logging.warning("No deleted index detected. Will not activate any deleted rows action.")
+
+    def delete_verified_rows(self, file_id: str, service_type: str, sheet_id, row_fingerprints: SheetRowFingerprints) \
+            -> int:
+        """Delete the exported rows that still hold the exported values, returns the number of deleted rows.
+
+        Every block is re-read right before the batchUpdate, all matching blocks are deleted with one
+        batchUpdate of non-contiguous deleteDimension ranges, last rows first.
+        """
+        service = self._create_api_service(service_type)
+        blocks = row_fingerprints.blocks
+        verified_blocks = []
+        for offset in range(0, len(blocks), GoogleDocAPIMGMT.VERIFY_BATCH_RANGES):
+            batch = blocks[offset:offset + GoogleDocAPIMGMT.VERIFY_BATCH_RANGES]
+            response = self._execute(service.spreadsheets().values().batchGet(
+                spreadsheetId=file_id, ranges=[row_fingerprints.block_range(block) for block in batch],
+                **row_fingerprints.render_options), stage='clean')
+            for block, value_range in zip(batch, response.get('valueRanges')):
+                if SheetRowFingerprints.matches(block, value_range.get('values', [])):
+                    verified_blocks.append(block)
+                else:
+                    logging.warning('Rows ' + str(block.start_row) + '-' + str(block.end_row) +
+                                    ' changed since they were exported, they are not deleted')
+        if not verified_blocks:
+            logging.warning("No verified rows to delete. Will not activate any deleted rows action.")
+            return 0
+        requests = [{
+            "deleteDimension": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "dimension": "ROWS",
+                    "startIndex": start_row - 1,
+                    "endIndex": end_row
+                }
+            }
+        } for start_row, end_row in SheetRowFingerprints.merge_blocks(verified_blocks)]
+        response = self.batch_update(file_id=file_id, requests=requests, service_type=service_type)
+        logging.info(response)
+        return sum(block.row_count for block in verified_blocks)
@@ -1,22 +1,404 @@
-from google.cloud import storage
-from google.oauth2 import service_account
-from google.cloud.storage import Blob
+from api_client_cache import ApiClientCache
+from api_rate_limiter import ApiRateLimiter
+from run_metrics import RunMetrics
+from concurrent.futures import ThreadPoolExecutor
+from lazy_module import LazyModule
+import base64
+import io
+import json
 import logging
+import os
+import struct
+import uuid
+
+api_core_exceptions = LazyModule('google.api_core.exceptions')
+
+CRC32C_READ_SIZE = 8 * 1024 * 1024
+
+
+def load_crc32c_extend():
+    """extend(crc, data) -> crc of google_crc32c or crcmod, None when neither is installed."""
+    try:
+        import google_crc32c
+        return google_crc32c.extend
+    except ImportError:
+        pass
+    try:
+        import crcmod.predefined
+        crc_function = crcmod.predefined.mkCrcFun('crc-32c')
+        return lambda crc, data: crc_function(data, crc)
+    except ImportError:
+        return None
+
+
+def file_crc32c(local_file_path: str, crc32c_extend) -> str:
+    """CRC32C of the file, base64 encoded big endian like Blob.crc32c."""
+    crc = 0
+    with open(local_file_path, 'rb') as file_obj:
+        for block in iter(lambda: file_obj.read(CRC32C_READ_SIZE), b''):
+            crc = crc32c_extend(crc, block)
+    return base64.b64encode(struct.pack('>I', crc)).decode('utf-8')
+
+
+class FilePartReader(io.RawIOBase):
+    """Read-only view of length bytes of a file from offset, so a part upload never reads past its end."""
+
+    def __init__(self, local_file_path: str, offset: int, length: int):
+        self._file_obj = open(local_file_path, 'rb')
+        self._offset = offset
+        self._length = length
+        self._file_obj.seek(offset)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        remaining = self._offset + self._length - self._file_obj.tell()
+        if remaining <= 0:
+            return 0
+        data = self._file_obj.read(min(len(buffer), remaining))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def tell(self):
+        return self._file_obj.tell() - self._offset
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._file_obj.seek(self._offset + max(0, min(offset, self._length)))
+        return self.tell()
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._file_obj.close()
+        io.RawIOBase.close(self)
+
+
+class IterableReader(io.RawIOBase):
+    """Read-only, forward-only file object over an iterable of bytes, counts the bytes it has served."""
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._buffer = b''
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._iterator)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self._position += size
+        return size
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (whence == io.SEEK_SET and offset == self._position) or (whence == io.SEEK_CUR and offset == 0):
+            return self._position
+        raise io.UnsupportedOperation('IterableReader can only seek to its current position')
+
 
 class GoogleCloudStorageClient:
 
-    def __init__(self, service_account_path, project):
+    # Resumable uploads send the payload in chunks, chunk size must be a multiple of 256 KB.
+    RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    # Files from this size on are uploaded as parallel parts joined with compose, like gsutil does.
+    COMPOSITE_UPLOAD_THRESHOLD = 150 * 1024 * 1024
+    COMPOSITE_PART_SIZE = 64 * 1024 * 1024
+    COMPOSITE_UPLOAD_WORKERS = 8
+    MAX_COMPOSE_SOURCES = 32
+    API_NAME = 'storage'
+
+    def __init__(self, service_account_path, project, composite_upload_threshold: int = None,
+                 composite_part_size: int = None, composite_upload_workers: int = None):
         self.service_account_file = service_account_path
         self.project = project
+        self.composite_upload_threshold = composite_upload_threshold or \
+            GoogleCloudStorageClient.COMPOSITE_UPLOAD_THRESHOLD
+        self.composite_part_size = composite_part_size or GoogleCloudStorageClient.COMPOSITE_PART_SIZE
+        self.composite_upload_workers = composite_upload_workers or GoogleCloudStorageClient.COMPOSITE_UPLOAD_WORKERS
 
     def _create_credential(self):
-        credentials = service_account.Credentials.from_service_account_file(
-            self.service_account_file)
-        return storage.Client(credentials=credentials, project=self.project)
-
-    def upload_file_to_gcs(self, bucket_name: str, gcs_file_name: str, local_file_path: str, content_type: str):
-        client = self._create_credential()
-        bucket = client.get_bucket(bucket_name=bucket_name)
-        blob = Blob(name=gcs_file_name, bucket=bucket)
-        blob.upload_from_filename(filename=local_file_path, content_type=content_type)
-        logging.info('Successfully uploaded file : gs://' + bucket_name + '/' + gcs_file_name)
\ No newline at end of file
+        return ApiClientCache.shared().get_storage_client(service_account_file=self.service_account_file,
+                                                          project=self.project)
+
+    def _get_bucket(self, bucket_name: str):
+        with RunMetrics.current().stage('auth'):
+            return ApiClientCache.shared().get_bucket(service_account_file=self.service_account_file,
+                                                      project=self.project, bucket_name=bucket_name)
+
+    def _execute(self, call, retryable: bool = True):
+        return ApiRateLimiter.shared().execute(api=GoogleCloudStorageClient.API_NAME,
+                                               credential_key=self.service_account_file, call=call,
+                                               retryable=retryable)
+
+    def upload_file_to_gcs(self, bucket_name: str, gcs_file_name: str, local_file_path: str, content_type: str,
+                           content_encoding: str = None):
+        """Simple upload below RESUMABLE_UPLOAD_THRESHOLD, chunked resumable upload below the composite
+        threshold and a parallel composite upload above it."""
+        file_size = os.path.getsize(local_file_path)
+        bucket = self._get_bucket(bucket_name=bucket_name)
+        with RunMetrics.current().stage('upload', bytes=file_size):
+            if file_size >= self.composite_upload_threshold:
+                self.upload_file_composite(bucket=bucket, gcs_file_name=gcs_file_name, local_file_path=local_file_path,
+                                           content_type=content_type, content_encoding=content_encoding)
+            else:
+                blob = bucket.blob(gcs_file_name)
+                blob.content_encoding = content_encoding
+                if file_size > GoogleCloudStorageClient.RESUMABLE_UPLOAD_THRESHOLD:
+                    blob.chunk_size = GoogleCloudStorageClient.UPLOAD_CHUNK_SIZE
+                self._execute(lambda: blob.upload_from_filename(filename=local_file_path, content_type=content_type))
+        logging.info('Successfully uploaded file : gs://' + bucket_name + '/' + gcs_file_name)
+
+    def upload_file_composite(self, bucket, gcs_file_name: str, local_file_path: str, content_type: str,
+                              content_encoding: str = None):
+        """Upload the file as parts in parallel, compose them into gcs_file_name and verify its CRC32C.
+
+        Parts are temporary objects next to the destination, they are deleted whether the upload
+        succeeded or not. Compose takes at most 32 sources, more parts are composed in several rounds.
+        """
+        file_size = os.path.getsize(local_file_path)
+        part_prefix = gcs_file_name + '.parts-' + uuid.uuid4().hex + '/'
+        offsets = list(range(0, file_size, self.composite_part_size)) or [0]
+        temporary_blobs = []
+        crc32c_extend = load_crc32c_extend()
+        run_metrics = RunMetrics.current()
+
+        def upload_part(index: int, offset: int):
+            part = bucket.blob(part_prefix + '%05d' % index)
+            length = min(self.composite_part_size, file_size - offset)
+
+            def upload():
+                with FilePartReader(local_file_path, offset, length) as reader:
+                    part.upload_from_file(reader, size=length, content_type=content_type)
+            self._execute(upload)
+            return part
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.composite_upload_workers) as executor:
+                crc_future = executor.submit(file_crc32c, local_file_path, crc32c_extend) if crc32c_extend else None
+                part_futures = [executor.submit(run_metrics.bind(upload_part), index, offset)
+                                for index, offset in enumerate(offsets)]
+                parts = []
+                part_exception = None
+                # Every part is waited for, the parts uploaded before one failed are deleted with the others.
+                for future in part_futures:
+                    try:
+                        parts.append(future.result())
+                    except Exception as exception:
+                        part_exception = part_exception or exception
+                temporary_blobs.extend(parts)
+                if part_exception is not None:
+                    raise part_exception
+                expected_crc32c = crc_future.result() if crc_future else None
+
+            destination = self.compose_blobs(bucket=bucket, sources=parts, gcs_file_name=gcs_file_name,
+                                             content_type=content_type, content_encoding=content_encoding,
+                                             part_prefix=part_prefix, temporary_blobs=temporary_blobs)
+            if expected_crc32c is None:
+                logging.warning('Install google-crc32c or crcmod to verify composite uploads, ' + gcs_file_name +
+                                ' is not verified')
+            else:
+                self._execute(destination.reload)
+                if destination.crc32c != expected_crc32c:
+                    self._execute(destination.delete, retryable=False)
+                    raise IOError('CRC32C of gs://' + bucket.name + '/' + gcs_file_name + ' is ' +
+                                  str(destination.crc32c) + ', expected ' + expected_crc32c + ', object deleted')
+            logging.info('Composed ' + str(len(parts)) + ' parts into gs://' + bucket.name + '/' + gcs_file_name)
+        finally:
+            self.delete_blobs(temporary_blobs)
+
+    def compose_blobs(self, bucket, sources: [], gcs_file_name: str, content_type: str, content_encoding: str,
+                      part_prefix: str, temporary_blobs: []):
+        compose_round = 0
+        while len(sources) > GoogleCloudStorageClient.MAX_COMPOSE_SOURCES:
+            composed = []
+            for start in range(0, len(sources), GoogleCloudStorageClient.MAX_COMPOSE_SOURCES):
+                group = sources[start:start + GoogleCloudStorageClient.MAX_COMPOSE_SOURCES]
+                if len(group) == 1:
+                    composed.append(group[0])
+                    continue
+                intermediate = bucket.blob(part_prefix + 'composed-%d-%05d' % (compose_round, start))
+                intermediate.content_type = content_type
+                self._execute(lambda: intermediate.compose(group))
+                temporary_blobs.append(intermediate)
+                composed.append(intermediate)
+            sources = composed
+            compose_round += 1
+        destination = bucket.blob(gcs_file_name)
+        # compose needs the content type of the destination up front.
+        destination.content_type = content_type
+        destination.content_encoding = content_encoding
+        self._execute(lambda: destination.compose(sources))
+        return destination
+
+    def delete_blobs(self, blobs: []):
+        for blob in blobs:
+            try:
+                self._execute(blob.delete)
+            except Exception as exception:
+                logging.warning('Cannot delete temporary object ' + blob.name + ' : ' + repr(exception))
+
+    def upload_data_to_gcs(self, bucket_name: str, gcs_file_name: str, data, content_type: str,
+                           content_encoding: str = None) -> int:
+        """Upload str, bytes or an iterable of bytes without a local file, returns the uploaded size.
+
+        Payloads above RESUMABLE_UPLOAD_THRESHOLD and iterables, whose size is unknown up front, are sent
+        as a chunked resumable upload so only one chunk is held in memory at a time.
+        """
+        with RunMetrics.current().stage('upload'):
+            uploaded_size = self._upload_data(bucket_name=bucket_name, gcs_file_name=gcs_file_name, data=data,
+                                              content_type=content_type, content_encoding=content_encoding)
+        RunMetrics.current().record('upload', bytes=uploaded_size)
+        logging.info('Successfully uploaded ' + str(uploaded_size) + ' bytes : gs://' + bucket_name + '/' +
+                     gcs_file_name)
+        return uploaded_size
+
+    def blob_exists(self, bucket_name: str, gcs_file_name: str) -> bool:
+        bucket = self._get_bucket(bucket_name=bucket_name)
+        return self._execute(bucket.blob(gcs_file_name).exists)
+
+    def get_blob_crc32c(self, bucket_name: str, gcs_file_name: str):
+        bucket = self._get_bucket(bucket_name=bucket_name)
+        blob = self._execute(lambda: bucket.get_blob(gcs_file_name))
+        return blob.crc32c if blob is not None else None
+
+    def copy_blob_if_absent(self, bucket_name: str, source_name: str, destination_name: str) -> bool:
+        """Server side copy that only creates destination_name, False when the object already exists."""
+        bucket = self._get_bucket(bucket_name=bucket_name)
+        source = bucket.blob(source_name)
+        destination = bucket.blob(destination_name)
+        try:
+            # rewrite copies large objects in several calls, each call returns the token of the next one.
+            rewrite_token, _, _ = self._execute(lambda: destination.rewrite(source, if_generation_match=0))
+            while rewrite_token is not None:
+                rewrite_token, _, _ = self._execute(lambda: destination.rewrite(source, token=rewrite_token,
+                                                                                if_generation_match=0))
+        except api_core_exceptions.PreconditionFailed:
+            return False
+        logging.info('Published gs://' + bucket_name + '/' + destination_name)
+        return True
+
+    def create_blob_if_absent(self, bucket_name: str, gcs_file_name: str, data: str, content_type: str) -> bool:
+        bucket = self._get_bucket(bucket_name=bucket_name)
+        blob = bucket.blob(gcs_file_name)
+        try:
+            self._execute(lambda: blob.upload_from_string(data, content_type=content_type, if_generation_match=0))
+        except api_core_exceptions.PreconditionFailed:
+            return False
+        return True
+
+    def delete_blob(self, bucket_name: str, gcs_file_name: str):
+        bucket = self._get_bucket(bucket_name=bucket_name)
+        try:
+            self._execute(bucket.blob(gcs_file_name).delete)
+        except api_core_exceptions.NotFound:
+            pass
+
+    def _upload_data(self, bucket_name: str, gcs_file_name: str, data, content_type: str,
+                     content_encoding: str = None) -> int:
+        bucket = self._get_bucket(bucket_name=bucket_name)
+        blob = bucket.blob(gcs_file_name)
+        blob.content_encoding = content_encoding
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if isinstance(data, bytes):
+            if len(data) > GoogleCloudStorageClient.RESUMABLE_UPLOAD_THRESHOLD:
+                blob.chunk_size = GoogleCloudStorageClient.UPLOAD_CHUNK_SIZE
+            self._execute(lambda: blob.upload_from_file(io.BytesIO(data), size=len(data), content_type=content_type))
+            uploaded_size = len(data)
+        else:
+            reader = IterableReader(data)
+            blob.chunk_size = GoogleCloudStorageClient.UPLOAD_CHUNK_SIZE
+            # A consumed iterable cannot be rewound, so a failed streaming upload is not retried here.
+            self._execute(lambda: blob.upload_from_file(reader, content_type=content_type), retryable=False)
+            uploaded_size = reader.tell()
+        return uploaded_size
+
+
+class PublishConflictError(IOError):
+    pass
+
+
+class StagedPublish:
+    """Uploads to a temporary prefix, promoted to their final names once every object of the time slot is complete.
+
+    Final objects are only ever created, never overwritten (if_generation_match=0), so loaders never see a
+    partially written slot. Objects are promoted in the order given, data before schema, and the optional
+    success marker is written last. A re-run of a published slot finds its marker, or all of its objects
+    when there is no marker, and does nothing.
+    """
+
+    DEFAULT_STAGING_PREFIX = '_staging'
+    SUCCESS_MARKER_SUFFIX = '._SUCCESS'
+
+    def __init__(self, google_storage: GoogleCloudStorageClient, bucket_name: str, final_names: [],
+                 staging_prefix: str = None, success_marker: bool = False):
+        self.google_storage = google_storage
+        self.bucket_name = bucket_name
+        self.final_names = list(final_names)
+        self.staging_prefix = (staging_prefix or StagedPublish.DEFAULT_STAGING_PREFIX).strip('/') + '/' + \
+            uuid.uuid4().hex + '/'
+        self.success_marker = success_marker
+        self.staged_names = []
+
+    @property
+    def success_marker_name(self) -> str:
+        return self.final_names[0] + StagedPublish.SUCCESS_MARKER_SUFFIX
+
+    def staging_name(self, final_name: str) -> str:
+        staged_name = self.staging_prefix + final_name
+        self.staged_names.append(staged_name)
+        return staged_name
+
+    def is_published(self) -> bool:
+        names = [self.success_marker_name] if self.success_marker else self.final_names
+        return all(self.google_storage.blob_exists(bucket_name=self.bucket_name, gcs_file_name=name)
+                   for name in names)
+
+    def promote(self):
+        """Raises PublishConflictError when a final object already exists with other content, e.g. an earlier
+        run of the slot stopped half way and the sheet changed since, so the caller does not clean rows that
+        were never published."""
+        published = []
+        with RunMetrics.current().stage('publish'):
+            for final_name in self.final_names:
+                staged_name = self.staging_prefix + final_name
+                if not self.google_storage.copy_blob_if_absent(bucket_name=self.bucket_name, source_name=staged_name,
+                                                               destination_name=final_name):
+                    existing_crc32c = self.google_storage.get_blob_crc32c(bucket_name=self.bucket_name,
+                                                                          gcs_file_name=final_name)
+                    staged_crc32c = self.google_storage.get_blob_crc32c(bucket_name=self.bucket_name,
+                                                                        gcs_file_name=staged_name)
+                    if existing_crc32c != staged_crc32c:
+                        raise PublishConflictError('gs://' + self.bucket_name + '/' + final_name +
+                                                   ' was already published with other content')
+                    logging.info('gs://' + self.bucket_name + '/' + final_name + ' was already published')
+                published.append(final_name)
+            if self.success_marker:
+                self.google_storage.create_blob_if_absent(bucket_name=self.bucket_name,
+                                                          gcs_file_name=self.success_marker_name,
+                                                          data=json.dumps({'objects': published}),
+                                                          content_type='application/json')
+
+    def discard(self):
+        for staged_name in self.staged_names:
+            try:
+                self.google_storage.delete_blob(bucket_name=self.bucket_name, gcs_file_name=staged_name)
+            except Exception as exception:
+                logging.warning('Cannot delete staged object ' + staged_name + ' : ' + repr(exception))
+        self.staged_names = []
@@ -0,0 +1,42 @@
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    pandas, googleapiclient and google.cloud.storage take most of the start up time of a short run, entry
+    points like --help, argument validation or a clean only run never need them. Modules using a lazy
+    module must not touch it at import time, annotations naming its types are kept unevaluated with
+    `from __future__ import annotations`.
+    """
+
+    _instances = []
+
+    def __init__(self, module_name: str):
+        self._module_name = module_name
+        self._module = None
+        LazyModule._instances.append(self)
+
+    @staticmethod
+    def load_all() -> []:
+        """Import every lazy module created so far, e.g. before timing code that would import them on first use.
+        Returns the names of the modules that are not installed."""
+        missing = []
+        for lazy_module in list(LazyModule._instances):
+            try:
+                lazy_module._load()
+            except ImportError:
+                missing.append(lazy_module._module_name)
+        return missing
+
+    def _load(self):
+        if self._module is None:
+            # importlib holds a per module lock, concurrent first accesses import the module once.
+            self._module = importlib.import_module(self._module_name)
+        return self._module
+
+    def __getattr__(self, name: str):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return '<lazy module ' + repr(self._module_name) + (' (loaded)>' if self._module is not None else '>')
@@ -1,15 +1,35 @@
+import functools
+import itertools
 import logging
 import os
-import pytz
-from datetime import datetime, timedelta
-from ruamel import yaml
+from datetime import datetime
 from argparse import ArgumentParser, Namespace
-from google_doc_api_mgmt import GoogleDocAPIMGMT
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from google_doc_api_mgmt import GoogleDocAPIMGMT, SheetExportStats
+from export_state import ExportStateStore, SheetWatermark
+from export_cache import ExportCache
+from bigquery_loader import BigQueryLoader, BigQueryLoadRequest, GoogleBigQueryLoader
+from row_fingerprints import SheetRowFingerprints
+from change_detection import ChangeDetector
+from api_rate_limiter import ApiRateLimiter
+from async_engine import AsyncIOEngine, run_independent
+from run_profiler import RunProfiler
+from run_metrics import RunMetrics, STATUS_SUCCESS, STATUS_FAILED, DEFAULT_PUSHGATEWAY_JOB, \
+    export_run_reports
+from output_writers import OutputWriter, CsvOutputWriter, parse_schema
 from global_constant import GlobalConstant
-from google_storage_mgmt import GoogleCloudStorageClient
+from google_storage_mgmt import GoogleCloudStorageClient, StagedPublish
 from transform_inputs import TransformInputs
+from profile_model import ProfileModel, ProfileCache
+from lazy_module import LazyModule
+
+pytz = LazyModule('pytz')
 
 OUTPUT_DIR = '/outputs'
+IO_ENGINE_SYNC = 'sync'
+IO_ENGINE_ASYNCIO = 'asyncio'
+PROFILE_RUN_DIR = 'profiling'
 
 
 def read_args(parser_args: ArgumentParser) -> Namespace:
@@ -22,6 +42,28 @@ def read_args(parser_args: ArgumentParser) -> Namespace:
     optional.add_argument('-clean', '--clean_sheet',
                           default="False",
                           help='Clean sheet after uploading data from google sheets, flag True or False')
+    optional.add_argument('--metrics_json',
+                          help='Write the per stage run report as JSON to this file')
+    optional.add_argument('--metrics_textfile',
+                          help='Write the run metrics in Prometheus text format to this file (node exporter textfile)')
+    optional.add_argument('--metrics_pushgateway',
+                          help='Push the run metrics to this Prometheus pushgateway URL')
+    optional.add_argument('--metrics_job',
+                          default=DEFAULT_PUSHGATEWAY_JOB,
+                          help='Pushgateway job name')
+    optional.add_argument('--replay_cache', action='store_true',
+                          help='Only upload every time slot kept in the export cache of the profile again, e.g. to '
+                               'backfill lost objects, the sheet is not read')
+    optional.add_argument('--profile_run', '--profile-run', nargs='?', const=PROFILE_RUN_DIR,
+                          help='Write cProfile stats, collapsed stack samples and the peak memory of every stage of '
+                               'the run to this directory (default ' + PROFILE_RUN_DIR + ')')
+    optional.add_argument('--io_engine',
+                          default=IO_ENGINE_SYNC, choices=[IO_ENGINE_SYNC, IO_ENGINE_ASYNCIO],
+                          help='Run the API calls one after the other or on an asyncio loop overlapping independent '
+                               'uploads')
+    optional.add_argument('--io_concurrency', type=int,
+                          default=AsyncIOEngine.DEFAULT_MAX_CONCURRENCY,
+                          help='API calls in flight at most with the asyncio engine')
     return parser_args.parse_args()
 
 
@@ -36,6 +78,11 @@ def validate_args(parser: ArgumentParser, arguments: Namespace):
         parser.print_help()
         exit(1)
 
+    if arguments.io_concurrency < 1:
+        logging.error("Please specific --io_concurrency greater than 0")
+        parser.print_help()
+        exit(1)
+
     if not arguments.clean_sheet or arguments.clean_sheet.__str__().lower() in ['false']:
         logging.info("Set clean sheet flag to default -> False")
         arguments.clean_sheet = False
@@ -59,45 +106,59 @@ def create_schema_file(file_name: str, content: str) -> str:
 
 
 class ProfileItem:
+    """One run of a profile: the compiled profile plus the file names and GCS paths of the current time."""
+
+    __slots__ = ('profile_model', 'mode', 'is_clean_sheet', 'file_name', 'file_name_daily', 'schema_file_name',
+                 'schema_file_name_daily', 'gcs_destination_file_path', 'gcs_destination_daily_file_path',
+                 'gcs_destination_schema_path', 'gcs_destination_schema_path_daily', 'sheet_exports')
 
-    def __init__(self, config_path: str, mode: str, is_clean_sheet: bool):
-        profile = yaml.safe_load(open(config_path))
-        input_timezone = profile['timezone']
-        local_time_zone = pytz.timezone(input_timezone)
+    def __init__(self, config_path: str, mode: str, is_clean_sheet: bool, profile_model: ProfileModel = None):
+        # Callers holding the compiled profile, e.g. the scheduler daemon, pass it as profile_model.
+        self.profile_model = profile_model or ProfileCache.shared().load(config_path)
         utc_time = datetime.utcnow()
-        current_time = utc_time.replace(tzinfo=pytz.utc).astimezone(tz=local_time_zone)
-        self.file_name = profile['gsc_file_pattern'] + current_time.strftime(profile['date_time_format']) + '_1' + '.' + \
-                         profile['gsc_file_type']
-        self.file_name_daily = profile['gsc_file_pattern'] + datetime.strftime(current_time - timedelta(1),
-                                                                               profile['date_format']) + '_1' + '.' + \
-                               profile['gsc_file_type']
-        self.credential_scopes = profile['credential_api_scope']
-        self.service_account_file_path = profile['service_account_file_path']
-        self.google_doc_id = profile['google_doc_id']
-        self.google_doc_mime_type = profile['mime_type']
+        current_time = utc_time.replace(tzinfo=pytz.utc).astimezone(tz=self.profile_model.time_zone)
+        for name, value in self.profile_model.path_templates.render(current_time).items():
+            setattr(self, name, value)
         self.mode = mode
-        self.gcs_project = profile['gcs_project']
-        self.gcs_bucket = profile['gcs_bucket_name']
-        self.gcs_destination_file_path = profile['gcs_bucket_destination'] + '/' + current_time.strftime(
-            '%Y') + '/' + current_time.strftime('%m') + '/' + self.file_name
-        self.gcs_destination_daily_file_path = profile['gcs_bucket_destination'] + '/' + current_time.strftime(
-            '%Y') + '/' + self.file_name_daily
-        self.google_sheets_range = profile['goolge_data_range']
-        self.schema_file_name = profile['gsc_file_pattern'] + current_time.strftime(
-            profile['date_time_format']) + '.schema'
-        self.schema_file_name_daily = profile['gsc_file_pattern'] + datetime.strftime(current_time - timedelta(1),
-                                                                                      profile[
-                                                                                          'date_format']) + '.schema'
-        self.schema_file_content = profile['schema_content']
-        self.gcs_destination_schema_path = profile['gcs_bucket_destination'] + '/' + current_time.strftime(
-            '%Y') + '/' + current_time.strftime('%m') + '/' + self.schema_file_name
-        self.gcs_destination_schema_path_daily = profile['gcs_bucket_destination'] + '/' + current_time.strftime(
-            '%Y') + '/' + self.schema_file_name_daily
-        self.google_sheet_id = convert_str_to_int(text=profile['google_sheet_id'])
-        self.google_sheet_timestamp_format = profile['google_sheet_timestamp_format']
         self.is_clean_sheet = is_clean_sheet
-        self.columns_transform_mobile_number = profile['google_sheet_column_transform_mobile_number']
-        self.columns_transform_timestamp = profile['google_sheet_column_transform_timestamp']
+        self.sheet_exports = [SheetExportItem(profile_model=sheet_export_model, current_time=current_time)
+                              for sheet_export_model in self.profile_model.sheet_exports]
+        sheet_ids = [sheet_export.google_sheet_id for sheet_export in self.sheet_exports]
+        if is_clean_sheet and len(set(sheet_ids)) != len(sheet_ids):
+            raise ValueError('Clean sheet needs a different google_sheet_id for every google_sheet_exports entry')
+
+    def __getattr__(self, name: str):
+        # Everything that does not depend on the run time is read from the compiled profile.
+        if name == 'profile_model':
+            raise AttributeError(name)
+        return getattr(self.profile_model, name)
+
+
+class SheetExportItem:
+    """One range/tab of a multi range profile, keys missing in the entry are taken from the profile."""
+
+    __slots__ = ('profile_model', 'file_name', 'file_name_daily', 'schema_file_name', 'schema_file_name_daily',
+                 'gcs_destination_file_path', 'gcs_destination_daily_file_path', 'gcs_destination_schema_path',
+                 'gcs_destination_schema_path_daily')
+
+    def __init__(self, profile_model: ProfileModel, current_time: datetime):
+        self.profile_model = profile_model
+        for name, value in profile_model.path_templates.render(current_time).items():
+            setattr(self, name, value)
+
+    def __getattr__(self, name: str):
+        if name == 'profile_model':
+            raise AttributeError(name)
+        return getattr(self.profile_model, name)
+
+    def create_transform_inputs(self) -> TransformInputs:
+        transform_inputs = TransformInputs()
+        transform_inputs.convert_transform_inputs(mobile_column_inputs=self.columns_transform_mobile_number,
+                                                  timestamp_column_inputs=self.columns_transform_timestamp)
+        transform_inputs.set_column_count(len(parse_schema(self.schema_file_content)) or None)
+        if self.google_sheet_typed_fetch:
+            transform_inputs.set_typed_schema(parse_schema(self.schema_file_content))
+        return transform_inputs
 
 
 def convert_str_to_int(text: str):
@@ -108,88 +169,537 @@ def convert_str_to_int(text: str):
         raise exception
 
 
+def read_profile_dataframes(profile: ProfileItem, drive_mgmt: GoogleDocAPIMGMT, transform_inputs: TransformInputs,
+                            export_stats: SheetExportStats, allow_empty: bool = False):
+    return drive_mgmt.iter_sheets_ranges_dataframes(file_id=profile.google_doc_id,
+                                                    service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                                                    ranges=profile.google_sheets_range,
+                                                    sheet_timestamp=profile.google_sheet_timestamp_format,
+                                                    transform_inputs=transform_inputs, export_stats=export_stats,
+                                                    chunk_rows=profile.google_sheets_chunk_rows,
+                                                    allow_empty=allow_empty)
+
+
+def upload_name(gcs_destination: str, staged_publish: StagedPublish = None) -> str:
+    return staged_publish.staging_name(gcs_destination) if staged_publish is not None else gcs_destination
+
+
+def create_staged_publish(profile: ProfileItem, bucket_name: str, gcs_file_destination: str,
+                          gcs_schema_destination: str) -> StagedPublish:
+    google_storage = GoogleCloudStorageClient(service_account_path=profile.service_account_file_path,
+                                              project=profile.gcs_project)
+    return StagedPublish(google_storage=google_storage, bucket_name=bucket_name,
+                         final_names=[gcs_file_destination, gcs_schema_destination],
+                         staging_prefix=profile.gcs_staging_prefix, success_marker=profile.gcs_success_marker)
+
+
+def create_bigquery_loader(profile: ProfileItem) -> BigQueryLoader:
+    if not profile.bigquery_table and not any(sheet_export.bigquery_table for sheet_export in profile.sheet_exports):
+        return None
+    return GoogleBigQueryLoader(service_account_file=profile.service_account_file_path,
+                                project=profile.bigquery_project or profile.gcs_project)
+
+
+def load_to_bigquery(profile, bigquery_loader: BigQueryLoader, gcs_file_destination: str) -> dict:
+    """Load the uploaded data object of the profile, or of one of its sheet exports, into its bigquery_table."""
+    if bigquery_loader is None or not profile.bigquery_table:
+        return None
+    return bigquery_loader.load(BigQueryLoadRequest(
+        source_uri='gs://' + profile.gcs_bucket + '/' + gcs_file_destination, table_id=profile.bigquery_table,
+        schema=parse_schema(profile.schema_file_content),
+        source_format=OutputWriter.for_format(profile.gcs_output_format).bigquery_source_format,
+        write_disposition=profile.bigquery_write_disposition, partition_type=profile.bigquery_partition_type,
+        partition_field=profile.bigquery_partition_field))
+
+
+def create_export_cache(profile: ProfileItem) -> ExportCache:
+    if not profile.export_cache_dir:
+        return None
+    return ExportCache(cache_dir=profile.export_cache_dir,
+                       max_bytes=profile.export_cache_max_mb and int(profile.export_cache_max_mb * 1024 * 1024),
+                       max_age_seconds=profile.export_cache_max_age_hours and profile.export_cache_max_age_hours * 3600)
+
+
+def export_cache_metadata(profile: ProfileItem, export_stats: SheetExportStats, delete_row_index: int,
+                          gcs_file_destination: str, gcs_schema_destination: str) -> dict:
+    """What the run would do after the upload, so a replay can clean the sheet and move the watermark."""
+    return {'gcs_file_destination': gcs_file_destination, 'gcs_schema_destination': gcs_schema_destination,
+            'row_delete_index': delete_row_index, 'row_count': export_stats.row_count,
+            'is_clean_sheet': bool(profile.is_clean_sheet), 'clean_sheet_verified': bool(profile.clean_sheet_verified),
+            'watermark': export_stats.watermark.to_dict() if profile.incremental and export_stats.watermark else None,
+            'row_fingerprints': export_stats.row_fingerprints.to_dict()
+            if export_stats.row_fingerprints is not None else None}
+
+
+def replay_cached_exports(profile_item: ProfileItem, export_cache: ExportCache, replay_all: bool = False,
+                          bigquery_loader: BigQueryLoader = None) -> int:
+    """Upload the cached time slots of the profile whose upload failed, returns the number of replayed slots.
+
+    replay_all uploads every cached slot again, e.g. to backfill lost objects. The rows of a slot that never was
+    uploaded are cleaned and its watermark is saved as its own run would have done.
+    """
+    entries = export_cache.entries(ExportCache.profile_key(profile_item.profile_path), pending_only=not replay_all)
+    for entry in entries:
+        metadata = entry.metadata
+        logging.info('Replay cached export ' + metadata['slot_name'])
+        staged_publish = None
+        if profile_item.gcs_staged_publish:
+            staged_publish = create_staged_publish(profile_item, entry.objects[0]['bucket'],
+                                                   metadata['gcs_file_destination'], metadata['gcs_schema_destination'])
+        try:
+            if staged_publish is None or not staged_publish.is_published():
+                google_storage = GoogleCloudStorageClient(service_account_path=profile_item.service_account_file_path,
+                                                          project=profile_item.gcs_project)
+                export_cache.replay(entry, google_storage,
+                                    upload_name=lambda name: upload_name(name, staged_publish))
+                if staged_publish is not None:
+                    staged_publish.promote()
+        finally:
+            if staged_publish is not None:
+                staged_publish.discard()
+        was_pending = entry.is_pending
+        if was_pending:
+            load_to_bigquery(profile_item, bigquery_loader, metadata['gcs_file_destination'])
+        export_cache.mark_uploaded(entry)
+        if was_pending:
+            finish_replayed_export(profile_item, metadata)
+    return len(entries)
+
+
+def finish_replayed_export(profile_item: ProfileItem, metadata: dict):
+    export_state_store = None
+    if profile_item.incremental and metadata.get('watermark'):
+        export_state_store = ExportStateStore(state_path=profile_item.export_state_path,
+                                              service_account_file=profile_item.service_account_file_path,
+                                              project=profile_item.gcs_project)
+        with RunMetrics.current().stage('state'):
+            export_state_store.save_watermark(google_doc_id=profile_item.google_doc_id,
+                                              google_sheet_id=profile_item.google_sheet_id,
+                                              watermark=SheetWatermark.from_dict(metadata['watermark']))
+    if metadata['is_clean_sheet'] and metadata['clean_sheet_verified']:
+        delete_verified_rows_google_sheets(profile_item=profile_item, sheet_id=profile_item.google_sheet_id,
+                                           row_fingerprints=SheetRowFingerprints.from_dict(
+                                               metadata['row_fingerprints']))
+    elif metadata['is_clean_sheet']:
+        deleted_rows_google_sheets(profile_item=profile_item, delete_index_end=metadata['row_delete_index'])
+        if export_state_store is not None:
+            export_state_store.save_watermark(google_doc_id=profile_item.google_doc_id,
+                                              google_sheet_id=profile_item.google_sheet_id, watermark=None)
+
+
 def extract_data_to_gcs(profile: ProfileItem, drive_mgmt: GoogleDocAPIMGMT, output_file_path: str,
-                        schema_file_path: str, gcs_file_destination: str, gcs_schema_destination: str, transform_inputs: TransformInputs):
-    download_file, delete_row_index = drive_mgmt.download_sheets_ranges_csv(file_id=profile.google_doc_id,
-                                                          service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
-                                                          ranges=profile.google_sheets_range,
-                                                          output_path=output_file_path,
-                                                          sheet_timestamp=profile.google_sheet_timestamp_format, transform_inputs=transform_inputs)
+                        schema_file_path: str, gcs_file_destination: str, gcs_schema_destination: str, transform_inputs: TransformInputs,
+                        export_stats: SheetExportStats = None, chunks: [] = None,
+                        staged_publish: StagedPublish = None, export_cache: ExportCache = None,
+                        bigquery_loader: BigQueryLoader = None):
+    """chunks holds the already read DataFrames when the caller had to look at the data first, with staged_publish
+    the objects are uploaded under its staging prefix and promoted once both are complete. With export_cache the
+    files are cached before the upload, a failed upload is replayed from the cache by the next run."""
+    export_stats = export_stats if export_stats is not None else SheetExportStats()
+    output_writer = OutputWriter.for_format(profile.gcs_output_format)
+    if chunks is None and output_writer.format_name == CsvOutputWriter.format_name:
+        download_file, delete_row_index = drive_mgmt.download_sheets_ranges_csv(file_id=profile.google_doc_id,
+                                                              service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                                                              ranges=profile.google_sheets_range,
+                                                              output_path=output_file_path,
+                                                              sheet_timestamp=profile.google_sheet_timestamp_format, transform_inputs=transform_inputs,
+                                                              chunk_rows=profile.google_sheets_chunk_rows,
+                                                              export_stats=export_stats)
+    else:
+        if chunks is None:
+            chunks = read_profile_dataframes(profile=profile, drive_mgmt=drive_mgmt,
+                                             transform_inputs=transform_inputs, export_stats=export_stats)
+        download_file = output_writer.write(chunks, schema=parse_schema(profile.schema_file_content),
+                                            output_path=output_file_path)
+        delete_row_index = export_stats.deleted_row_index_end()
+    if export_stats.incremental and export_stats.row_count == 0:
+        logging.info('No new rows to export for ' + profile.google_doc_id)
+        return delete_row_index
+
+    cache_entry = None
+    if export_cache is not None:
+        with RunMetrics.current().stage('cache'):
+            cache_entry = export_cache.store(
+                profile_key=ExportCache.profile_key(profile.profile_path), slot_name=gcs_file_destination,
+                uploads=[{'bucket': profile.gcs_bucket, 'name': gcs_schema_destination, 'local_path': schema_file_path,
+                          'content_type': 'Application/json'},
+                         {'bucket': profile.gcs_bucket, 'name': gcs_file_destination, 'local_path': download_file,
+                          'content_type': output_writer.content_type or profile.google_doc_mime_type,
+                          'content_encoding': output_writer.content_encoding}],
+                metadata=export_cache_metadata(profile, export_stats, delete_row_index, gcs_file_destination,
+                                               gcs_schema_destination))
 
     google_storage = GoogleCloudStorageClient(service_account_path=profile.service_account_file_path,
                                               project=profile.gcs_project)
-    google_storage.upload_file_to_gcs(bucket_name=profile.gcs_bucket,
-                                      gcs_file_name=gcs_schema_destination,
-                                      local_file_path=schema_file_path,
-                                      content_type='Application/json')
-    google_storage.upload_file_to_gcs(bucket_name=profile.gcs_bucket,
-                                      gcs_file_name=gcs_file_destination,
-                                      local_file_path=download_file,
-                                      content_type=profile.google_doc_mime_type)
+    run_independent([functools.partial(google_storage.upload_file_to_gcs, bucket_name=profile.gcs_bucket,
+                                       gcs_file_name=upload_name(gcs_schema_destination, staged_publish),
+                                       local_file_path=schema_file_path, content_type='Application/json'),
+                     functools.partial(google_storage.upload_file_to_gcs, bucket_name=profile.gcs_bucket,
+                                       gcs_file_name=upload_name(gcs_file_destination, staged_publish),
+                                       local_file_path=download_file,
+                                       content_type=output_writer.content_type or profile.google_doc_mime_type,
+                                       content_encoding=output_writer.content_encoding)])
+    if staged_publish is not None:
+        staged_publish.promote()
+    load_to_bigquery(profile, bigquery_loader, gcs_file_destination)
+    if cache_entry is not None:
+        with RunMetrics.current().stage('cache'):
+            export_cache.mark_uploaded(cache_entry)
     return delete_row_index
 
 
+def extract_data_to_gcs_in_memory(profile: ProfileItem, drive_mgmt: GoogleDocAPIMGMT, gcs_file_destination: str,
+                                  gcs_schema_destination: str, transform_inputs: TransformInputs,
+                                  export_stats: SheetExportStats = None, chunks: [] = None,
+                                  staged_publish: StagedPublish = None, bigquery_loader: BigQueryLoader = None):
+    export_stats = export_stats if export_stats is not None else SheetExportStats()
+    output_writer = OutputWriter.for_format(profile.gcs_output_format)
+    if chunks is None:
+        chunks = read_profile_dataframes(profile=profile, drive_mgmt=drive_mgmt, transform_inputs=transform_inputs,
+                                         export_stats=export_stats)
+    output_parts = output_writer.serialize_chunks(chunks, schema=parse_schema(profile.schema_file_content))
+    if export_stats.incremental:
+        # Pull the first part before uploading anything, an empty delta must not create empty objects.
+        first_part = next(output_parts, None)
+        if first_part is None:
+            logging.info('No new rows to export for ' + profile.google_doc_id)
+            return export_stats.deleted_row_index_end(), 0
+        output_parts = itertools.chain([first_part], output_parts)
+
+    google_storage = GoogleCloudStorageClient(service_account_path=profile.service_account_file_path,
+                                              project=profile.gcs_project)
+    _, output_bytes = run_independent([
+        functools.partial(google_storage.upload_data_to_gcs, bucket_name=profile.gcs_bucket,
+                          gcs_file_name=upload_name(gcs_schema_destination, staged_publish),
+                          data=profile.schema_file_content, content_type='Application/json'),
+        functools.partial(google_storage.upload_data_to_gcs, bucket_name=profile.gcs_bucket,
+                          gcs_file_name=upload_name(gcs_file_destination, staged_publish), data=output_parts,
+                          content_type=output_writer.content_type or profile.google_doc_mime_type,
+                          content_encoding=output_writer.content_encoding)])
+    if staged_publish is not None:
+        staged_publish.promote()
+    load_to_bigquery(profile, bigquery_loader, gcs_file_destination)
+    return export_stats.deleted_row_index_end(), output_bytes
+
+
+def sheet_export_destinations(profile: ProfileItem, sheet_export: SheetExportItem) -> (str, str):
+    if profile.mode == GlobalConstant.MODE_DAILY:
+        return sheet_export.gcs_destination_daily_file_path, sheet_export.gcs_destination_schema_path_daily
+    return sheet_export.gcs_destination_file_path, sheet_export.gcs_destination_schema_path
+
+
+def create_sheet_export_staged_publishes(profile: ProfileItem) -> []:
+    return [create_staged_publish(profile, sheet_export.gcs_bucket, *sheet_export_destinations(profile, sheet_export))
+            for sheet_export in profile.sheet_exports]
+
+
+def extract_sheet_exports_to_gcs(profile: ProfileItem, drive_mgmt: GoogleDocAPIMGMT, workers: int = 4,
+                                 staged_publishes: [] = None, export_stats_list: [] = None,
+                                 bigquery_loader: BigQueryLoader = None):
+    """staged_publishes holds one StagedPublish per sheet export when the profile publishes through staging,
+    export_stats_list one SheetExportStats per sheet export tracking the read rows."""
+    sheet_exports = profile.sheet_exports
+    staged_publishes = staged_publishes or [None] * len(sheet_exports)
+    export_results = drive_mgmt.fetch_sheets_multi_ranges_dataframes(
+        file_id=profile.google_doc_id, service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+        range_specs=[(sheet_export.google_sheets_range, sheet_export.google_sheet_timestamp_format,
+                      sheet_export.create_transform_inputs()) for sheet_export in sheet_exports],
+        workers=workers, export_stats_list=export_stats_list)
+    google_storage = GoogleCloudStorageClient(service_account_path=profile.service_account_file_path,
+                                              project=profile.gcs_project)
+
+    def upload_sheet_export(sheet_export: SheetExportItem, data, staged_publish: StagedPublish):
+        gcs_file_destination, gcs_schema_destination = sheet_export_destinations(profile, sheet_export)
+        if data.empty:
+            logging.info('Skip upload of ' + gcs_file_destination + ', no rows in ' + sheet_export.google_sheets_range)
+            return 0
+        output_writer = OutputWriter.for_format(sheet_export.gcs_output_format)
+        output_data = output_writer.serialize(data, schema=parse_schema(sheet_export.schema_file_content))
+        _, output_bytes = run_independent([
+            functools.partial(google_storage.upload_data_to_gcs, bucket_name=sheet_export.gcs_bucket,
+                              gcs_file_name=upload_name(gcs_schema_destination, staged_publish),
+                              data=sheet_export.schema_file_content, content_type='Application/json'),
+            functools.partial(google_storage.upload_data_to_gcs, bucket_name=sheet_export.gcs_bucket,
+                              gcs_file_name=upload_name(gcs_file_destination, staged_publish), data=output_data,
+                              content_type=output_writer.content_type or profile.google_doc_mime_type,
+                              content_encoding=output_writer.content_encoding)])
+        if staged_publish is not None:
+            staged_publish.promote()
+        load_to_bigquery(sheet_export, bigquery_loader, gcs_file_destination)
+        return output_bytes
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(RunMetrics.current().bind(upload_sheet_export), sheet_export, data, staged_publish)
+                   for sheet_export, (data, _), staged_publish in zip(sheet_exports, export_results,
+                                                                      staged_publishes)]
+        output_bytes = sum(future.result() for future in futures)
+    return [delete_row_index for _, delete_row_index in export_results], output_bytes
+
+
 def clean_google_sheets(profile_item: ProfileItem):
     drive_management = GoogleDocAPIMGMT(scopes=profile_item.credential_scopes,
                                         service_account_file=profile_item.service_account_file_path)
     drive_management.clean_sheets_file(file_id=profile_item.google_doc_id,
                                        service_type=GlobalConstant.GOOGLE_SHEETS_TYPE)
 
+def create_export_stats(profile_item: ProfileItem, ranges: str, transform_inputs: TransformInputs) -> SheetExportStats:
+    if profile_item.is_clean_sheet and profile_item.clean_sheet_verified:
+        return SheetExportStats(row_fingerprints=SheetRowFingerprints(
+            ranges, render_options=GoogleDocAPIMGMT.value_render_options(transform_inputs)))
+    return SheetExportStats()
+
+
+def delete_verified_rows_google_sheets(profile_item: ProfileItem, sheet_id, row_fingerprints: SheetRowFingerprints):
+    drive_management = GoogleDocAPIMGMT(scopes=profile_item.credential_scopes,
+                                        service_account_file=profile_item.service_account_file_path)
+    drive_management.delete_verified_rows(file_id=profile_item.google_doc_id,
+                                          service_type=GlobalConstant.GOOGLE_SHEETS_TYPE, sheet_id=sheet_id,
+                                          row_fingerprints=row_fingerprints)
+
+
 def deleted_rows_google_sheets(profile_item : ProfileItem, delete_index_end : int):
     drive_management = GoogleDocAPIMGMT(scopes=profile_item.credential_scopes,
                                         service_account_file=profile_item.service_account_file_path)
     drive_management.delete_sheets_rows_by_index(file_id=profile_item.google_doc_id,
                                        service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,sheet_id=profile_item.google_sheet_id , end_index=delete_index_end)
 
-def main():
-    parser = ArgumentParser()
-    args = read_args(parser)
-    validate_args(parser=parser, arguments=args)
-    profile_item = ProfileItem(config_path=args.profile, mode=args.mode, is_clean_sheet=args.clean_sheet)
+class ExportResult:
+
+    def __init__(self, row_count: int = 0, output_bytes: int = 0):
+        self.row_count = row_count
+        self.output_bytes = output_bytes
+        self.skipped = False
+        self.metrics = None
+
+
+def run_profile(profile_item: ProfileItem, run_metrics: RunMetrics = None) -> ExportResult:
+    """Export one profile while recording its stage timings, export_result.metrics holds the run report."""
+    run_metrics = run_metrics if run_metrics is not None else RunMetrics(labels={'mode': profile_item.mode})
+    with run_metrics.activate():
+        try:
+            export_result = export_profile(profile_item=profile_item)
+        except BaseException:
+            run_metrics.finish(status=STATUS_FAILED)
+            raise
+    run_metrics.finish(status=STATUS_SUCCESS)
+    logging.info('Run stages : ' + run_metrics.summary())
+    export_result.metrics = run_metrics.to_dict()
+    return export_result
+
+
+def replay_profile_cache(profile_item: ProfileItem, export_cache: ExportCache, run_metrics: RunMetrics) -> int:
+    with run_metrics.activate():
+        try:
+            replayed = replay_cached_exports(profile_item=profile_item, export_cache=export_cache, replay_all=True,
+                                             bigquery_loader=create_bigquery_loader(profile_item))
+        except BaseException:
+            run_metrics.finish(status=STATUS_FAILED)
+            raise
+    run_metrics.finish(status=STATUS_SUCCESS)
+    logging.info('Replayed ' + str(replayed) + ' cached exports, stages : ' + run_metrics.summary())
+    return replayed
+
+
+def export_profile(profile_item: ProfileItem) -> ExportResult:
     transform_inputs = TransformInputs()
     transform_inputs.convert_transform_inputs(mobile_column_inputs=profile_item.columns_transform_mobile_number,
                                               timestamp_column_inputs=profile_item.columns_transform_timestamp)
-    output_path = create_output_folder()
+    transform_inputs.set_column_count(len(parse_schema(profile_item.schema_file_content)) or None)
+    if profile_item.google_sheet_typed_fetch:
+        transform_inputs.set_typed_schema(parse_schema(profile_item.schema_file_content))
     local_output_path = ''
     local_schema_file_path = ''
     row_delete_index = 0
+    export_result = ExportResult()
+    export_state_store = None
+    export_stats = create_export_stats(profile_item, profile_item.google_sheets_range, transform_inputs)
+    staged_publishes = []
+    export_cache = create_export_cache(profile_item)
+    bigquery_loader = create_bigquery_loader(profile_item)
 
     try:
+        if export_cache is not None:
+            # Before the watermark is read, a replayed slot moves it.
+            replay_cached_exports(profile_item=profile_item, export_cache=export_cache,
+                                  bigquery_loader=bigquery_loader)
+        if profile_item.incremental:
+            export_state_store = ExportStateStore(state_path=profile_item.export_state_path,
+                                                  service_account_file=profile_item.service_account_file_path,
+                                                  project=profile_item.gcs_project)
+            with RunMetrics.current().stage('state'):
+                export_stats = SheetExportStats(watermark=export_state_store.load_watermark(
+                    google_doc_id=profile_item.google_doc_id, google_sheet_id=profile_item.google_sheet_id))
         drive_management = GoogleDocAPIMGMT(scopes=profile_item.credential_scopes,
-                                            service_account_file=profile_item.service_account_file_path)
+                                            service_account_file=profile_item.service_account_file_path,
+                                            download_chunk_size=profile_item.google_drive_download_chunk_mb and
+                                            int(profile_item.google_drive_download_chunk_mb * 1024 * 1024))
         if profile_item.mode == GlobalConstant.MODE_DAILY:
-            local_output_path = output_path + '/' + profile_item.file_name_daily
-            local_schema_file_path = output_path + '/' + profile_item.schema_file_name_daily
-            create_schema_file(file_name=local_schema_file_path,
-                               content=profile_item.schema_file_content)
-            row_delete_index = extract_data_to_gcs(profile=profile_item, drive_mgmt=drive_management, output_file_path=local_output_path,
-                                schema_file_path=local_schema_file_path,
-                                gcs_file_destination=profile_item.gcs_destination_daily_file_path,
-                                gcs_schema_destination=profile_item.gcs_destination_schema_path_daily, transform_inputs=transform_inputs)
+            file_name = profile_item.file_name_daily
+            schema_file_name = profile_item.schema_file_name_daily
+            gcs_file_destination = profile_item.gcs_destination_daily_file_path
+            gcs_schema_destination = profile_item.gcs_destination_schema_path_daily
         elif profile_item.mode == GlobalConstant.MODE_HOURLY:
-            local_output_path = output_path + '/' + profile_item.file_name
-            local_schema_file_path = output_path + '/' + profile_item.schema_file_name
+            file_name = profile_item.file_name
+            schema_file_name = profile_item.schema_file_name
+            gcs_file_destination = profile_item.gcs_destination_file_path
+            gcs_schema_destination = profile_item.gcs_destination_schema_path
+        else:
+            logging.error('Invalid mode input')
+            raise Exception("Please use only daily or hourly mode.")
+
+        if profile_item.gcs_staged_publish:
+            if profile_item.sheet_exports:
+                staged_publishes = create_sheet_export_staged_publishes(profile_item)
+            else:
+                staged_publishes = [create_staged_publish(profile_item, profile_item.gcs_bucket, gcs_file_destination,
+                                                          gcs_schema_destination)]
+            with RunMetrics.current().stage('publish'):
+                is_published = all(staged_publish.is_published() for staged_publish in staged_publishes)
+            if is_published:
+                # Rows of a published slot are not cleaned again, the run that published them cleaned them or failed
+                # before, in which case they are exported with the next slot.
+                logging.info('Skip ' + profile_item.google_doc_id + ', time slot already published')
+                export_result.skipped = True
+                return export_result
+
+        change_detector = None
+        prefetched_chunks = None
+        if profile_item.skip_unchanged:
+            change_detector = ChangeDetector(export_state_store=ExportStateStore(
+                state_path=profile_item.export_state_path, service_account_file=profile_item.service_account_file_path,
+                project=profile_item.gcs_project), drive_mgmt=drive_management,
+                google_doc_id=profile_item.google_doc_id, google_sheet_id=profile_item.google_sheet_id,
+                state_key=ChangeDetector.create_state_key(profile_item.profile_path, profile_item.mode))
+            if change_detector.is_revision_unchanged():
+                logging.info('Skip ' + profile_item.google_doc_id + ', Drive revision unchanged : ' +
+                             str(change_detector.revision))
+                export_result.skipped = True
+                return export_result
+            if not profile_item.incremental and not profile_item.sheet_exports:
+                # A cleaned sheet is empty until new rows arrive, its content matches the state saved by the clean.
+                prefetched_chunks = list(read_profile_dataframes(profile=profile_item, drive_mgmt=drive_management,
+                                                                 transform_inputs=transform_inputs,
+                                                                 export_stats=export_stats, allow_empty=True))
+                with RunMetrics.current().stage('change_check'):
+                    is_content_unchanged = change_detector.is_content_unchanged(prefetched_chunks)
+                if is_content_unchanged:
+                    logging.info('Skip ' + profile_item.google_doc_id + ', content unchanged since the last export')
+                    change_detector.save()
+                    export_result.skipped = True
+                    return export_result
+                if not prefetched_chunks:
+                    logging.error('No Data found in range :' + profile_item.google_sheets_range)
+                    exit(2)
+
+        if profile_item.sheet_exports:
+            export_state_store = None
+            export_stats_list = [create_export_stats(profile_item, sheet_export.google_sheets_range,
+                                                     sheet_export.create_transform_inputs())
+                                 for sheet_export in profile_item.sheet_exports]
+            row_delete_indices, export_result.output_bytes = extract_sheet_exports_to_gcs(
+                profile=profile_item, drive_mgmt=drive_management, staged_publishes=staged_publishes,
+                export_stats_list=export_stats_list, bigquery_loader=bigquery_loader)
+            export_result.row_count = sum(index - GoogleDocAPIMGMT.DELETE_ROW_INDEX_START
+                                          for index in row_delete_indices)
+            if profile_item.is_clean_sheet:
+                for sheet_export, delete_index_end, sheet_export_stats in zip(profile_item.sheet_exports,
+                                                                              row_delete_indices, export_stats_list):
+                    if profile_item.clean_sheet_verified:
+                        drive_management.delete_verified_rows(file_id=profile_item.google_doc_id,
+                                                              service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                                                              sheet_id=sheet_export.google_sheet_id,
+                                                              row_fingerprints=sheet_export_stats.row_fingerprints)
+                        continue
+                    drive_management.delete_sheets_rows_by_index(file_id=profile_item.google_doc_id,
+                                                                 service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                                                                 sheet_id=sheet_export.google_sheet_id,
+                                                                 end_index=delete_index_end)
+            if change_detector is not None:
+                change_detector.save(is_sheet_cleaned=profile_item.is_clean_sheet)
+            return export_result
+        elif profile_item.gcs_upload_mode == GlobalConstant.UPLOAD_MODE_MEMORY:
+            row_delete_index, export_result.output_bytes = extract_data_to_gcs_in_memory(
+                profile=profile_item, drive_mgmt=drive_management, gcs_file_destination=gcs_file_destination,
+                gcs_schema_destination=gcs_schema_destination, transform_inputs=transform_inputs,
+                export_stats=export_stats, chunks=prefetched_chunks,
+                staged_publish=staged_publishes[0] if staged_publishes else None, bigquery_loader=bigquery_loader)
+        else:
+            output_path = create_output_folder()
+            local_output_path = output_path + '/' + file_name
+            local_schema_file_path = output_path + '/' + schema_file_name
             create_schema_file(file_name=local_schema_file_path,
                                content=profile_item.schema_file_content)
             row_delete_index = extract_data_to_gcs(profile=profile_item, drive_mgmt=drive_management, output_file_path=local_output_path,
                                 schema_file_path=local_schema_file_path,
-                                gcs_file_destination=profile_item.gcs_destination_file_path,
-                                gcs_schema_destination=profile_item.gcs_destination_schema_path, transform_inputs=transform_inputs)
+                                gcs_file_destination=gcs_file_destination,
+                                gcs_schema_destination=gcs_schema_destination, transform_inputs=transform_inputs,
+                                export_stats=export_stats, chunks=prefetched_chunks,
+                                staged_publish=staged_publishes[0] if staged_publishes else None,
+                                export_cache=export_cache, bigquery_loader=bigquery_loader)
+            if os.path.exists(local_output_path):
+                export_result.output_bytes = os.path.getsize(local_output_path)
+
+        if export_state_store is not None:
+            export_result.row_count = export_stats.row_count
+            with RunMetrics.current().stage('state'):
+                export_state_store.save_watermark(google_doc_id=profile_item.google_doc_id,
+                                                  google_sheet_id=profile_item.google_sheet_id,
+                                                  watermark=export_stats.watermark)
         else:
-            logging.error('Invalid mode input')
-            raise Exception("Please use only daily or hourly mode.")
+            export_result.row_count = row_delete_index - GoogleDocAPIMGMT.DELETE_ROW_INDEX_START
 
-        if profile_item.is_clean_sheet:
+        if profile_item.is_clean_sheet and profile_item.clean_sheet_verified:
+            delete_verified_rows_google_sheets(profile_item=profile_item, sheet_id=profile_item.google_sheet_id,
+                                               row_fingerprints=export_stats.row_fingerprints)
+        elif profile_item.is_clean_sheet:
             deleted_rows_google_sheets(profile_item=profile_item, delete_index_end=row_delete_index)
+            if export_state_store is not None:
+                export_state_store.save_watermark(google_doc_id=profile_item.google_doc_id,
+                                                  google_sheet_id=profile_item.google_sheet_id, watermark=None)
+        if change_detector is not None:
+            with RunMetrics.current().stage('state'):
+                change_detector.save(is_sheet_cleaned=profile_item.is_clean_sheet)
 
     except Exception as exception:
         logging.error('Error occurs at :' + str(exception))
         raise exception
     finally:
+        for staged_publish in staged_publishes:
+            staged_publish.discard()
         if os.path.exists(local_output_path):
             os.remove(local_output_path)
         if os.path.exists(local_schema_file_path):
             os.remove(local_schema_file_path)
+    return export_result
+
+
+def main():
+    parser = ArgumentParser()
+    args = read_args(parser)
+    validate_args(parser=parser, arguments=args)
+    run_metrics = RunMetrics(name=args.profile, labels={'mode': args.mode})
+    try:
+        profile_item = ProfileItem(config_path=args.profile, mode=args.mode, is_clean_sheet=args.clean_sheet)
+        if args.replay_cache:
+            export_cache = create_export_cache(profile_item)
+            if export_cache is None:
+                logging.error('Please set export_cache_dir in the profile to replay its cached exports')
+                exit(1)
+            replay_profile_cache(profile_item=profile_item, export_cache=export_cache, run_metrics=run_metrics)
+            return
+        run_profiler = RunProfiler(output_dir=args.profile_run, name=RunProfiler.run_name(args.profile)) \
+            if args.profile_run else None
+        with run_profiler.profile(run_metrics) if run_profiler is not None else nullcontext():
+            if args.io_engine == IO_ENGINE_ASYNCIO:
+                with AsyncIOEngine(max_concurrency=args.io_concurrency).activate():
+                    run_profile(profile_item=profile_item, run_metrics=run_metrics)
+            else:
+                run_profile(profile_item=profile_item, run_metrics=run_metrics)
+    finally:
+        logging.info('API calls : ' + ApiRateLimiter.shared().stats.summary())
+        export_run_reports([run_metrics.to_dict()], json_path=args.metrics_json,
+                           textfile_path=args.metrics_textfile, pushgateway_url=args.metrics_pushgateway,
+                           pushgateway_job=args.metrics_job)
 
 
 if __name__ == '__main__':
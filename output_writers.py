@@ -0,0 +1,223 @@
+from __future__ import annotations
+import gzip
+import io
+import json
+import logging
+from lazy_module import LazyModule
+from run_metrics import RunMetrics
+
+pandas = LazyModule('pandas')
+
+BQ_STRING_TYPES = ['STRING', 'BYTES']
+BQ_INTEGER_TYPES = ['INTEGER', 'INT64']
+BQ_FLOAT_TYPES = ['FLOAT', 'FLOAT64', 'NUMERIC']
+BQ_BOOLEAN_TYPES = ['BOOLEAN', 'BOOL']
+BQ_TIMESTAMP_TYPES = ['TIMESTAMP', 'DATETIME']
+BQ_DATE_TYPES = ['DATE']
+BOOLEAN_VALUES = {'true': True, 'false': False, '1': True, '0': False, 'yes': True, 'no': False}
+
+
+def parse_schema(schema_content) -> []:
+    """BigQuery schema fields from the profile schema_content, a JSON string or an already parsed list."""
+    if isinstance(schema_content, str):
+        schema_content = json.loads(schema_content)
+    if isinstance(schema_content, dict):
+        schema_content = schema_content.get('fields', [])
+    return list(schema_content or [])
+
+
+def apply_schema_types(data: pandas.DataFrame, schema: []) -> pandas.DataFrame:
+    """Name the sheet columns after the schema fields (by position) and cast them to the field types."""
+    if data.shape[1] > len(schema):
+        raise ValueError('Data has ' + str(data.shape[1]) + ' columns but schema_content only describes ' +
+                         str(len(schema)))
+    typed = pandas.DataFrame(index=data.index)
+    for position, field in enumerate(schema):
+        values = data.iloc[:, position] if position < data.shape[1] else pandas.Series(None, index=data.index,
+                                                                                         dtype=object)
+        typed[field['name']] = cast_series(values, str(field.get('type', 'STRING')).upper())
+    return typed
+
+
+def cast_series(values: pandas.Series, field_type: str) -> pandas.Series:
+    if field_type in BQ_INTEGER_TYPES:
+        numbers = pandas.to_numeric(values, errors='coerce')
+        if hasattr(pandas, 'Int64Dtype'):
+            return numbers.round().astype('Int64')
+        return numbers
+    if field_type in BQ_FLOAT_TYPES:
+        return pandas.to_numeric(values, errors='coerce')
+    if field_type in BQ_BOOLEAN_TYPES:
+        return values.map(lambda value: BOOLEAN_VALUES.get(str(value).strip().lower()))
+    if field_type in BQ_TIMESTAMP_TYPES:
+        return pandas.to_datetime(values, errors='coerce')
+    if field_type in BQ_DATE_TYPES:
+        return pandas.to_datetime(values, errors='coerce').dt.date
+    return values.astype(object).where(values.notnull(), None)
+
+
+class OutputWriter:
+    """Serializes transformed sheet DataFrames into the bytes uploaded to GCS."""
+
+    format_name = None
+    # None keeps the profile mime_type, as the CSV export always did.
+    content_type = None
+    content_encoding = None
+    # sourceFormat of a BigQuery load job reading the uploaded object.
+    bigquery_source_format = None
+    # Formats that cannot be appended to are serialized once, after all chunks have been read.
+    supports_chunks = True
+
+    _writers = {}
+
+    @staticmethod
+    def register(writer_class):
+        OutputWriter._writers[writer_class.format_name] = writer_class
+        return writer_class
+
+    @staticmethod
+    def for_format(format_name: str):
+        format_name = (format_name or CsvOutputWriter.format_name).lower()
+        if format_name not in OutputWriter._writers:
+            raise ValueError('Output format does not match : ' + format_name + ', use one of ' +
+                             ', '.join(sorted(OutputWriter._writers)))
+        return OutputWriter._writers[format_name]()
+
+    def serialize(self, data: pandas.DataFrame, schema: [], header: bool = True) -> bytes:
+        raise NotImplementedError
+
+    def serialize_chunks(self, chunks, schema: []):
+        if not self.supports_chunks:
+            frames = list(chunks)
+            if frames:
+                logging.info('Format ' + self.format_name + ' is written once, holding ' + str(len(frames)) +
+                             ' chunks in memory')
+                yield self.serialize_timed(pandas.concat(frames), schema)
+            return
+        is_first = True
+        for data in chunks:
+            yield self.serialize_timed(data, schema, header=is_first)
+            is_first = False
+
+    def serialize_timed(self, data: pandas.DataFrame, schema: [], header: bool = True) -> bytes:
+        with RunMetrics.current().stage('serialize'):
+            part = self.serialize(data, schema, header=header)
+        RunMetrics.current().record('serialize', rows=data.shape[0], bytes=len(part))
+        return part
+
+    def write(self, chunks, schema: [], output_path: str) -> str:
+        with open(output_path, 'wb') as file_obj:
+            for part in self.serialize_chunks(chunks, schema):
+                file_obj.write(part)
+        return output_path
+
+
+@OutputWriter.register
+class CsvOutputWriter(OutputWriter):
+
+    format_name = 'csv'
+    bigquery_source_format = 'CSV'
+
+    def serialize(self, data: pandas.DataFrame, schema: [], header: bool = True) -> bytes:
+        return data.to_csv(index=False, header=header).encode('utf-8')
+
+
+@OutputWriter.register
+class GzipCsvOutputWriter(CsvOutputWriter):
+
+    format_name = 'csv_gzip'
+    content_type = 'text/csv'
+    content_encoding = 'gzip'
+
+    def serialize(self, data: pandas.DataFrame, schema: [], header: bool = True) -> bytes:
+        # Concatenated gzip members are a valid gzip stream, so chunks can be compressed one by one.
+        return gzip.compress(CsvOutputWriter.serialize(self, data, schema, header=header))
+
+
+@OutputWriter.register
+class NdjsonOutputWriter(OutputWriter):
+
+    format_name = 'ndjson'
+    content_type = 'application/x-ndjson'
+    bigquery_source_format = 'NEWLINE_DELIMITED_JSON'
+
+    def serialize(self, data: pandas.DataFrame, schema: [], header: bool = True) -> bytes:
+        typed = apply_schema_types(data, schema)
+        lines = []
+        for record in typed.astype(object).where(typed.notnull(), None).to_dict(orient='records'):
+            lines.append(json.dumps(record, default=NdjsonOutputWriter.to_json_value, ensure_ascii=False))
+        return ''.join(line + '\n' for line in lines).encode('utf-8')
+
+    @staticmethod
+    def to_json_value(value):
+        if isinstance(value, pandas.Timestamp):
+            return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if hasattr(value, 'item'):
+            return value.item()
+        return str(value)
+
+
+@OutputWriter.register
+class ParquetOutputWriter(OutputWriter):
+
+    format_name = 'parquet'
+    content_type = 'application/vnd.apache.parquet'
+    bigquery_source_format = 'PARQUET'
+    supports_chunks = False
+
+    def serialize(self, data: pandas.DataFrame, schema: [], header: bool = True) -> bytes:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Output format parquet needs pyarrow, please pip install pyarrow')
+        table = pyarrow.Table.from_pandas(apply_schema_types(data, schema), preserve_index=False)
+        buffer = pyarrow.BufferOutputStream()
+        pyarrow.parquet.write_table(table, buffer, compression='snappy')
+        return buffer.getvalue().to_pybytes()
+
+
+@OutputWriter.register
+class AvroOutputWriter(OutputWriter):
+
+    format_name = 'avro'
+    content_type = 'avro/binary'
+    bigquery_source_format = 'AVRO'
+    supports_chunks = False
+    AVRO_TYPES = {
+        'INTEGER': 'long', 'INT64': 'long', 'FLOAT': 'double', 'FLOAT64': 'double', 'NUMERIC': 'double',
+        'BOOLEAN': 'boolean', 'BOOL': 'boolean', 'BYTES': 'bytes',
+        'TIMESTAMP': {'type': 'long', 'logicalType': 'timestamp-micros'},
+        'DATETIME': {'type': 'long', 'logicalType': 'timestamp-micros'},
+        'DATE': {'type': 'int', 'logicalType': 'date'},
+    }
+
+    @staticmethod
+    def create_avro_schema(schema: []) -> dict:
+        fields = []
+        for field in schema:
+            avro_type = AvroOutputWriter.AVRO_TYPES.get(str(field.get('type', 'STRING')).upper(), 'string')
+            if str(field.get('mode', 'NULLABLE')).upper() != 'REQUIRED':
+                avro_type = ['null', avro_type]
+            fields.append({'name': field['name'], 'type': avro_type})
+        return {'type': 'record', 'name': 'sheet_row', 'fields': fields}
+
+    def serialize(self, data: pandas.DataFrame, schema: [], header: bool = True) -> bytes:
+        try:
+            import fastavro
+        except ImportError:
+            raise ImportError('Output format avro needs fastavro, please pip install fastavro')
+        typed = apply_schema_types(data, schema)
+        records = typed.astype(object).where(typed.notnull(), None).to_dict(orient='records')
+        for record in records:
+            for name, value in record.items():
+                if isinstance(value, pandas.Timestamp):
+                    record[name] = value.to_pydatetime()
+                elif hasattr(value, 'item'):
+                    record[name] = value.item()
+        buffer = io.BytesIO()
+        fastavro.writer(buffer, fastavro.parse_schema(AvroOutputWriter.create_avro_schema(schema)), records,
+                        codec='deflate')
+        return buffer.getvalue()
@@ -0,0 +1,267 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from bigquery_loader import WRITE_DISPOSITIONS, PARTITION_TYPES
+from global_constant import GlobalConstant
+from lazy_module import LazyModule
+from output_writers import OutputWriter, CsvOutputWriter, parse_schema
+from sheet_range import SheetRange
+
+pytz = LazyModule('pytz')
+yaml = LazyModule('ruamel.yaml')
+
+REQUIRED_KEYS = ['timezone', 'gsc_file_pattern', 'date_time_format', 'date_format', 'gsc_file_type',
+                 'credential_api_scope', 'service_account_file_path', 'google_doc_id', 'mime_type', 'gcs_project',
+                 'gcs_bucket_name', 'gcs_bucket_destination', 'goolge_data_range', 'schema_content', 'google_sheet_id',
+                 'google_sheet_timestamp_format', 'google_sheet_column_transform_mobile_number',
+                 'google_sheet_column_transform_timestamp']
+# Keys that have to be present but may be left empty (null), e.g. a profile without columns to transform.
+NULLABLE_KEYS = ['google_sheet_column_transform_mobile_number', 'google_sheet_column_transform_timestamp']
+UPLOAD_MODES = [GlobalConstant.UPLOAD_MODE_FILE, GlobalConstant.UPLOAD_MODE_MEMORY]
+
+
+def load_profile_settings(profile_path: str) -> dict:
+    with open(profile_path) as profile_file:
+        return yaml.YAML(typ='safe').load(profile_file)
+
+
+class ProfileValidationError(ValueError):
+
+    def __init__(self, profile_path: str, errors: []):
+        self.profile_path = profile_path
+        self.errors = errors
+        ValueError.__init__(self, 'Invalid profile ' + (profile_path or '<settings>') + ' : ' + '; '.join(errors))
+
+
+class PathTemplates:
+    """strftime patterns of the file names and GCS paths of one profile, built once per profile.
+
+    Rendering a run is one strftime call per path, hourly names use the current time, daily names the day
+    before and the year folder of the current time, as the exports always did.
+    """
+
+    __slots__ = ('file_name', 'file_name_daily', 'schema_file_name', 'schema_file_name_daily', 'month_path',
+                 'year_path')
+
+    def __init__(self, settings: dict):
+        pattern = PathTemplates.escape(settings['gsc_file_pattern'])
+        file_type = PathTemplates.escape(settings['gsc_file_type'])
+        self.file_name = pattern + settings['date_time_format'] + '_1.' + file_type
+        self.file_name_daily = pattern + settings['date_format'] + '_1.' + file_type
+        self.schema_file_name = pattern + settings['date_time_format'] + '.schema'
+        self.schema_file_name_daily = pattern + settings['date_format'] + '.schema'
+        self.year_path = PathTemplates.escape(settings['gcs_bucket_destination']) + '/%Y/'
+        self.month_path = self.year_path + '%m/'
+
+    @staticmethod
+    def escape(text) -> str:
+        return str(text).replace('%', '%%')
+
+    def render(self, current_time: datetime) -> dict:
+        previous_day = current_time - timedelta(1)
+        file_name = current_time.strftime(self.file_name)
+        file_name_daily = previous_day.strftime(self.file_name_daily)
+        schema_file_name = current_time.strftime(self.schema_file_name)
+        schema_file_name_daily = previous_day.strftime(self.schema_file_name_daily)
+        month_path = current_time.strftime(self.month_path)
+        year_path = current_time.strftime(self.year_path)
+        return {'file_name': file_name, 'file_name_daily': file_name_daily,
+                'schema_file_name': schema_file_name, 'schema_file_name_daily': schema_file_name_daily,
+                'gcs_destination_file_path': month_path + file_name,
+                'gcs_destination_daily_file_path': year_path + file_name_daily,
+                'gcs_destination_schema_path': month_path + schema_file_name,
+                'gcs_destination_schema_path_daily': year_path + schema_file_name_daily}
+
+
+class ProfileModel:
+    """Parsed and validated profile, every problem of a profile is reported at once by ProfileValidationError."""
+
+    __slots__ = ('profile_path', 'settings', 'time_zone', 'path_templates', 'credential_scopes',
+                 'service_account_file_path', 'google_doc_id', 'google_doc_mime_type', 'gcs_project', 'gcs_bucket',
+                 'google_sheets_range', 'google_sheets_chunk_rows', 'google_sheet_typed_fetch',
+                 'google_drive_download_chunk_mb', 'gcs_upload_mode',
+                 'gcs_output_format', 'incremental', 'export_state_path', 'skip_unchanged', 'clean_sheet_verified',
+                 'gcs_staged_publish', 'gcs_staging_prefix', 'gcs_success_marker', 'export_cache_dir',
+                 'export_cache_max_mb', 'export_cache_max_age_hours', 'bigquery_table', 'bigquery_project',
+                 'bigquery_write_disposition', 'bigquery_partition_type', 'bigquery_partition_field',
+                 'schema_file_content',
+                 'google_sheet_id', 'google_sheet_timestamp_format', 'columns_transform_mobile_number',
+                 'columns_transform_timestamp', 'sheet_exports')
+
+    def __init__(self, settings: dict, profile_path: str = None):
+        errors = ProfileModel.validate(settings)
+        if errors:
+            raise ProfileValidationError(profile_path, errors)
+        self.profile_path = profile_path
+        self.settings = settings
+        self.time_zone = pytz.timezone(settings['timezone'])
+        self.path_templates = PathTemplates(settings)
+        self.credential_scopes = settings['credential_api_scope']
+        self.service_account_file_path = settings['service_account_file_path']
+        self.google_doc_id = settings['google_doc_id']
+        self.google_doc_mime_type = settings['mime_type']
+        self.gcs_project = settings['gcs_project']
+        self.gcs_bucket = settings['gcs_bucket_name']
+        self.google_sheets_range = settings['goolge_data_range']
+        self.google_sheets_chunk_rows = settings.get('google_sheet_chunk_rows')
+        self.google_sheet_typed_fetch = settings.get('google_sheet_typed_fetch', False)
+        self.gcs_upload_mode = settings.get('gcs_upload_mode', GlobalConstant.UPLOAD_MODE_FILE)
+        self.gcs_output_format = settings.get('gcs_output_format', CsvOutputWriter.format_name)
+        self.incremental = settings.get('incremental', False)
+        self.google_drive_download_chunk_mb = settings.get('google_drive_download_chunk_mb')
+        self.export_state_path = settings.get('export_state_path')
+        self.skip_unchanged = settings.get('skip_unchanged', False)
+        self.clean_sheet_verified = settings.get('clean_sheet_verified', False)
+        self.gcs_staged_publish = settings.get('gcs_staged_publish', False)
+        self.gcs_staging_prefix = settings.get('gcs_staging_prefix')
+        self.gcs_success_marker = settings.get('gcs_success_marker', False)
+        self.export_cache_dir = settings.get('export_cache_dir')
+        self.export_cache_max_mb = settings.get('export_cache_max_mb')
+        self.export_cache_max_age_hours = settings.get('export_cache_max_age_hours')
+        self.bigquery_table = settings.get('bigquery_table')
+        self.bigquery_project = settings.get('bigquery_project')
+        self.bigquery_write_disposition = settings.get('bigquery_write_disposition', WRITE_DISPOSITIONS[0])
+        self.bigquery_partition_type = settings.get('bigquery_partition_type')
+        self.bigquery_partition_field = settings.get('bigquery_partition_field')
+        self.schema_file_content = settings['schema_content']
+        self.google_sheet_id = int(settings['google_sheet_id'])
+        self.google_sheet_timestamp_format = settings['google_sheet_timestamp_format']
+        self.columns_transform_mobile_number = settings['google_sheet_column_transform_mobile_number'] or []
+        self.columns_transform_timestamp = settings['google_sheet_column_transform_timestamp'] or []
+        self.sheet_exports = [ProfileModel(settings=ProfileModel.sheet_export_settings(settings, export_settings),
+                                           profile_path=profile_path)
+                              for export_settings in settings.get('google_sheet_exports') or []]
+
+    @staticmethod
+    def load(profile_path: str):
+        return ProfileModel(settings=load_profile_settings(profile_path), profile_path=profile_path)
+
+    @staticmethod
+    def sheet_export_settings(settings: dict, export_settings: dict) -> dict:
+        """Settings of one google_sheet_exports entry, keys missing in the entry are taken from the profile."""
+        merged = dict(settings, **export_settings)
+        merged.pop('google_sheet_exports', None)
+        return merged
+
+    @staticmethod
+    def validate(settings) -> []:
+        if not isinstance(settings, dict):
+            return ['profile is not a mapping of keys']
+        errors = ['missing key ' + key for key in REQUIRED_KEYS
+                  if key not in settings or (settings[key] is None and key not in NULLABLE_KEYS)]
+        if settings.get('timezone') is not None:
+            try:
+                pytz.timezone(settings['timezone'])
+            except (pytz.UnknownTimeZoneError, AttributeError):
+                errors.append('unknown timezone ' + str(settings['timezone']))
+        if settings.get('google_sheet_id') is not None:
+            try:
+                int(settings['google_sheet_id'])
+            except (TypeError, ValueError):
+                errors.append('google_sheet_id is not a number : ' + str(settings['google_sheet_id']))
+        for key in ['google_sheet_column_transform_mobile_number', 'google_sheet_column_transform_timestamp']:
+            columns = settings.get(key)
+            if columns is not None and (not isinstance(columns, list) or
+                                        not all(isinstance(column, int) for column in columns)):
+                errors.append(key + ' must be a list of column indices')
+        if settings.get('schema_content') is not None:
+            try:
+                parse_schema(settings['schema_content'])
+            except ValueError as exception:
+                errors.append('schema_content is not valid JSON : ' + str(exception))
+        chunk_rows = settings.get('google_sheet_chunk_rows')
+        if chunk_rows is not None and (not isinstance(chunk_rows, int) or chunk_rows <= 0):
+            errors.append('google_sheet_chunk_rows must be a number greater than 0')
+        for key in ['google_drive_download_chunk_mb', 'export_cache_max_mb', 'export_cache_max_age_hours']:
+            value = settings.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+                errors.append(key + ' must be a number greater than 0')
+        errors.extend(ProfileModel.validate_bigquery(settings))
+        if settings.get('gcs_upload_mode', GlobalConstant.UPLOAD_MODE_FILE) not in UPLOAD_MODES:
+            errors.append('gcs_upload_mode must be one of ' + ', '.join(UPLOAD_MODES))
+        try:
+            OutputWriter.for_format(settings.get('gcs_output_format'))
+        except ValueError as exception:
+            errors.append(str(exception))
+        if settings.get('skip_unchanged') and not settings.get('export_state_path'):
+            errors.append('skip_unchanged needs export_state_path to remember the last exported revision')
+        if settings.get('incremental') and not settings.get('export_state_path'):
+            errors.append('incremental needs export_state_path to remember the watermark')
+        # Only the file upload of a single range stores its files in the export cache.
+        if settings.get('export_cache_dir') and \
+                settings.get('gcs_upload_mode', GlobalConstant.UPLOAD_MODE_FILE) != GlobalConstant.UPLOAD_MODE_FILE:
+            errors.append('export_cache_dir needs gcs_upload_mode ' + GlobalConstant.UPLOAD_MODE_FILE)
+        if settings.get('export_cache_dir') and settings.get('google_sheet_exports'):
+            errors.append('export_cache_dir cannot be used with google_sheet_exports')
+        if settings.get('incremental') and settings.get('google_sheet_exports'):
+            errors.append('incremental cannot be used with google_sheet_exports')
+        if settings.get('clean_sheet_verified') and settings.get('incremental'):
+            errors.append('clean_sheet_verified needs the full range read, it cannot be used with incremental')
+        # These modes address rows by number, the range has to be in A1 notation.
+        if settings.get('goolge_data_range') is not None and (chunk_rows or settings.get('incremental') or
+                                                             settings.get('clean_sheet_verified')):
+            try:
+                SheetRange.parse(settings['goolge_data_range'])
+            except ValueError as exception:
+                errors.append(str(exception))
+        for index, export_settings in enumerate(settings.get('google_sheet_exports') or []):
+            if not isinstance(export_settings, dict):
+                errors.append('google_sheet_exports[' + str(index) + '] is not a mapping of keys')
+                continue
+            export_errors = ProfileModel.validate(ProfileModel.sheet_export_settings(settings, export_settings))
+            errors.extend('google_sheet_exports[' + str(index) + '] ' + error for error in export_errors
+                          if error not in errors)
+        return errors
+
+    @staticmethod
+    def validate_bigquery(settings: dict) -> []:
+        errors = []
+        table = settings.get('bigquery_table')
+        if table is not None and (not isinstance(table, str) or len(table.split('.')) not in [2, 3]):
+            errors.append('bigquery_table must be dataset.table or project.dataset.table : ' + str(table))
+        if settings.get('bigquery_write_disposition', WRITE_DISPOSITIONS[0]) not in WRITE_DISPOSITIONS:
+            errors.append('bigquery_write_disposition must be one of ' + ', '.join(WRITE_DISPOSITIONS))
+        partition_type = settings.get('bigquery_partition_type')
+        if partition_type is not None and partition_type not in PARTITION_TYPES:
+            errors.append('bigquery_partition_type must be one of ' + ', '.join(PARTITION_TYPES))
+        if settings.get('bigquery_partition_field') and not partition_type:
+            errors.append('bigquery_partition_field needs bigquery_partition_type')
+        if table is not None:
+            try:
+                if OutputWriter.for_format(settings.get('gcs_output_format')).bigquery_source_format is None:
+                    errors.append('gcs_output_format ' + str(settings.get('gcs_output_format')) +
+                                  ' cannot be loaded into BigQuery')
+            except ValueError:
+                pass
+        return errors
+
+
+class ProfileCache:
+    """Process wide cache of compiled profiles, a profile file is parsed again only when its mtime or size changed."""
+
+    _shared_cache = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = {}
+
+    @staticmethod
+    def shared():
+        with ProfileCache._shared_lock:
+            if ProfileCache._shared_cache is None:
+                ProfileCache._shared_cache = ProfileCache()
+            return ProfileCache._shared_cache
+
+    def load(self, profile_path: str) -> ProfileModel:
+        stat = os.stat(profile_path)
+        key = os.path.abspath(profile_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._profiles.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        profile_model = ProfileModel.load(profile_path)
+        with self._lock:
+            self._profiles[key] = (version, profile_model)
+        return profile_model
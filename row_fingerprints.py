@@ -0,0 +1,83 @@
+import hashlib
+import json
+from sheet_range import SheetRange
+
+
+class RowBlock:
+    """Consecutive sheet rows start_row..end_row (1-based, inclusive) and the hash of their raw cell values."""
+
+    def __init__(self, start_row: int, end_row: int, rows_hash: str):
+        self.start_row = start_row
+        self.end_row = end_row
+        self.rows_hash = rows_hash
+
+    @property
+    def row_count(self) -> int:
+        return self.end_row - self.start_row + 1
+
+
+class SheetRowFingerprints:
+    """Hashes of the rows read for an export, kept per block of BLOCK_ROWS rows.
+
+    A verified clean re-reads every block before deleting it and only deletes blocks that still hold the
+    exported values at the same row numbers. Rows appended during the run are outside every block, a block
+    shifted by inserted or deleted rows no longer matches and is kept, its rows are exported again next run.
+    """
+
+    BLOCK_ROWS = 1000
+
+    def __init__(self, ranges: str, block_rows: int = None, render_options: dict = None):
+        self.ranges = ranges
+        self.sheet_range = SheetRange.parse(ranges)
+        self.block_rows = block_rows or SheetRowFingerprints.BLOCK_ROWS
+        # The re-read has to render the cells like the export read did.
+        self.render_options = render_options or {}
+        self.blocks = []
+
+    def to_dict(self) -> dict:
+        return {'ranges': self.ranges, 'block_rows': self.block_rows, 'render_options': self.render_options,
+                'blocks': [[block.start_row, block.end_row, block.rows_hash] for block in self.blocks]}
+
+    @staticmethod
+    def from_dict(state: dict):
+        if not state:
+            return None
+        row_fingerprints = SheetRowFingerprints(ranges=state['ranges'], block_rows=state['block_rows'],
+                                                render_options=state['render_options'])
+        row_fingerprints.blocks = [RowBlock(start_row=start_row, end_row=end_row, rows_hash=rows_hash)
+                                   for start_row, end_row, rows_hash in state['blocks']]
+        return row_fingerprints
+
+    @staticmethod
+    def hash_rows(values: []) -> str:
+        return hashlib.sha256(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def track_values(self, values: [], start_row: int):
+        for offset in range(0, len(values), self.block_rows):
+            block_values = values[offset:offset + self.block_rows]
+            block_start_row = start_row + offset
+            self.blocks.append(RowBlock(start_row=block_start_row, end_row=block_start_row + len(block_values) - 1,
+                                        rows_hash=SheetRowFingerprints.hash_rows(block_values)))
+
+    def block_range(self, block: RowBlock) -> str:
+        return self.sheet_range.with_rows(start_row=block.start_row, end_row=block.end_row).to_a1()
+
+    @staticmethod
+    def matches(block: RowBlock, values: []) -> bool:
+        # A re-read drops trailing empty rows, a block ending with blank rows read them as [] the first time.
+        if len(values) > block.row_count:
+            return False
+        values = values + [[]] * (block.row_count - len(values))
+        return SheetRowFingerprints.hash_rows(values) == block.rows_hash
+
+    @staticmethod
+    def merge_blocks(blocks: []) -> []:
+        """(start_row, end_row) of the contiguous runs of blocks, last run first so deleting one run does not
+        shift the rows of the next."""
+        runs = []
+        for block in sorted(blocks, key=lambda item: item.start_row):
+            if runs and runs[-1][1] + 1 == block.start_row:
+                runs[-1] = (runs[-1][0], block.end_row)
+            else:
+                runs.append((block.start_row, block.end_row))
+        return list(reversed(runs))
@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STATUS_SUCCESS = 'SUCCESS'
+STATUS_FAILED = 'FAILED'
+METRIC_PREFIX = 'sheet_export'
+DEFAULT_PUSHGATEWAY_JOB = 'gcp_google_drive_export2gcs'
+
+_active = threading.local()
+
+
+class StageMetrics:
+    """Totals of one pipeline stage. seconds includes nested stages, self_seconds does not."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+        self.rows = 0
+        self.cells = 0
+        self.bytes = 0
+        self.peak_memory_bytes = 0
+        self.api_calls = {}
+
+    def to_dict(self) -> dict:
+        return {'calls': self.calls, 'seconds': self.seconds, 'self_seconds': self.self_seconds, 'rows': self.rows,
+                'cells': self.cells, 'bytes': self.bytes, 'peak_memory_bytes': self.peak_memory_bytes,
+                'api_calls': {api: dict(counters) for api, counters in self.api_calls.items()}}
+
+
+class RunMetrics:
+    """Timings and volumes per stage (auth, fetch, transform, serialize, upload, publish, load, cache, clean,
+    state) of one run.
+
+    Code deep in the pipeline reports to RunMetrics.current(), the metrics activated on the calling thread,
+    so the API and storage clients do not need a metrics argument. Work handed to a thread pool keeps
+    reporting to the same run when the submitted function is wrapped with bind(). Without an active run
+    current() is a disabled instance and recording costs nothing.
+    """
+
+    def __init__(self, name: str = '', labels: dict = None, enabled: bool = True, clock=time.perf_counter):
+        self.name = name
+        self.labels = dict(labels or {})
+        self.enabled = enabled
+        self.status = None
+        self.started_at = time.time()
+        self.elapsed_seconds = 0.0
+        self.stages = {}
+        self._clock = clock
+        self._start = clock()
+        self._lock = threading.Lock()
+        # Set by a profiled run, e.g. run_profiler.MemoryPeakTracker, to record the peak memory of every stage.
+        self.memory_tracker = None
+
+    @staticmethod
+    def current():
+        return getattr(_active, 'metrics', None) or DISABLED_RUN_METRICS
+
+    @contextmanager
+    def activate(self):
+        previous_metrics = getattr(_active, 'metrics', None)
+        previous_stages = getattr(_active, 'stages', None)
+        _active.metrics = self
+        _active.stages = []
+        try:
+            yield self
+        finally:
+            _active.metrics = previous_metrics
+            _active.stages = previous_stages
+
+    def bind(self, func):
+        def bound(*args, **kwargs):
+            with self.activate():
+                return func(*args, **kwargs)
+        return bound
+
+    def _get_stage(self, name: str) -> StageMetrics:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageMetrics(name)
+        return stage
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0, cells: int = 0, bytes: int = 0):
+        if not self.enabled:
+            yield
+            return
+        stages = getattr(_active, 'stages', None)
+        if stages is None:
+            stages = _active.stages = []
+        # [name, seconds spent in nested stages]
+        frame = [name, 0.0]
+        stages.append(frame)
+        memory_tracker = self.memory_tracker
+        memory_frame = memory_tracker.enter() if memory_tracker is not None else None
+        start_time = self._clock()
+        try:
+            yield
+        finally:
+            seconds = self._clock() - start_time
+            stages.pop()
+            if stages:
+                stages[-1][1] += seconds
+            self.record(name, calls=1, seconds=seconds, self_seconds=seconds - frame[1], rows=rows, cells=cells,
+                        bytes=bytes,
+                        peak_memory_bytes=memory_tracker.exit(memory_frame) if memory_frame is not None else 0)
+
+    def record(self, name: str, calls: int = 0, seconds: float = 0.0, self_seconds: float = 0.0, rows: int = 0,
+               cells: int = 0, bytes: int = 0, peak_memory_bytes: int = 0):
+        if not self.enabled:
+            return
+        with self._lock:
+            stage = self._get_stage(name)
+            stage.calls += calls
+            stage.seconds += seconds
+            stage.self_seconds += self_seconds
+            stage.rows += rows
+            stage.cells += cells
+            stage.bytes += bytes
+            stage.peak_memory_bytes = max(stage.peak_memory_bytes, peak_memory_bytes)
+
+    def count_api_call(self, api: str, counter: str = 'calls'):
+        """Count an API request on the innermost stage running on this thread."""
+        if not self.enabled:
+            return
+        stages = getattr(_active, 'stages', None)
+        with self._lock:
+            api_counters = self._get_stage(stages[-1][0] if stages else 'other').api_calls.setdefault(api, {})
+            api_counters[counter] = api_counters.get(counter, 0) + 1
+
+    def finish(self, status: str):
+        self.status = status
+        self.elapsed_seconds = self._clock() - self._start
+
+    def summary(self) -> str:
+        with self._lock:
+            return ', '.join(name + ' %.2fs' % stage.seconds +
+                             ''.join(' ' + str(getattr(stage, field)) + ' ' + field
+                                     for field in ['rows', 'bytes'] if getattr(stage, field))
+                             for name, stage in self.stages.items())
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'name': self.name, 'labels': dict(self.labels), 'status': self.status,
+                    'started_at': self.started_at, 'elapsed_seconds': self.elapsed_seconds,
+                    'stages': {name: stage.to_dict() for name, stage in self.stages.items()}}
+
+
+DISABLED_RUN_METRICS = RunMetrics(enabled=False)
+
+
+def write_json_report(reports: [], output_path: str):
+    with open(output_path, 'wt') as report_file:
+        json.dump({'runs': reports}, report_file, indent=2, sort_keys=True)
+    logging.info('Wrote run report : ' + output_path)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: dict) -> str:
+    return '{' + ','.join(name + '="' + escape_label_value(value) + '"' for name, value in sorted(labels.items())) + '}'
+
+
+def format_prometheus(reports: []) -> str:
+    """Prometheus text exposition format, one sample per run and stage labelled with the run name."""
+    metrics = [
+        ('run_duration_seconds', 'Wall time of the export run.'),
+        ('run_success', '1 when the export run succeeded.'),
+        ('run_start_timestamp_seconds', 'Unix time the export run started.'),
+        ('stage_duration_seconds', 'Time spent in the stage, including nested stages.'),
+        ('stage_self_seconds', 'Time spent in the stage, excluding nested stages.'),
+        ('stage_calls', 'Times the stage was entered.'),
+        ('stage_rows', 'Sheet rows handled by the stage.'),
+        ('stage_cells', 'Sheet cells handled by the stage.'),
+        ('stage_bytes', 'Bytes produced or sent by the stage.'),
+        ('stage_peak_memory_bytes', 'Peak traced Python memory while the stage ran, profiled runs only.'),
+        ('stage_api_requests', 'Google API requests made by the stage, by api and outcome.'),
+    ]
+    samples = dict((name, []) for name, _ in metrics)
+    for report in reports:
+        run_labels = dict(report.get('labels') or {}, profile=report['name'])
+        samples['run_duration_seconds'].append((run_labels, report['elapsed_seconds']))
+        samples['run_success'].append((run_labels, 1 if report['status'] == STATUS_SUCCESS else 0))
+        samples['run_start_timestamp_seconds'].append((run_labels, report['started_at']))
+        for stage_name, stage in sorted(report['stages'].items()):
+            stage_labels = dict(run_labels, stage=stage_name)
+            samples['stage_duration_seconds'].append((stage_labels, stage['seconds']))
+            samples['stage_self_seconds'].append((stage_labels, stage['self_seconds']))
+            for field in ['calls', 'rows', 'cells', 'bytes']:
+                samples['stage_' + field].append((stage_labels, stage[field]))
+            if stage.get('peak_memory_bytes'):
+                samples['stage_peak_memory_bytes'].append((stage_labels, stage['peak_memory_bytes']))
+            for api, counters in sorted(stage['api_calls'].items()):
+                for outcome, value in sorted(counters.items()):
+                    samples['stage_api_requests'].append((dict(stage_labels, api=api, outcome=outcome), value))
+
+    lines = []
+    for name, help_text in metrics:
+        if not samples[name]:
+            continue
+        lines.append('# HELP ' + METRIC_PREFIX + '_' + name + ' ' + help_text)
+        lines.append('# TYPE ' + METRIC_PREFIX + '_' + name + ' gauge')
+        for labels, value in samples[name]:
+            lines.append(METRIC_PREFIX + '_' + name + format_labels(labels) + ' ' + repr(float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(reports: [], output_path: str):
+    # The node exporter textfile collector may read at any time, so replace the file in one step.
+    temp_path = output_path + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_path, 'wt') as textfile:
+        textfile.write(format_prometheus(reports))
+    os.replace(temp_path, output_path)
+    logging.info('Wrote Prometheus textfile : ' + output_path)
+
+
+def push_to_gateway(reports: [], gateway_url: str, job: str = DEFAULT_PUSHGATEWAY_JOB, timeout: float = 10.0):
+    from urllib import request as urllib_request
+    url = gateway_url.rstrip('/') + '/metrics/job/' + job
+    request = urllib_request.Request(url, data=format_prometheus(reports).encode('utf-8'), method='PUT',
+                                     headers={'Content-Type': 'text/plain; version=0.0.4'})
+    with urllib_request.urlopen(request, timeout=timeout):
+        pass
+    logging.info('Pushed run metrics to ' + url)
+
+
+def export_run_reports(reports: [], json_path: str = None, textfile_path: str = None, pushgateway_url: str = None,
+                       pushgateway_job: str = DEFAULT_PUSHGATEWAY_JOB):
+    """Write the reports to every configured target, a failing target never fails the export itself."""
+    targets = [(json_path, write_json_report), (textfile_path, write_prometheus_textfile),
+               (pushgateway_url, lambda data, url: push_to_gateway(data, url, job=pushgateway_job))]
+    for target, export in targets:
+        if not target:
+            continue
+        try:
+            export(reports, target)
+        except Exception as exception:
+            logging.error('Cannot export run metrics to ' + target + ' : ' + repr(exception))
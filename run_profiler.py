@@ -0,0 +1,149 @@
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class MemoryFrame:
+
+    __slots__ = ('peak_bytes',)
+
+    def __init__(self):
+        self.peak_bytes = 0
+
+
+class MemoryPeakTracker:
+    """Peak traced memory of every stage from tracemalloc, which counts the allocations of the whole process.
+
+    Entering a stage restarts the tracemalloc peak, the peak reached until then is first carried into the stages
+    still open on any thread, so nested and concurrent stages keep the highest allocation seen while they ran.
+    Python before 3.9 has no tracemalloc.reset_peak, a stage then reports the peak of the run up to its end.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open_frames = []
+
+    def enter(self) -> MemoryFrame:
+        memory_frame = MemoryFrame()
+        with self._lock:
+            if hasattr(tracemalloc, 'reset_peak'):
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+                for open_frame in self._open_frames:
+                    open_frame.peak_bytes = max(open_frame.peak_bytes, peak_bytes)
+                tracemalloc.reset_peak()
+            self._open_frames.append(memory_frame)
+        return memory_frame
+
+    def exit(self, memory_frame: MemoryFrame) -> int:
+        with self._lock:
+            memory_frame.peak_bytes = max(memory_frame.peak_bytes, tracemalloc.get_traced_memory()[1])
+            self._open_frames = [open_frame for open_frame in self._open_frames if open_frame is not memory_frame]
+        return memory_frame.peak_bytes
+
+
+class StackSampler:
+    """Samples the stack of every thread each interval seconds and counts them as collapsed stacks.
+
+    Unlike cProfile it sees the worker threads and time spent waiting, e.g. on a socket, a stack blocked in
+    ssl.read is network wait. The output is one "thread;outer;...;inner count" line per stack, the input of
+    flamegraph.pl and speedscope.
+    """
+
+    DEFAULT_INTERVAL = 0.005
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or StackSampler.DEFAULT_INTERVAL
+        self.stack_counts = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        code = frame.f_code
+        return (code.co_name + ' (' + os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) +
+                ')').replace(';', ':')
+
+    def sample(self):
+        sampler_id = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(StackSampler.frame_name(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, str(thread_id)).replace(';', ':'))
+            self.stack_counts[';'.join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def write_collapsed(self, output_path: str):
+        with open(output_path, 'wt') as collapsed_file:
+            for stack, count in sorted(self.stack_counts.items()):
+                collapsed_file.write(stack + ' ' + str(count) + '\n')
+
+
+class RunProfiler:
+    """Profiles one export run into output_dir.
+
+    <name>.pstats holds the cProfile of the thread running the pipeline (python -m pstats, snakeviz),
+    <name>.collapsed the stack samples of all threads and <name>.stages.json the run metrics, whose stages carry
+    their peak_memory_bytes.
+    """
+
+    def __init__(self, output_dir: str, name: str, sample_interval: float = None):
+        self.output_dir = output_dir
+        self.name = name
+        self.sample_interval = sample_interval
+
+    @staticmethod
+    def run_name(profile_path: str) -> str:
+        return os.path.splitext(os.path.basename(profile_path))[0] + '_' + datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    def output_path(self, suffix: str) -> str:
+        return os.path.join(self.output_dir, self.name + suffix)
+
+    @contextmanager
+    def profile(self, run_metrics):
+        os.makedirs(self.output_dir, exist_ok=True)
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        run_metrics.memory_tracker = MemoryPeakTracker()
+        sampler = StackSampler(interval=self.sample_interval)
+        profiler = cProfile.Profile()
+        sampler.start()
+        profiler.enable()
+        try:
+            yield self
+        finally:
+            profiler.disable()
+            sampler.stop()
+            run_metrics.memory_tracker = None
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            if not was_tracing:
+                tracemalloc.stop()
+            profiler.dump_stats(self.output_path('.pstats'))
+            sampler.write_collapsed(self.output_path('.collapsed'))
+            with open(self.output_path('.stages.json'), 'wt') as stages_file:
+                json.dump(run_metrics.to_dict(), stages_file, indent=2, sort_keys=True)
+            logging.info('Wrote run profile ' + self.output_path('.*') + ', peak traced memory %.1f MB' %
+                         (peak_bytes / (1024.0 * 1024.0)))
@@ -0,0 +1,282 @@
+import logging
+import os
+import signal
+import threading
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from global_constant import GlobalConstant
+from lazy_module import LazyModule
+from api_client_cache import ApiClientCache
+from api_rate_limiter import ApiRateLimiter
+from run_metrics import write_prometheus_textfile
+from profile_model import ProfileCache, ProfileModel
+import batch_runner
+
+pytz = LazyModule('pytz')
+
+DEFAULT_POLL_SECONDS = 30.0
+
+
+def read_args(parser_args: ArgumentParser) -> Namespace:
+    required = parser_args.add_argument_group('required arguments')
+    required.add_argument('-p', '--profiles', nargs='+',
+                          help='Profile files (.yaml) or directories containing profile files')
+    optional = parser_args.add_argument_group('option argument')
+    optional.add_argument('-mode', '--mode',
+                          default=GlobalConstant.MODE_HOURLY,
+                          help='daily or hourly cadence of profiles without a schedule key')
+    optional.add_argument('-clean', '--clean_sheet',
+                          default="False",
+                          help='Clean sheet after uploading data for schedule entries without clean_sheet')
+    optional.add_argument('-w', '--workers', type=int,
+                          default=4,
+                          help='Number of profiles exported at the same time')
+    optional.add_argument('--poll_seconds', type=float,
+                          default=DEFAULT_POLL_SECONDS,
+                          help='How often profile files are checked for changes')
+    optional.add_argument('--sheets_requests_per_minute', type=float,
+                          default=ApiRateLimiter.DEFAULT_REQUESTS_PER_MINUTE['sheets'],
+                          help='Sheets API requests per minute allowed per service account')
+    optional.add_argument('--metrics_textfile',
+                          help='Keep the metrics of the last run of every profile in this Prometheus textfile')
+    return parser_args.parse_args()
+
+
+def validate_args(parser: ArgumentParser, arguments: Namespace):
+    if not arguments.profiles:
+        logging.error("Please specific -p or --profiles for profile paths")
+        parser.print_help()
+        exit(1)
+
+    if arguments.mode not in [GlobalConstant.MODE_DAILY, GlobalConstant.MODE_HOURLY]:
+        logging.error("Please specific mode -mode or --mode with daily or hourly")
+        parser.print_help()
+        exit(1)
+
+    if arguments.workers < 1 or arguments.poll_seconds <= 0:
+        logging.error("Please specific -w or --workers and --poll_seconds greater than 0")
+        parser.print_help()
+        exit(1)
+
+    arguments.clean_sheet = arguments.clean_sheet.__str__().lower() in ['true']
+
+
+class ScheduleEntry:
+    """One cadence of a profile: hourly at minute, or daily at hour:minute, in the profile timezone."""
+
+    def __init__(self, mode: str, minute: int = 0, hour: int = 0, is_clean_sheet: bool = False):
+        if mode not in [GlobalConstant.MODE_DAILY, GlobalConstant.MODE_HOURLY]:
+            raise ValueError('Schedule mode does not match : ' + str(mode) + ', use daily or hourly')
+        if not 0 <= minute <= 59 or not 0 <= hour <= 23:
+            raise ValueError('Schedule needs 0 <= hour <= 23 and 0 <= minute <= 59')
+        self.mode = mode
+        self.minute = minute
+        self.hour = hour
+        self.is_clean_sheet = is_clean_sheet
+
+    def next_run_time(self, after: datetime, time_zone) -> datetime:
+        """First run time strictly after the aware datetime after, returned in UTC."""
+        local_after = after.astimezone(time_zone)
+        if self.mode == GlobalConstant.MODE_HOURLY:
+            candidate = local_after.replace(minute=self.minute, second=0, microsecond=0)
+            if candidate <= local_after:
+                candidate = candidate + timedelta(hours=1)
+            return candidate.astimezone(pytz.utc)
+        # Localize the wall clock time of every day, so daily runs keep their local hour across DST changes.
+        run_date = local_after.date()
+        while True:
+            candidate = time_zone.localize(datetime(run_date.year, run_date.month, run_date.day, self.hour,
+                                                    self.minute))
+            if candidate > after:
+                return candidate.astimezone(pytz.utc)
+            run_date += timedelta(days=1)
+
+
+def create_schedule_entries(schedule_settings, default_mode: str, is_clean_sheet: bool) -> []:
+    if not schedule_settings:
+        return [ScheduleEntry(mode=default_mode, is_clean_sheet=is_clean_sheet)]
+    if isinstance(schedule_settings, dict):
+        schedule_settings = [schedule_settings]
+    return [ScheduleEntry(mode=entry.get('mode', default_mode), minute=int(entry.get('minute', 0)),
+                          hour=int(entry.get('hour', 0)),
+                          is_clean_sheet=bool(entry.get('clean_sheet', is_clean_sheet)))
+            for entry in schedule_settings]
+
+
+class ScheduledProfile:
+
+    def __init__(self, profile_path: str, profile_model: ProfileModel, modified_time: float, entries: [],
+                 after: datetime):
+        self.profile_path = profile_path
+        self.profile_model = profile_model
+        self.modified_time = modified_time
+        self.time_zone = profile_model.time_zone
+        settings = profile_model.settings
+        self.entries = entries
+        self.next_run_times = [entry.next_run_time(after, self.time_zone) for entry in entries]
+        sheet_ids = [settings['google_sheet_id']] + [export_settings.get('google_sheet_id', settings['google_sheet_id'])
+                                                     for export_settings in settings.get('google_sheet_exports') or []]
+        # Runs of any profile touching one of these sheets must not overlap.
+        self.sheet_keys = set((str(settings['google_doc_id']), str(sheet_id)) for sheet_id in sheet_ids)
+
+
+class SchedulerDaemon:
+    """Resident scheduler running every profile on its own cadence in one process.
+
+    Profiles are parsed once and reloaded when their file changes. Runs share the process wide API client
+    cache, the rate limiter and a thread pool, so only the first run of a service account pays for start
+    up and authentication. A run that is due while an earlier run of the same sheet is still going is
+    skipped, not queued, the next occurrence exports the rows it would have exported.
+    """
+
+    def __init__(self, profiles: [], default_mode: str = GlobalConstant.MODE_HOURLY, is_clean_sheet: bool = False,
+                 workers: int = 4, poll_seconds: float = DEFAULT_POLL_SECONDS, metrics_textfile: str = None,
+                 run_profile=batch_runner.run_profile_path, clock=None):
+        self.profiles = profiles
+        self.default_mode = default_mode
+        self.is_clean_sheet = is_clean_sheet
+        self.poll_seconds = poll_seconds
+        self.metrics_textfile = metrics_textfile
+        self.run_profile = run_profile
+        self.clock = clock or (lambda: datetime.now(pytz.utc))
+        self.scheduled_profiles = {}
+        self.running_sheets = set()
+        self.last_reports = {}
+        self.skipped_runs = 0
+        self.last_tick = None
+        self._failed_modified_times = {}
+        self._next_reload = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def reload_profiles(self, now: datetime):
+        profile_paths = batch_runner.collect_profile_paths(self.profiles)
+        for profile_path in set(self.scheduled_profiles) - set(profile_paths):
+            logging.info('Profile removed : ' + profile_path)
+            del self.scheduled_profiles[profile_path]
+        for profile_path in profile_paths:
+            try:
+                modified_time = os.path.getmtime(profile_path)
+            except OSError as exception:
+                logging.error('Cannot read profile ' + profile_path + ' : ' + repr(exception))
+                continue
+            current = self.scheduled_profiles.get(profile_path)
+            if (current is not None and current.modified_time == modified_time) or \
+                    self._failed_modified_times.get(profile_path) == modified_time:
+                continue
+            try:
+                # An invalid profile is rejected here, not at every scheduled run.
+                profile_model = ProfileCache.shared().load(profile_path)
+                entries = create_schedule_entries(profile_model.settings.get('schedule'),
+                                                  default_mode=self.default_mode, is_clean_sheet=self.is_clean_sheet)
+                # A reload must not swallow a run that became due since the previous tick.
+                scheduled_profile = ScheduledProfile(profile_path=profile_path, profile_model=profile_model,
+                                                     modified_time=modified_time, entries=entries,
+                                                     after=self.last_tick or now)
+            except Exception as exception:
+                logging.error('Cannot load profile ' + profile_path + ', keeping the previous version : ' +
+                              repr(exception))
+                self._failed_modified_times[profile_path] = modified_time
+                continue
+            self._failed_modified_times.pop(profile_path, None)
+            self.scheduled_profiles[profile_path] = scheduled_profile
+            logging.info(('Reloaded' if current is not None else 'Loaded') + ' profile ' + profile_path +
+                         ', next runs : ' + ', '.join(str(run_time) for run_time in scheduled_profile.next_run_times))
+            self.warm_credentials(profile_model.settings)
+        self._next_reload = now + timedelta(seconds=self.poll_seconds)
+
+    @staticmethod
+    def warm_credentials(settings: dict):
+        try:
+            ApiClientCache.shared().get_credentials(service_account_file=settings['service_account_file_path'],
+                                                    scopes=settings.get('credential_api_scope'))
+        except Exception as exception:
+            logging.warning('Cannot load credentials of ' + str(settings.get('service_account_file_path')) +
+                            ' : ' + repr(exception))
+
+    def submit(self, scheduled_profile: ScheduledProfile, entry: ScheduleEntry) -> bool:
+        with self._lock:
+            if scheduled_profile.sheet_keys & self.running_sheets:
+                self.skipped_runs += 1
+                logging.warning('Skip ' + entry.mode + ' run of ' + scheduled_profile.profile_path +
+                                ', a previous run of the same sheet is still running')
+                return False
+            self.running_sheets |= scheduled_profile.sheet_keys
+        self.executor.submit(self._run, scheduled_profile, entry)
+        return True
+
+    def _run(self, scheduled_profile: ScheduledProfile, entry: ScheduleEntry):
+        try:
+            result = self.run_profile(scheduled_profile.profile_path, entry.mode, entry.is_clean_sheet,
+                                      scheduled_profile.profile_model)
+            logging.info('Run ' + entry.mode + ' ' + scheduled_profile.profile_path + ' : ' + result.status +
+                         ', rows : ' + str(result.row_count) + ', %.2f seconds' % result.elapsed_seconds)
+            if result.metrics:
+                with self._lock:
+                    self.last_reports[(scheduled_profile.profile_path, entry.mode)] = result.metrics
+                    reports = list(self.last_reports.values())
+                if self.metrics_textfile:
+                    write_prometheus_textfile(reports, self.metrics_textfile)
+        except Exception as exception:
+            logging.error('Scheduled run of ' + scheduled_profile.profile_path + ' failed : ' + repr(exception))
+        finally:
+            with self._lock:
+                self.running_sheets -= scheduled_profile.sheet_keys
+
+    def run_due_profiles(self, now: datetime) -> int:
+        submitted = 0
+        for scheduled_profile in list(self.scheduled_profiles.values()):
+            for index, entry in enumerate(scheduled_profile.entries):
+                if scheduled_profile.next_run_times[index] > now:
+                    continue
+                # Runs missed while the daemon was busy or stopped are not caught up one by one.
+                scheduled_profile.next_run_times[index] = entry.next_run_time(now, scheduled_profile.time_zone)
+                submitted += 1 if self.submit(scheduled_profile, entry) else 0
+        return submitted
+
+    def tick(self) -> datetime:
+        now = self.clock()
+        if self._next_reload is None or now >= self._next_reload:
+            self.reload_profiles(now)
+        self.run_due_profiles(now)
+        self.last_tick = now
+        return now
+
+    def seconds_until_next_event(self, now: datetime) -> float:
+        next_times = [self._next_reload] + [run_time for scheduled_profile in self.scheduled_profiles.values()
+                                            for run_time in scheduled_profile.next_run_times]
+        return max(0.0, min((next_time - now).total_seconds() for next_time in next_times if next_time))
+
+    def run_forever(self):
+        logging.info('Scheduler daemon started')
+        while not self._stop_event.is_set():
+            now = self.tick()
+            self._stop_event.wait(self.seconds_until_next_event(now))
+        logging.info('Scheduler daemon stopping, waiting for running exports')
+        self.executor.shutdown(wait=True)
+
+    def stop(self, *args):
+        self._stop_event.set()
+
+
+def daemon_main():
+    parser = ArgumentParser()
+    args = read_args(parser)
+    validate_args(parser=parser, arguments=args)
+    ApiRateLimiter.shared().configure(api='sheets', requests_per_minute=args.sheets_requests_per_minute)
+    daemon = SchedulerDaemon(profiles=args.profiles, default_mode=args.mode, is_clean_sheet=args.clean_sheet,
+                             workers=args.workers, poll_seconds=args.poll_seconds,
+                             metrics_textfile=args.metrics_textfile)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(threadName)s - %(name)s - %(levelname)-7s - %(message)s'
+    )
+    daemon_main()
@@ -0,0 +1,70 @@
+import re
+
+
+class SheetRange:
+    """A1 notation range, e.g. "A2:Z", "Sheet1!A2:Z5000" or "'Form Responses 1'!B2:F"."""
+
+    A1_PATTERN = re.compile(r"^(?:(?P<sheet>'(?:[^']|'')+'|[^!]+)!)?"
+                            r"(?P<start_col>[A-Za-z]+)(?P<start_row>\d+)?"
+                            r":(?P<end_col>[A-Za-z]+)(?P<end_row>\d+)?$")
+
+    def __init__(self, sheet_name: str, start_col: str, start_row: int, end_col: str, end_row: int = None):
+        self.sheet_name = sheet_name
+        self.start_col = start_col.upper()
+        self.start_row = start_row
+        self.end_col = end_col.upper()
+        self.end_row = end_row
+
+    @staticmethod
+    def parse(ranges: str):
+        match = SheetRange.A1_PATTERN.match(ranges.strip())
+        if not match:
+            raise ValueError('Range is not in A1 notation : ' + ranges)
+        end_row = match.group('end_row')
+        return SheetRange(sheet_name=match.group('sheet'),
+                          start_col=match.group('start_col'),
+                          start_row=int(match.group('start_row') or 1),
+                          end_col=match.group('end_col'),
+                          end_row=int(end_row) if end_row else None)
+
+    @staticmethod
+    def column_to_index(column: str) -> int:
+        index = 0
+        for letter in column.upper():
+            index = index * 26 + (ord(letter) - ord('A') + 1)
+        return index - 1
+
+    @staticmethod
+    def index_to_column(index: int) -> str:
+        column = ''
+        index = index + 1
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            column = chr(ord('A') + remainder) + column
+        return column
+
+    def column_count(self) -> int:
+        return SheetRange.column_to_index(self.end_col) - SheetRange.column_to_index(self.start_col) + 1
+
+    def with_rows(self, start_row: int, end_row: int = None):
+        return SheetRange(sheet_name=self.sheet_name, start_col=self.start_col, start_row=start_row,
+                          end_col=self.end_col, end_row=end_row)
+
+    def split_rows(self, chunk_rows: int, last_row: int) -> []:
+        if chunk_rows <= 0:
+            raise ValueError('Chunk rows must be greater than 0 : ' + str(chunk_rows))
+        windows = []
+        start_row = self.start_row
+        while start_row <= last_row:
+            end_row = min(start_row + chunk_rows - 1, last_row)
+            windows.append(self.with_rows(start_row=start_row, end_row=end_row))
+            start_row = end_row + 1
+        return windows
+
+    def to_a1(self) -> str:
+        prefix = self.sheet_name + '!' if self.sheet_name else ''
+        end_row = str(self.end_row) if self.end_row else ''
+        return prefix + self.start_col + str(self.start_row) + ':' + self.end_col + end_row
+
+    def __str__(self):
+        return self.to_a1()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+import logging
+from lazy_module import LazyModule
+from output_writers import cast_series, BQ_TIMESTAMP_TYPES, BQ_DATE_TYPES
+from transform_inputs import TransformInputs
+
+pandas = LazyModule('pandas')
+
+
+class TransformReport:
+
+    def __init__(self):
+        self.mobile_unconverted_rows = {}
+        self.timestamp_failed_rows = {}
+
+    def add_mobile_unconverted(self, column, rows: []):
+        if len(rows) > 0:
+            self.mobile_unconverted_rows[column] = rows
+
+    def add_timestamp_failed(self, column, rows: []):
+        if len(rows) > 0:
+            self.timestamp_failed_rows[column] = rows
+
+    def has_timestamp_failures(self) -> bool:
+        return len(self.timestamp_failed_rows) > 0
+
+    def summary(self) -> str:
+        lines = []
+        for column, rows in self.mobile_unconverted_rows.items():
+            lines.append('Mobile column ' + str(column) + ' : ' + str(len(rows)) + ' non numeric rows kept as is')
+        for column, rows in self.timestamp_failed_rows.items():
+            lines.append('Timestamp column ' + str(column) + ' : ' + str(len(rows)) + ' rows failed to convert ' +
+                         str(rows[:10]))
+        return '\n'.join(lines)
+
+
+class VectorizedTransformEngine:
+    """Column-at-a-time equivalent of GoogleDocAPIMGMT.convert_mobile_number / convert_date_time."""
+
+    # Same inputs as int() accepts: surrounding whitespace, a sign, unicode digits and '_' separators.
+    MOBILE_NUMBER_PATTERN = r'^\s*[+-]?\d+(?:_\d+)*\s*$'
+    DEFAULT_BQ_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+    BQ_DATE_FORMAT = '%Y-%m-%d'
+    # Day 0 of Sheets serial dates, as in Lotus 1-2-3 and Excel.
+    SERIAL_DATE_ORIGIN = '1899-12-30'
+
+    def __init__(self, sheet_timestamp: str, output_timestamp_format: str = DEFAULT_BQ_TIMESTAMP_FORMAT,
+                 strict: bool = True):
+        self.sheet_timestamp = sheet_timestamp
+        self.output_timestamp_format = output_timestamp_format
+        self.strict = strict
+
+    def transform(self, data: pandas.DataFrame, transform_inputs: TransformInputs):
+        report = TransformReport()
+        if transform_inputs.typed_schema is not None:
+            return self.transform_typed(data, transform_inputs, report), report
+        for mobile_cols in transform_inputs.transform_mobile_number_column_indices:
+            data[mobile_cols] = self.transform_mobile_series(data[mobile_cols], column=mobile_cols, report=report)
+        for timestamp_cols in transform_inputs.transform_timestamp_column_indices:
+            data[timestamp_cols] = self.transform_timestamp_series(data[timestamp_cols], column=timestamp_cols,
+                                                                   report=report)
+        self.check_report(report)
+        return data, report
+
+    def check_report(self, report: TransformReport):
+        if report.has_timestamp_failures():
+            logging.warning(report.summary())
+            if self.strict:
+                raise ValueError('Cannot convert timestamp columns with format ' + self.sheet_timestamp + ' :\n' +
+                                 report.summary())
+
+    @staticmethod
+    def transform_mobile_series(series: pandas.Series, column=None, report: TransformReport = None) -> pandas.Series:
+        text = series.map(str).astype(object)
+        is_number = text.str.match(VectorizedTransformEngine.MOBILE_NUMBER_PATTERN).fillna(False).astype(bool)
+        if report is not None:
+            report.add_mobile_unconverted(column, text.index[~is_number].tolist())
+        return text.where(~is_number, '0' + text)
+
+    def transform_timestamp_series(self, series: pandas.Series, column=None,
+                                   report: TransformReport = None) -> pandas.Series:
+        parsed = pandas.to_datetime(series, format=self.sheet_timestamp, errors='coerce')
+        is_parsed = parsed.notnull()
+        if report is not None:
+            report.add_timestamp_failed(column, series.index[~is_parsed].tolist())
+        formatted = parsed.dt.strftime(self.output_timestamp_format).astype(object)
+        return formatted.where(is_parsed, series.astype(object))
+
+    def transform_typed(self, data: pandas.DataFrame, transform_inputs: TransformInputs,
+                        report: TransformReport) -> pandas.DataFrame:
+        """Transform the cells of a typed fetch, numbers arrive as numbers and dates as serial numbers.
+
+        Timestamp columns are the configured ones plus the TIMESTAMP, DATETIME and DATE fields of the schema,
+        the other schema fields are cast to their type. Cells typed as text, e.g. a date entered with a leading
+        apostrophe, still go through the sheet timestamp format.
+        """
+        schema = transform_inputs.typed_schema
+        timestamp_columns = set(transform_inputs.transform_timestamp_column_indices)
+        for position, field in enumerate(schema):
+            if str(field.get('type', 'STRING')).upper() in BQ_TIMESTAMP_TYPES + BQ_DATE_TYPES:
+                timestamp_columns.add(position)
+        for mobile_cols in transform_inputs.transform_mobile_number_column_indices:
+            data[mobile_cols] = self.transform_typed_mobile_series(data[mobile_cols], column=mobile_cols,
+                                                                   report=report)
+        for position in sorted(timestamp_columns):
+            if position not in data.columns:
+                continue
+            field_type = str(schema[position].get('type', '')).upper() if position < len(schema) else ''
+            output_format = VectorizedTransformEngine.BQ_DATE_FORMAT if field_type in BQ_DATE_TYPES else \
+                self.output_timestamp_format
+            data[position] = self.transform_serial_timestamp_series(data[position], output_format=output_format,
+                                                                    column=position, report=report)
+        for position, field in enumerate(schema):
+            if position in data.columns and position not in timestamp_columns and \
+                    position not in transform_inputs.transform_mobile_number_column_indices:
+                field_type = str(field.get('type', 'STRING')).upper()
+                if field_type != 'STRING':
+                    data[position] = cast_series(data[position], field_type)
+        self.check_report(report)
+        return data
+
+    @staticmethod
+    def is_text_series(series: pandas.Series) -> pandas.Series:
+        return series.map(type).eq(str)
+
+    @staticmethod
+    def transform_typed_mobile_series(series: pandas.Series, column=None,
+                                      report: TransformReport = None) -> pandas.Series:
+        """Numbers lost their leading zero in the sheet and get it back, text cells kept theirs."""
+        is_text = VectorizedTransformEngine.is_text_series(series)
+        numbers = pandas.to_numeric(series.where(~is_text), errors='coerce')
+        is_number = numbers.notnull()
+        if report is not None:
+            text = series[is_text].astype(str)
+            report.add_mobile_unconverted(
+                column, text.index[~text.str.match(VectorizedTransformEngine.MOBILE_NUMBER_PATTERN)].tolist())
+        converted = series.astype(object).copy()
+        converted[is_number] = '0' + numbers[is_number].round().astype('int64').astype(str)
+        return converted
+
+    def transform_serial_timestamp_series(self, series: pandas.Series, output_format: str, column=None,
+                                          report: TransformReport = None) -> pandas.Series:
+        is_text = VectorizedTransformEngine.is_text_series(series)
+        serials = pandas.to_numeric(series.where(~is_text), errors='coerce')
+        # Serial fractions are not exact, 01:02:03 reads as 01:02:02.999999.
+        parsed = pandas.to_datetime(serials, unit='D', origin=VectorizedTransformEngine.SERIAL_DATE_ORIGIN)
+        parsed = parsed.dt.round('s')
+        formatted = parsed.dt.strftime(output_format).astype(object).where(parsed.notnull(), None)
+        if is_text.any():
+            formatted[is_text] = self.transform_timestamp_series(series[is_text], column=column, report=report)
+        return formatted
@@ -3,6 +3,10 @@ class TransformInputs:
     def __init__(self):
         self.transform_mobile_number_column_indices = []
         self.transform_timestamp_column_indices = []
+        # Schema fields of a typed fetch, cells are then read unformatted and dates as serial numbers.
+        self.typed_schema = None
+        # Output width, the schema fields, so every chunk is written with as many columns as the header.
+        self.column_count = None
 
     def set_transform_mobile_column(self, mobile_number_column_indices: []):
         self.transform_mobile_number_column_indices = mobile_number_column_indices
@@ -15,3 +19,9 @@ class TransformInputs:
             self.set_transform_mobile_column(mobile_number_column_indices=mobile_column_inputs)
         if timestamp_column_inputs and len(timestamp_column_inputs) > 0:
             self.set_transform_timestamp_column(timestamp_column_indices=timestamp_column_inputs)
+
+    def set_typed_schema(self, schema: []):
+        self.typed_schema = schema
+
+    def set_column_count(self, column_count: int):
+        self.column_count = column_count
@@ -0,0 +1,62 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from api_client_cache import ApiClientCache
+
+
+class TestApiClientCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ApiClientCache()
+
+    @patch('api_client_cache.build')
+    @patch('api_client_cache.service_account')
+    def test_get_service_reuses_service_and_credentials(self, mock_service_account, mock_build):
+        # Given
+        mock_build.side_effect = lambda *args, **kwargs: MagicMock()
+
+        # When
+        sheets_service = self.cache.get_service('sheets', 'v4', ['scope_1'], 'service_account.json')
+        sheets_service_again = self.cache.get_service('sheets', 'v4', ['scope_1'], 'service_account.json')
+        drive_service = self.cache.get_service('drive', 'v3', ['scope_1'], 'service_account.json')
+
+        # Then
+        self.assertIs(sheets_service, sheets_service_again)
+        self.assertIsNot(sheets_service, drive_service)
+        self.assertEqual(mock_build.call_count, 2)
+        mock_service_account.Credentials.from_service_account_file.assert_called_once_with(
+            'service_account.json', scopes=['scope_1'])
+
+    @patch('api_client_cache.build')
+    @patch('api_client_cache.service_account')
+    def test_get_service_is_cached_per_thread(self, mock_service_account, mock_build):
+        # Given
+        mock_build.side_effect = lambda *args, **kwargs: MagicMock()
+        services = []
+
+        # When
+        services.append(self.cache.get_service('sheets', 'v4', ['scope_1'], 'service_account.json'))
+        worker = threading.Thread(target=lambda: services.append(
+            self.cache.get_service('sheets', 'v4', ['scope_1'], 'service_account.json')))
+        worker.start()
+        worker.join()
+
+        # Then
+        self.assertIsNot(services[0], services[1])
+        mock_service_account.Credentials.from_service_account_file.assert_called_once()
+
+    @patch('api_client_cache.storage')
+    @patch('api_client_cache.service_account')
+    def test_get_bucket_is_cached(self, mock_service_account, mock_storage):
+        # When
+        bucket = self.cache.get_bucket('service_account.json', 'staging', 'bucket_staging')
+        bucket_again = self.cache.get_bucket('service_account.json', 'staging', 'bucket_staging')
+
+        # Then
+        self.assertIs(bucket, bucket_again)
+        mock_storage.Client.assert_called_once()
+        mock_storage.Client().get_bucket.assert_called_once_with('bucket_staging')
+
+
+if __name__ == '__main__':
+    unittest.main()
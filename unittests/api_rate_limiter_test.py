@@ -0,0 +1,106 @@
+import unittest
+from unittest.mock import MagicMock
+import httplib2
+from googleapiclient.errors import HttpError
+from requests import exceptions as requests_exceptions
+from api_rate_limiter import ApiRateLimiter, RetryPolicy, TokenBucket, is_retryable
+
+
+def create_http_error(status: int) -> HttpError:
+    response = MagicMock()
+    response.status = status
+    response.reason = 'error'
+    return HttpError(resp=response, content=b'{}')
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestApiRateLimiter(unittest.TestCase):
+
+    def test_token_bucket_throttles_after_capacity(self):
+        # Given
+        clock = FakeClock()
+        bucket = TokenBucket(capacity=60, refill_per_second=1, clock=clock.time, sleep=clock.sleep)
+
+        # When
+        waits = [bucket.acquire() for _ in range(62)]
+
+        # Then
+        self.assertEqual(sum(1 for wait in waits if wait > 0), 2)
+        self.assertAlmostEqual(clock.now, 2.0)
+
+    def test_execute_stays_within_requests_per_minute(self):
+        # Given
+        clock = FakeClock()
+        limiter = ApiRateLimiter(requests_per_minute={'sheets': 60}, sleep=clock.sleep, clock=clock.time)
+        call_times = []
+
+        # When
+        for _ in range(120):
+            limiter.execute(api='sheets', credential_key='service_account.json',
+                            call=lambda: call_times.append(clock.now))
+
+        # Then
+        self.assertEqual(len([call_time for call_time in call_times if call_time < 60.0]), 60)
+        self.assertEqual(len([call_time for call_time in call_times if 30.0 <= call_time < 90.0]), 60)
+
+    def test_is_retryable(self):
+        self.assertTrue(is_retryable(create_http_error(429)))
+        self.assertTrue(is_retryable(create_http_error(503)))
+        self.assertFalse(is_retryable(create_http_error(404)))
+        self.assertFalse(is_retryable(create_http_error(503), idempotent=False))
+        self.assertTrue(is_retryable(create_http_error(429), idempotent=False))
+
+    def test_is_retryable_transport_errors(self):
+        self.assertTrue(is_retryable(requests_exceptions.ConnectionError('Connection reset by peer')))
+        self.assertTrue(is_retryable(requests_exceptions.ReadTimeout('Read timed out')))
+        self.assertTrue(is_retryable(httplib2.ServerNotFoundError('Unable to find the server')))
+        self.assertTrue(is_retryable(ConnectionResetError()))
+        self.assertFalse(is_retryable(requests_exceptions.ConnectionError('Connection reset by peer'),
+                                      idempotent=False))
+        self.assertFalse(is_retryable(ValueError('not a transport error')))
+
+    def test_execute_retries_with_backoff(self):
+        # Given
+        clock = FakeClock()
+        limiter = ApiRateLimiter(retry_policy=RetryPolicy(max_attempts=4, initial_delay=1), sleep=clock.sleep,
+                                 clock=clock.time)
+        call = MagicMock(side_effect=[create_http_error(429), create_http_error(500), {'valueRanges': []}])
+
+        # When
+        response = limiter.execute(api='sheets', credential_key='service_account.json', call=call)
+
+        # Then
+        self.assertEqual(response, {'valueRanges': []})
+        self.assertEqual(call.call_count, 3)
+        stats = limiter.stats.snapshot()['sheets']
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['failures'], 0)
+
+    def test_execute_raises_when_not_retryable(self):
+        # Given
+        limiter = ApiRateLimiter(sleep=lambda seconds: None)
+        call = MagicMock(side_effect=create_http_error(403))
+
+        # When
+        with self.assertRaises(HttpError):
+            limiter.execute(api='storage', credential_key='service_account.json', call=call)
+
+        # Then
+        call.assert_called_once()
+        self.assertEqual(limiter.stats.snapshot()['storage']['failures'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
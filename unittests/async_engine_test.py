@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from api_rate_limiter import ApiRateLimiter
+from async_engine import AsyncIOEngine, run_independent
+from benchmarks.fake_backends import FakeBucket
+from google_storage_mgmt import GoogleCloudStorageClient
+from run_metrics import RunMetrics
+
+
+class TestAsyncIOEngine(unittest.TestCase):
+
+    def test_calls_overlap_within_concurrency_cap(self):
+        # Given
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def slow_call(index: int) -> int:
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return index
+
+        # When
+        with AsyncIOEngine(max_concurrency=2).activate() as engine:
+            results = engine.run(engine.gather(*[engine.call(slow_call, index) for index in range(6)]))
+
+        # Then
+        self.assertEqual(results, list(range(6)))
+        self.assertEqual(in_flight[1], 2)
+
+    def test_api_calls_of_routed_threads_run_on_engine(self):
+        # Given
+        rate_limiter = ApiRateLimiter.shared()
+        run_metrics = RunMetrics()
+
+        def api_call() -> str:
+            RunMetrics.current().record('upload', bytes=10)
+            return threading.current_thread().name
+
+        # When
+        with AsyncIOEngine(max_concurrency=2).activate(), run_metrics.activate():
+            routed_thread = rate_limiter.execute(api='storage', credential_key='service_account.json', call=api_call)
+            with AsyncIOEngine.routing(enabled=False):
+                unrouted_thread = rate_limiter.execute(api='storage', credential_key='service_account.json',
+                                                       call=api_call)
+
+        # Then
+        self.assertTrue(routed_thread.startswith('async-io'))
+        self.assertEqual(unrouted_thread, threading.current_thread().name)
+        self.assertEqual(run_metrics.stages['upload'].bytes, 20)
+        self.assertIsNone(rate_limiter.call_runner)
+        self.assertIsNone(AsyncIOEngine.active())
+
+    @patch.object(GoogleCloudStorageClient, '_get_bucket')
+    def test_upload_schema_and_data_together(self, mock_get_bucket):
+        # Given
+        bucket = FakeBucket(keep_content=True)
+        mock_get_bucket.return_value = bucket
+        google_storage = GoogleCloudStorageClient(service_account_path='service_account.json', project='staging')
+
+        # When
+        with AsyncIOEngine().activate() as engine:
+            sizes = engine.run(engine.gather(
+                engine.call(google_storage.upload_data_to_gcs, bucket_name='bucket', gcs_file_name='file.schema',
+                            data='[]', content_type='Application/json'),
+                engine.call(google_storage.upload_data_to_gcs, bucket_name='bucket', gcs_file_name='file.csv',
+                            data=iter([b'0,1\n', b'a,b\n']), content_type='text/csv')))
+            independent_sizes = run_independent([lambda: 1, lambda: 2])
+
+        # Then
+        self.assertEqual(sizes, [2, 8])
+        self.assertEqual(independent_sizes, [1, 2])
+        self.assertEqual(bucket.get_blob('file.csv').content, b'0,1\na,b\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
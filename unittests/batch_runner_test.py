@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+import batch_runner
+from api_rate_limiter import ApiRateLimiter
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def test_collect_profile_paths(self):
+        # Given
+        profile_dir = tempfile.mkdtemp()
+        for file_name in ['b.yaml', 'a.yml', 'notes.txt']:
+            open(os.path.join(profile_dir, file_name), 'w').close()
+
+        # When
+        profile_paths = batch_runner.collect_profile_paths([profile_dir, 'single.yaml'])
+
+        # Then
+        self.assertEqual(profile_paths, [os.path.join(profile_dir, 'a.yml'), os.path.join(profile_dir, 'b.yaml'),
+                                         'single.yaml'])
+
+    def test_process_workers_share_rate_limits(self):
+        # Given
+        rate_limiter = ApiRateLimiter(requests_per_minute={'sheets': 60, 'storage': None})
+
+        # When
+        with patch.object(ApiRateLimiter, 'shared', return_value=rate_limiter):
+            requests_per_minute = batch_runner.process_worker_requests_per_minute(workers=4)
+            batch_runner.configure_process_worker(requests_per_minute)
+
+        # Then
+        self.assertEqual(requests_per_minute, {'sheets': 15.0, 'drive': 150.0})
+        self.assertEqual(rate_limiter.requests_per_minute['sheets'], 15.0)
+
+    @patch('batch_runner.main')
+    def test_run_batch_isolates_failures(self, mock_main):
+        # Given
+        def run_profile(profile_item, run_metrics):
+            if profile_item == 'broken':
+                exit(2)
+            run_metrics.record('fetch', rows=10)
+            return MagicMock(row_count=10, output_bytes=100)
+
+        mock_main.ProfileItem.side_effect = lambda config_path, mode, is_clean_sheet, profile_model: \
+            'broken' if config_path == 'broken.yaml' else config_path
+        mock_main.run_profile.side_effect = run_profile
+
+        # When
+        results = batch_runner.run_batch(profile_paths=['a.yaml', 'broken.yaml', 'b.yaml'], mode='hourly',
+                                         is_clean_sheet=False, workers=2)
+
+        # Then
+        self.assertEqual([result.status for result in results],
+                         [batch_runner.STATUS_SUCCESS, batch_runner.STATUS_FAILED, batch_runner.STATUS_SUCCESS])
+        summary = batch_runner.format_summary(results)
+        self.assertIn('succeeded : 2, failed : 1, rows : 20, bytes : 200', summary)
+        self.assertEqual(results[0].metrics['stages']['fetch']['rows'], 10)
+        self.assertEqual(results[1].metrics['status'], batch_runner.STATUS_FAILED)
+
+    @patch('batch_runner.main')
+    def test_run_batch_asyncio_schedules_api_calls_on_engine(self, mock_main):
+        # Given
+        def run_profile(profile_item, run_metrics):
+            thread_name = ApiRateLimiter.shared().execute(api='sheets', credential_key=profile_item,
+                                                          call=lambda: threading.current_thread().name)
+            return MagicMock(row_count=1 if thread_name.startswith('async-io') else 0, output_bytes=0)
+
+        mock_main.ProfileItem.side_effect = lambda config_path, mode, is_clean_sheet, profile_model: config_path
+        mock_main.run_profile.side_effect = run_profile
+
+        # When
+        results = batch_runner.run_batch(profile_paths=['a.yaml', 'b.yaml', 'c.yaml'], mode='hourly',
+                                         is_clean_sheet=False, workers=3, executor_type=batch_runner.EXECUTOR_ASYNCIO,
+                                         io_concurrency=2)
+
+        # Then
+        self.assertEqual([result.status for result in results], [batch_runner.STATUS_SUCCESS] * 3)
+        self.assertEqual([result.row_count for result in results], [1, 1, 1])
+        self.assertIsNone(ApiRateLimiter.shared().call_runner)
+
+
+if __name__ == '__main__':
+    unittest.main()
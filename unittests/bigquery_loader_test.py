@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from google.api_core import exceptions
+from bigquery_loader import BigQueryLoadRequest, GoogleBigQueryLoader
+from run_metrics import RunMetrics
+
+
+class TestBigQueryLoader(unittest.TestCase):
+
+    def create_load_request(self, source_uri: str = 'gs://bucket/orders/2018/08/orders_1.csv') -> BigQueryLoadRequest:
+        return BigQueryLoadRequest(source_uri=source_uri, table_id='staging.sheets.orders',
+                                   schema=[{'name': 'created', 'type': 'timestamp', 'mode': 'nullable'}],
+                                   source_format='CSV', partition_type='DAY', partition_field='created')
+
+    def test_load_request_job_id_is_stable_per_request(self):
+        # Given
+        load_request = self.create_load_request()
+
+        # When
+        retry_job_id = load_request.job_id
+        next_run_job_id = self.create_load_request().job_id
+        other_job_id = self.create_load_request(source_uri='gs://bucket/orders/2018/08/orders_2.csv').job_id
+
+        # Then
+        self.assertEqual(load_request.job_id, retry_job_id)
+        self.assertNotEqual(load_request.job_id, next_run_job_id)
+        self.assertNotEqual(load_request.job_id, other_job_id)
+        self.assertEqual(load_request.skip_leading_rows, 1)
+        self.assertEqual(load_request.write_disposition, 'WRITE_APPEND')
+
+    @patch('bigquery_loader.ApiClientCache')
+    def test_load_finds_job_submitted_by_lost_attempt(self, mock_api_client_cache):
+        # Given
+        client = mock_api_client_cache.shared.return_value.get_bigquery_client.return_value
+        client.load_table_from_uri.side_effect = exceptions.Conflict('Already Exists: Job')
+        client.get_job.return_value = MagicMock(job_id='sheet_export_1', output_rows=42)
+        load_request = self.create_load_request()
+        run_metrics = RunMetrics()
+
+        # When
+        with patch('bigquery_loader.bigquery', new=MagicMock()) as mock_bigquery, run_metrics.activate():
+            result = GoogleBigQueryLoader(service_account_file='service_account.json', project='staging').load(
+                load_request)
+
+        # Then
+        self.assertEqual(result, {'job_id': 'sheet_export_1', 'output_rows': 42})
+        client.get_job.assert_called_once_with(load_request.job_id)
+        client.get_job.return_value.result.assert_called_once_with(timeout=None)
+        mock_bigquery.SchemaField.assert_called_once_with('created', 'TIMESTAMP', mode='NULLABLE')
+        mock_bigquery.TimePartitioning.assert_called_once_with(type_='DAY', field='created')
+        self.assertEqual(run_metrics.stages['load'].rows, 42)
+
+
+if __name__ == '__main__':
+    unittest.main()
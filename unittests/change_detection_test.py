@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import pandas
+from change_detection import ChangeDetector, hash_dataframes
+from export_state import ExportStateStore
+
+
+class TestChangeDetection(unittest.TestCase):
+
+    def test_hash_dataframes_ignores_chunking(self):
+        # Given
+        data = pandas.DataFrame([['a', '1'], ['b', '2'], ['c', '3']], index=[2, 3, 4])
+        changed = data.copy()
+        changed.loc[4, 1] = '4'
+
+        # When
+        whole_hash = hash_dataframes([data])
+        chunked_hash = hash_dataframes([data.loc[[2]], data.loc[[3, 4]]])
+
+        # Then
+        self.assertEqual(whole_hash, chunked_hash)
+        self.assertNotEqual(whole_hash, hash_dataframes([changed]))
+
+    def test_change_detector(self):
+        # Given
+        export_state_store = ExportStateStore(state_path=tempfile.mkdtemp())
+        drive_mgmt = MagicMock()
+        drive_mgmt.get_drive_revision.return_value = {'version': '12', 'modified_time': '2018-08-09T01:02:03.000Z'}
+        data = pandas.DataFrame([['a', '1']])
+        first_run = ChangeDetector(export_state_store, drive_mgmt, google_doc_id='doc_1', google_sheet_id=0,
+                                   state_key='hourly:profile.yaml')
+
+        # When
+        first_revision_unchanged = first_run.is_revision_unchanged()
+        first_content_unchanged = first_run.is_content_unchanged([data])
+        first_run.save()
+        second_run = ChangeDetector(export_state_store, drive_mgmt, google_doc_id='doc_1', google_sheet_id=0,
+                                    state_key='hourly:profile.yaml')
+        daily_run = ChangeDetector(export_state_store, drive_mgmt, google_doc_id='doc_1', google_sheet_id=0,
+                                   state_key='daily:profile.yaml')
+        second_revision_unchanged = second_run.is_revision_unchanged()
+        daily_revision_unchanged = daily_run.is_revision_unchanged()
+        drive_mgmt.get_drive_revision.side_effect = Exception('insufficient scopes')
+        third_run = ChangeDetector(export_state_store, drive_mgmt, google_doc_id='doc_1', google_sheet_id=0,
+                                   state_key='hourly:profile.yaml')
+
+        # Then
+        self.assertFalse(first_revision_unchanged)
+        self.assertFalse(first_content_unchanged)
+        self.assertTrue(second_revision_unchanged)
+        self.assertFalse(daily_revision_unchanged)
+        self.assertFalse(third_run.is_revision_unchanged())
+        self.assertTrue(third_run.is_content_unchanged([data]))
+
+
+    def test_change_detector_after_clean_decides_on_content(self):
+        # Given
+        export_state_store = ExportStateStore(state_path=tempfile.mkdtemp())
+        drive_mgmt = MagicMock()
+        drive_mgmt.get_drive_revision.return_value = {'version': '13', 'modified_time': '2018-08-09T02:00:00.000Z'}
+        cleaning_run = ChangeDetector(export_state_store, drive_mgmt, google_doc_id='doc_1', google_sheet_id=0,
+                                      state_key='hourly:profile.yaml')
+        cleaning_run.is_revision_unchanged()
+        cleaning_run.is_content_unchanged([pandas.DataFrame([['a', '1']])])
+
+        # When
+        cleaning_run.save(is_sheet_cleaned=True)
+        next_run = ChangeDetector(export_state_store, drive_mgmt, google_doc_id='doc_1', google_sheet_id=0,
+                                  state_key='hourly:profile.yaml')
+
+        # Then
+        self.assertFalse(next_run.is_revision_unchanged())
+        self.assertTrue(next_run.is_content_unchanged([pandas.DataFrame()]))
+        self.assertFalse(next_run.is_content_unchanged([pandas.DataFrame([['b', '2']])]))
+
+if __name__ == '__main__':
+    unittest.main()
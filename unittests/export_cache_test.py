@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from export_cache import ExportCache
+
+
+def write_file(directory: str, name: str, content: bytes) -> str:
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as file_obj:
+        file_obj.write(content)
+    return path
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestExportCache(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.clock = Clock()
+        self.export_cache = ExportCache(cache_dir=tempfile.mkdtemp(), max_bytes=35, max_age_seconds=100,
+                                        clock=self.clock)
+
+    def store_slot(self, slot: str, data: bytes, schema: bytes = b'[]'):
+        self.clock.now += 1
+        uploads = [{'bucket': 'bucket', 'name': slot + '.schema', 'content_type': 'Application/json',
+                    'local_path': write_file(self.output_dir, slot + '.schema', schema)},
+                   {'bucket': 'bucket', 'name': slot + '.csv', 'content_type': 'text/csv',
+                    'local_path': write_file(self.output_dir, slot + '.csv', data)}]
+        return self.export_cache.store(profile_key='profile', slot_name=slot + '.csv', uploads=uploads,
+                                       metadata={'row_delete_index': 11})
+
+    def test_store_keeps_identical_content_once(self):
+        # Given
+        first = self.store_slot('slot_1', b'0123456789')
+        second = self.store_slot('slot_2', b'abcdefghij')
+
+        # When
+        self.export_cache.mark_uploaded(first)
+        pending = self.export_cache.entries('profile', pending_only=True)
+
+        # Then
+        self.assertEqual(first.objects[0]['sha256'], second.objects[0]['sha256'])
+        self.assertEqual([entry.metadata['slot_name'] for entry in pending], ['slot_2.csv'])
+        self.assertEqual(pending[0].metadata['row_delete_index'], 11)
+        with open(self.export_cache.object_path(second.objects[1]['sha256']), 'rb') as file_obj:
+            self.assertEqual(file_obj.read(), b'abcdefghij')
+
+    def test_evict_uploaded_entries_by_size_and_every_entry_by_age(self):
+        # Given
+        entries = [self.store_slot('slot_' + str(index), str(index).encode('utf-8') * 10) for index in range(3)]
+        pending = self.store_slot('slot_pending', b'p' * 10)
+
+        # When
+        for entry in entries:
+            self.export_cache.mark_uploaded(entry)
+        kept_by_size = [entry.metadata['slot_name'] for entry in self.export_cache.entries('profile')]
+        self.clock.now += 101
+        self.export_cache.evict()
+
+        # Then
+        self.assertEqual(kept_by_size, ['slot_1.csv', 'slot_2.csv', 'slot_pending.csv'])
+        self.assertFalse(os.path.exists(self.export_cache.object_path(entries[0].objects[1]['sha256'])))
+        self.assertEqual(self.export_cache.entries('profile'), [])
+        self.assertFalse(os.path.exists(self.export_cache.object_path(pending.objects[1]['sha256'])))
+
+
+    def test_evict_waits_for_store_in_progress(self):
+        # Given
+        other_process_cache = ExportCache(cache_dir=self.export_cache.cache_dir, max_bytes=35, max_age_seconds=100,
+                                          clock=self.clock)
+        write_entry = ExportCache._write_entry
+        evictions = []
+
+        def write_entry_during_eviction(export_cache, entry):
+            eviction = threading.Thread(target=other_process_cache.evict)
+            eviction.start()
+            eviction.join(timeout=0.2)
+            evictions.append(eviction.is_alive())
+            write_entry(export_cache, entry)
+
+        # When
+        with patch.object(ExportCache, '_write_entry', write_entry_during_eviction):
+            entry = self.store_slot('slot_1', b'0123456789')
+        other_process_cache.evict()
+
+        # Then
+        self.assertEqual(evictions, [True])
+        for cached_object in entry.objects:
+            self.assertTrue(os.path.exists(self.export_cache.object_path(cached_object['sha256'])))
+
+if __name__ == '__main__':
+    unittest.main()
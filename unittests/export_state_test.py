@@ -0,0 +1,39 @@
+import tempfile
+import unittest
+from export_state import ExportStateStore, SheetWatermark
+
+
+class TestExportStateStore(unittest.TestCase):
+
+    def test_save_and_load_watermark(self):
+        # Given
+        store = ExportStateStore(state_path=tempfile.mkdtemp() + '/state')
+        watermark = SheetWatermark.from_row(row_values=['08/09/2018 01:02:03', '812345678'], row_index=42)
+
+        # When
+        store.save_watermark(google_doc_id='12345', google_sheet_id=0, watermark=watermark)
+        store.update(google_doc_id='12345', google_sheet_id=0, other='value')
+        loaded = store.load_watermark(google_doc_id='12345', google_sheet_id=0)
+
+        # Then
+        self.assertEqual(loaded.row_index, 42)
+        self.assertTrue(loaded.matches(['08/09/2018 01:02:03', '812345678']))
+        self.assertFalse(loaded.matches(['08/09/2018 01:02:03', '812345679']))
+        self.assertEqual(store.load(google_doc_id='12345', google_sheet_id=0)['other'], 'value')
+
+    def test_clear_watermark(self):
+        # Given
+        store = ExportStateStore(state_path=tempfile.mkdtemp())
+        store.save_watermark(google_doc_id='12345', google_sheet_id=0,
+                             watermark=SheetWatermark(row_index=3, row_hash='hash'))
+
+        # When
+        store.save_watermark(google_doc_id='12345', google_sheet_id=0, watermark=None)
+
+        # Then
+        self.assertIsNone(store.load_watermark(google_doc_id='12345', google_sheet_id=0))
+        self.assertIsNone(store.load_watermark(google_doc_id='other', google_sheet_id=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
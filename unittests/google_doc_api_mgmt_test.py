@@ -0,0 +1,328 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from google_doc_api_mgmt import GoogleDocAPIMGMT, SheetExportStats
+from global_constant import GlobalConstant
+from api_rate_limiter import ApiRateLimiter
+from sheet_range import SheetRange
+from row_fingerprints import SheetRowFingerprints
+from transform_inputs import TransformInputs
+
+
+def create_sheet_rows(row_count: int):
+    rows = [['timestamp', 'mobile', 'name']]
+    for index in range(row_count):
+        rows.append(['08/09/2018 01:02:' + str(index % 60).zfill(2), '8' + str(index).zfill(8), 'name_' + str(index)])
+    rows[5] = []
+    rows[9] = rows[9][:1]
+    return rows
+
+
+def create_mock_sheets_service(sheet_rows: []):
+    service = MagicMock()
+
+    def get_value_range(ranges: str):
+        sheet_range = SheetRange.parse(ranges)
+        end_row = min(sheet_range.end_row or len(sheet_rows), len(sheet_rows))
+        start_col = SheetRange.column_to_index(sheet_range.start_col)
+        end_col = SheetRange.column_to_index(sheet_range.end_col)
+        values = [row[start_col:end_col + 1] for row in sheet_rows[sheet_range.start_row - 1:end_row]]
+        while values and not values[-1]:
+            values = values[:-1]
+        value_range = {'range': sheet_range.with_rows(sheet_range.start_row, end_row).to_a1()}
+        if values:
+            value_range['values'] = values
+        return value_range
+
+    def batch_get(spreadsheetId, ranges, **kwargs):
+        request = MagicMock()
+        request.execute.return_value = {
+            'valueRanges': [get_value_range(name) for name in ([ranges] if isinstance(ranges, str) else ranges)]}
+        return request
+
+    service.spreadsheets().values().batchGet.side_effect = batch_get
+    service.spreadsheets().get().execute.return_value = {
+        'sheets': [{'properties': {'gridProperties': {'rowCount': len(sheet_rows) + 50}}}]}
+    return service
+
+
+class TestSheetRange(unittest.TestCase):
+
+    def test_parse_and_split_rows(self):
+        # Given
+        sheet_range = SheetRange.parse("'Form Responses 1'!A2:Z")
+
+        # When
+        windows = sheet_range.split_rows(chunk_rows=5000, last_row=12000)
+
+        # Then
+        self.assertEqual([window.to_a1() for window in windows],
+                         ["'Form Responses 1'!A2:Z5001", "'Form Responses 1'!A5002:Z10001",
+                          "'Form Responses 1'!A10002:Z12000"])
+        self.assertEqual(sheet_range.column_count(), 26)
+
+    def test_parse_invalid_range(self):
+        with self.assertRaises(ValueError):
+            SheetRange.parse('not a range')
+
+
+class TestGoogleDocAPIMGMT(unittest.TestCase):
+
+    def setUp(self):
+        self.drive_mgmt = GoogleDocAPIMGMT(scopes=['scope'], service_account_file='service_account.json')
+        self.transform_inputs = TransformInputs()
+        self.transform_inputs.convert_transform_inputs(mobile_column_inputs=[1], timestamp_column_inputs=[0])
+        self.output_dir = tempfile.mkdtemp()
+        ApiRateLimiter.shared().configure(api='sheets', requests_per_minute=None)
+
+    def tearDown(self):
+        ApiRateLimiter.shared().configure(api='sheets',
+                                          requests_per_minute=ApiRateLimiter.DEFAULT_REQUESTS_PER_MINUTE['sheets'])
+
+    def download(self, service, chunk_rows=None):
+        output_path = os.path.join(self.output_dir, 'chunk_' + str(chunk_rows) + '.csv')
+        with patch.object(GoogleDocAPIMGMT, '_create_api_service', return_value=service):
+            _, deleted_row_index_end = self.drive_mgmt.download_sheets_ranges_csv(
+                file_id='12345', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE, ranges='A2:Z',
+                output_path=output_path, sheet_timestamp='%m/%d/%Y %H:%M:%S', transform_inputs=self.transform_inputs,
+                chunk_rows=chunk_rows)
+        with open(output_path) as file_obj:
+            return file_obj.read(), deleted_row_index_end
+
+    def test_chunked_download_matches_single_batch_get(self):
+        # Given
+        service = create_mock_sheets_service(create_sheet_rows(row_count=103))
+
+        # When
+        expected_content, expected_index = self.download(service)
+        content, deleted_row_index_end = self.download(service, chunk_rows=10)
+
+        # Then
+        self.assertEqual(content, expected_content)
+        self.assertEqual(deleted_row_index_end, expected_index)
+        self.assertEqual(deleted_row_index_end, 103)
+
+    def test_chunked_download_writes_every_chunk_with_header_width(self):
+        # Given
+        sheet_rows = [row[:2] for row in create_sheet_rows(row_count=15)[:12]] + create_sheet_rows(row_count=30)[12:]
+        service = create_mock_sheets_service(sheet_rows)
+        self.transform_inputs.set_column_count(3)
+
+        # When
+        expected_content, _ = self.download(service)
+        content, _ = self.download(service, chunk_rows=10)
+
+        # Then
+        self.assertEqual(content, expected_content)
+        self.assertEqual({line.count(',') for line in content.splitlines()}, {2})
+
+    def test_chunked_download_with_empty_range(self):
+        # Given
+        service = create_mock_sheets_service([['header']])
+
+        # When
+        with self.assertRaises(SystemExit) as exit_exception:
+            self.download(service, chunk_rows=10)
+
+        # Then
+        self.assertEqual(exit_exception.exception.code, 2)
+
+    def fetch_incremental(self, service, export_stats, chunk_rows=None):
+        with patch.object(GoogleDocAPIMGMT, '_create_api_service', return_value=service):
+            if chunk_rows:
+                return list(self.drive_mgmt.iter_transformed_range_chunks(
+                    file_id='12345', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE, ranges='A2:Z',
+                    sheet_timestamp='%m/%d/%Y %H:%M:%S', transform_inputs=self.transform_inputs,
+                    chunk_rows=chunk_rows, export_stats=export_stats))
+            data, _ = self.drive_mgmt.fetch_sheets_ranges_dataframe(
+                file_id='12345', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE, ranges='A2:Z',
+                sheet_timestamp='%m/%d/%Y %H:%M:%S', transform_inputs=self.transform_inputs,
+                export_stats=export_stats)
+            return [data]
+
+    def test_incremental_fetch_reads_rows_after_watermark(self):
+        # Given
+        sheet_rows = create_sheet_rows(row_count=40)
+        first_stats = SheetExportStats()
+        self.fetch_incremental(create_mock_sheets_service(sheet_rows), first_stats)
+        sheet_rows.extend(create_sheet_rows(row_count=15)[-7:])
+
+        for chunk_rows in [None, 4]:
+            # When
+            export_stats = SheetExportStats(watermark=first_stats.watermark)
+            chunks = self.fetch_incremental(create_mock_sheets_service(sheet_rows), export_stats, chunk_rows)
+
+            # Then
+            self.assertEqual([index for data in chunks for index in data.index], list(range(42, 49)))
+            self.assertEqual(export_stats.row_count, 7)
+            self.assertEqual(export_stats.watermark.row_index, 48)
+            self.assertEqual(export_stats.deleted_row_index_end(), 48)
+
+    def test_incremental_fetch_without_new_rows(self):
+        # Given
+        sheet_rows = create_sheet_rows(row_count=40)
+        first_stats = SheetExportStats()
+        self.fetch_incremental(create_mock_sheets_service(sheet_rows), first_stats)
+
+        # When
+        export_stats = SheetExportStats(watermark=first_stats.watermark)
+        chunks = self.fetch_incremental(create_mock_sheets_service(sheet_rows), export_stats)
+
+        # Then
+        self.assertTrue(chunks[0].empty)
+        self.assertEqual(export_stats.watermark.row_index, 41)
+
+    def test_incremental_fetch_with_changed_watermark_row_reads_whole_range(self):
+        # Given
+        sheet_rows = create_sheet_rows(row_count=40)
+        first_stats = SheetExportStats()
+        self.fetch_incremental(create_mock_sheets_service(sheet_rows), first_stats)
+        sheet_rows[40] = ['08/09/2018 01:02:03', '812345678', 'edited']
+
+        # When
+        export_stats = SheetExportStats(watermark=first_stats.watermark)
+        chunks = self.fetch_incremental(create_mock_sheets_service(sheet_rows), export_stats)
+
+        # Then
+        self.assertEqual(export_stats.row_count, 39)
+        self.assertEqual(export_stats.watermark.row_index, 41)
+
+    def test_fetch_sheets_multi_ranges_dataframes(self):
+        # Given
+        service = create_mock_sheets_service(create_sheet_rows(row_count=30))
+        name_only_inputs = TransformInputs()
+
+        # When
+        with patch.object(GoogleDocAPIMGMT, '_create_api_service', return_value=service):
+            results = self.drive_mgmt.fetch_sheets_multi_ranges_dataframes(
+                file_id='12345', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                range_specs=[('A2:C11', '%m/%d/%Y %H:%M:%S', self.transform_inputs),
+                             ('C12:C', '%m/%d/%Y %H:%M:%S', name_only_inputs),
+                             ('A100:C', '%m/%d/%Y %H:%M:%S', name_only_inputs)])
+
+        # Then
+        service.spreadsheets().values().batchGet.assert_called_once_with(spreadsheetId='12345',
+                                                                         ranges=['A2:C11', 'C12:C', 'A100:C'])
+        self.assertEqual([deleted_row_index_end for _, deleted_row_index_end in results], [10, 21, 1])
+        self.assertEqual(results[0][0].iloc[0].tolist(), ['2018-08-09 01:02:00', '0800000000', 'name_0'])
+        self.assertEqual(results[1][0].iloc[0].tolist(), ['name_10'])
+        self.assertTrue(results[2][0].empty)
+
+    def test_fetch_sheets_multi_ranges_dataframes_conforms_to_schema_width(self):
+        # Given
+        service = create_mock_sheets_service(create_sheet_rows(row_count=30))
+        narrow_schema_inputs = TransformInputs()
+        narrow_schema_inputs.set_column_count(2)
+        wide_schema_inputs = TransformInputs()
+        wide_schema_inputs.set_column_count(4)
+
+        # When
+        with patch.object(GoogleDocAPIMGMT, '_create_api_service', return_value=service):
+            results = self.drive_mgmt.fetch_sheets_multi_ranges_dataframes(
+                file_id='12345', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                range_specs=[('A12:C', '%m/%d/%Y %H:%M:%S', narrow_schema_inputs),
+                             ('A12:C', '%m/%d/%Y %H:%M:%S', wide_schema_inputs)])
+
+        # Then
+        self.assertEqual(results[0][0].shape[1], 2)
+        self.assertEqual(results[0][0].iloc[0].tolist(), ['08/09/2018 01:02:10', '800000010'])
+        self.assertEqual(results[1][0].shape[1], 4)
+        self.assertEqual(results[1][0].iloc[0].tolist()[:3], ['08/09/2018 01:02:10', '800000010', 'name_10'])
+        self.assertTrue(results[1][0].iloc[:, 3].isnull().all())
+
+    def test_delete_sheets_rows_by_index_skips_empty_range(self):
+        # Given
+        service = MagicMock()
+
+        # When
+        with patch.object(GoogleDocAPIMGMT, '_create_api_service', return_value=service):
+            self.drive_mgmt.delete_sheets_rows_by_index(file_id='12345', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                                                        sheet_id=0, end_index=GoogleDocAPIMGMT.DELETE_ROW_INDEX_START)
+            self.drive_mgmt.delete_sheets_rows_by_index(file_id='12345', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE,
+                                                        sheet_id=0, end_index=11)
+
+        # Then
+        service.spreadsheets().batchUpdate.assert_called_once()
+        delete_request = service.spreadsheets().batchUpdate.call_args[1]['body']['requests'][0]
+        self.assertEqual((delete_request['deleteDimension']['range']['startIndex'],
+                          delete_request['deleteDimension']['range']['endIndex']), (1, 11))
+
+    def test_typed_fetch_reads_unformatted_values(self):
+        # Given
+        service = create_mock_sheets_service([['created', 'mobile'], [43321 + 3723 / 86400, 812345678]])
+        self.transform_inputs.set_typed_schema([{'name': 'created', 'type': 'TIMESTAMP'},
+                                                {'name': 'mobile', 'type': 'STRING'}])
+
+        # When
+        content, _ = self.download(service, chunk_rows=10)
+
+        # Then
+        self.assertEqual(service.spreadsheets().values().batchGet.call_args[1]['valueRenderOption'],
+                         'UNFORMATTED_VALUE')
+        self.assertEqual(service.spreadsheets().values().batchGet.call_args[1]['dateTimeRenderOption'],
+                         'SERIAL_NUMBER')
+        self.assertEqual(content.splitlines()[1], '2018-08-09 01:02:03,0812345678')
+
+    def test_delete_verified_rows(self):
+        # Given
+        sheet_rows = create_sheet_rows(row_count=103)
+        service = create_mock_sheets_service(sheet_rows)
+        sheet_rows[25] = []
+        export_stats = SheetExportStats(row_fingerprints=SheetRowFingerprints('A2:Z', block_rows=25))
+        self.fetch_incremental(service, export_stats)
+        sheet_rows[29] = ['08/09/2018 01:02:03', '812345678', 'edited during the run']
+        sheet_rows.append(['08/09/2018 01:02:03', '812345678', 'appended during the run'])
+
+        # When
+        with patch.object(GoogleDocAPIMGMT, '_create_api_service', return_value=service):
+            deleted_row_count = self.drive_mgmt.delete_verified_rows(
+                file_id='12345', service_type=GlobalConstant.GOOGLE_SHEETS_TYPE, sheet_id=0,
+                row_fingerprints=export_stats.row_fingerprints)
+
+        # Then
+        request_body = service.spreadsheets().batchUpdate.call_args[1]['body']
+        self.assertEqual([(request['deleteDimension']['range']['startIndex'],
+                           request['deleteDimension']['range']['endIndex']) for request in request_body['requests']],
+                         [(51, 104), (1, 26)])
+        self.assertEqual(deleted_row_count, 78)
+        self.assertEqual(export_stats.row_fingerprints.blocks[0].end_row, 26)
+
+    def test_download_sheet_file_resumes_after_transient_failure(self):
+        # Given
+        content = bytes(range(256)) * 40
+        requested_ranges = []
+
+        def http_request(uri, method='GET', headers=None, **kwargs):
+            start, end = [int(value) for value in headers['range'][len('bytes='):].split('-')]
+            requested_ranges.append(start)
+            if len(requested_ranges) == 3:
+                raise ConnectionResetError('connection reset')
+            response = MagicMock(status=206)
+            response_headers = {'content-range': 'bytes %d-%d/%d' % (start, end, len(content))}
+            response.__contains__.side_effect = response_headers.__contains__
+            response.__getitem__.side_effect = response_headers.__getitem__
+            return response, content[start:end + 1]
+
+        request = MagicMock(uri='https://drive/export', headers={})
+        request.http.request.side_effect = http_request
+        service = MagicMock()
+        service.files().export_media.return_value = request
+        output_path = os.path.join(tempfile.mkdtemp(), 'workbook.xlsx')
+        drive_mgmt = GoogleDocAPIMGMT(scopes=['scope'], service_account_file='service_account.json',
+                                      download_chunk_size=4096)
+
+        # When
+        with patch.object(GoogleDocAPIMGMT, '_create_api_service', return_value=service), \
+                patch('api_rate_limiter.random.uniform', return_value=0):
+            drive_mgmt.download_sheet_file(file_id='12345', mime_type='application/pdf', output_path=output_path,
+                                           service_type=GlobalConstant.GOOGLE_DRIVE_TYPE)
+
+        # Then
+        with open(output_path, 'rb') as file_obj:
+            self.assertEqual(file_obj.read(), content)
+        self.assertEqual(requested_ranges, [0, 4096, 8192, 8192])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from benchmarks.fake_backends import FakeBlob, FakeBucket
+from google_storage_mgmt import GoogleCloudStorageClient, IterableReader, StagedPublish, PublishConflictError
+
+
+def create_mock_bucket(uploads: []):
+    def create_blob(name):
+        blob = MagicMock()
+        blob.chunk_size = None
+
+        def upload_from_file(file_obj, size=None, content_type=None):
+            uploads.append((name, blob.chunk_size, size, file_obj.read(), content_type))
+
+        blob.upload_from_file.side_effect = upload_from_file
+        return blob
+
+    bucket = MagicMock()
+    bucket.blob.side_effect = create_blob
+    return bucket
+
+
+class TestGoogleCloudStorageClient(unittest.TestCase):
+
+    def test_iterable_reader(self):
+        # Given
+        reader = IterableReader([b'abc', b'', b'defg'])
+
+        # When
+        first = reader.read(2)
+        rest = reader.read()
+
+        # Then
+        self.assertEqual(first + rest, b'abcdefg')
+        self.assertEqual(reader.tell(), 7)
+
+    @patch.object(GoogleCloudStorageClient, '_get_bucket')
+    def test_upload_data_to_gcs_from_memory(self, mock_get_bucket):
+        # Given
+        uploads = []
+        mock_get_bucket.return_value = create_mock_bucket(uploads)
+        google_storage = GoogleCloudStorageClient(service_account_path='service_account.json', project='staging')
+
+        # When
+        schema_size = google_storage.upload_data_to_gcs(bucket_name='bucket_staging', gcs_file_name='file.schema',
+                                                        data='[]', content_type='Application/json')
+        data_size = google_storage.upload_data_to_gcs(bucket_name='bucket_staging', gcs_file_name='file.csv',
+                                                      data=iter([b'0,1\n', b'a,b\n']), content_type='text/csv')
+
+        # Then
+        self.assertEqual(schema_size, 2)
+        self.assertEqual(data_size, 8)
+        self.assertEqual(uploads[0], ('file.schema', None, 2, b'[]', 'Application/json'))
+        self.assertEqual(uploads[1], ('file.csv', GoogleCloudStorageClient.UPLOAD_CHUNK_SIZE, None, b'0,1\na,b\n',
+                                      'text/csv'))
+
+    def write_temporary_file(self, data: bytes) -> str:
+        file_descriptor, path = tempfile.mkstemp()
+        with os.fdopen(file_descriptor, 'wb') as file_obj:
+            file_obj.write(data)
+        self.addCleanup(os.remove, path)
+        return path
+
+    @patch.object(GoogleCloudStorageClient, 'MAX_COMPOSE_SOURCES', 3)
+    @patch.object(GoogleCloudStorageClient, '_get_bucket')
+    def test_upload_file_to_gcs_composite(self, mock_get_bucket):
+        # Given
+        data = bytes(range(256)) * 40
+        local_file_path = self.write_temporary_file(data)
+        bucket = FakeBucket(keep_content=True)
+        mock_get_bucket.return_value = bucket
+        google_storage = GoogleCloudStorageClient(service_account_path='service_account.json', project='staging',
+                                                  composite_upload_threshold=1024, composite_part_size=1000)
+
+        # When
+        google_storage.upload_file_to_gcs(bucket_name='benchmark_bucket', gcs_file_name='file.csv',
+                                          local_file_path=local_file_path, content_type='text/csv')
+
+        # Then
+        self.assertEqual(list(bucket.blobs.keys()), ['file.csv'])
+        self.assertEqual(bucket.blobs['file.csv'].content, data)
+        self.assertEqual(bucket.blobs['file.csv'].content_type, 'text/csv')
+        # 11 parts are composed into 4 intermediates, 3 of them into one more, then into the destination.
+        self.assertEqual(bucket.compose_calls, 6)
+
+    @patch.object(GoogleCloudStorageClient, '_get_bucket')
+    def test_upload_file_to_gcs_composite_crc32c_mismatch(self, mock_get_bucket):
+        # Given
+        local_file_path = self.write_temporary_file(b'x' * 3000)
+        bucket = FakeBucket(keep_content=True)
+        mock_get_bucket.return_value = bucket
+        google_storage = GoogleCloudStorageClient(service_account_path='service_account.json', project='staging',
+                                                  composite_upload_threshold=1024, composite_part_size=1000)
+
+        # When
+        with patch('google_storage_mgmt.file_crc32c', return_value='AAAAAA=='):
+            with self.assertRaises(IOError):
+                google_storage.upload_file_to_gcs(bucket_name='benchmark_bucket', gcs_file_name='file.csv',
+                                                  local_file_path=local_file_path, content_type='text/csv')
+
+        # Then
+        self.assertEqual(bucket.blobs, {})
+
+    @patch.object(GoogleCloudStorageClient, '_get_bucket')
+    def test_upload_file_to_gcs_composite_part_failure(self, mock_get_bucket):
+        # Given
+        local_file_path = self.write_temporary_file(b'x' * 3000)
+        bucket = FakeBucket(keep_content=True)
+        mock_get_bucket.return_value = bucket
+        google_storage = GoogleCloudStorageClient(service_account_path='service_account.json', project='staging',
+                                                  composite_upload_threshold=1024, composite_part_size=1000)
+        upload_from_file = FakeBlob.upload_from_file
+
+        def fail_first_part(blob, file_obj, size=None, content_type=None, **kwargs):
+            if blob.name.endswith('/00000'):
+                raise ValueError('part upload failed')
+            upload_from_file(blob, file_obj, size=size, content_type=content_type, **kwargs)
+
+        # When
+        with patch.object(FakeBlob, 'upload_from_file', fail_first_part):
+            with self.assertRaises(ValueError):
+                google_storage.upload_file_to_gcs(bucket_name='benchmark_bucket', gcs_file_name='file.csv',
+                                                  local_file_path=local_file_path, content_type='text/csv')
+
+        # Then
+        self.assertEqual(bucket.blobs, {})
+
+    def upload_staged(self, staged_publish: StagedPublish, google_storage: GoogleCloudStorageClient, data: str):
+        for final_name, content in [('2018/file.csv', data), ('2018/file.schema', '[]')]:
+            google_storage.upload_data_to_gcs(bucket_name='benchmark_bucket',
+                                              gcs_file_name=staged_publish.staging_name(final_name), data=content,
+                                              content_type='text/plain')
+
+    @patch.object(GoogleCloudStorageClient, '_get_bucket')
+    def test_staged_publish(self, mock_get_bucket):
+        # Given
+        bucket = FakeBucket(keep_content=True)
+        mock_get_bucket.return_value = bucket
+        google_storage = GoogleCloudStorageClient(service_account_path='service_account.json', project='staging')
+        staged_publish = StagedPublish(google_storage=google_storage, bucket_name='benchmark_bucket',
+                                       final_names=['2018/file.csv', '2018/file.schema'], success_marker=True)
+
+        # When
+        self.upload_staged(staged_publish, google_storage, 'a,b\n')
+        is_published_before = staged_publish.is_published()
+        staged_publish.promote()
+        staged_publish.discard()
+
+        # Then
+        self.assertFalse(is_published_before)
+        self.assertTrue(staged_publish.is_published())
+        self.assertEqual(sorted(bucket.blobs.keys()), ['2018/file.csv', '2018/file.csv._SUCCESS', '2018/file.schema'])
+        self.assertEqual(bucket.blobs['2018/file.csv'].content, b'a,b\n')
+
+    @patch.object(GoogleCloudStorageClient, '_get_bucket')
+    def test_staged_publish_existing_objects(self, mock_get_bucket):
+        # Given
+        bucket = FakeBucket(keep_content=True)
+        mock_get_bucket.return_value = bucket
+        google_storage = GoogleCloudStorageClient(service_account_path='service_account.json', project='staging')
+        first_publish = StagedPublish(google_storage=google_storage, bucket_name='benchmark_bucket',
+                                      final_names=['2018/file.csv', '2018/file.schema'])
+        self.upload_staged(first_publish, google_storage, 'a,b\n')
+        first_publish.promote()
+        same_publish = StagedPublish(google_storage=google_storage, bucket_name='benchmark_bucket',
+                                     final_names=['2018/file.csv', '2018/file.schema'])
+        changed_publish = StagedPublish(google_storage=google_storage, bucket_name='benchmark_bucket',
+                                        final_names=['2018/file.csv', '2018/file.schema'])
+
+        # When
+        self.upload_staged(same_publish, google_storage, 'a,b\n')
+        same_publish.promote()
+        self.upload_staged(changed_publish, google_storage, 'a,b\nc,d\n')
+        with self.assertRaises(PublishConflictError):
+            changed_publish.promote()
+
+        # Then
+        self.assertEqual(bucket.blobs['2018/file.csv'].content, b'a,b\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
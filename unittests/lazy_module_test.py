@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+import unittest
+from lazy_module import LazyModule
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestLazyModule(unittest.TestCase):
+
+    def test_module_is_imported_on_first_access(self):
+        # Given
+        lazy_json = LazyModule('json')
+
+        # When
+        dumped = lazy_json.dumps([1])
+
+        # Then
+        self.assertEqual(dumped, '[1]')
+        self.assertIn('(loaded)', repr(lazy_json))
+
+    def test_load_all_imports_installed_modules(self):
+        # Given
+        lazy_csv = LazyModule('csv')
+        lazy_missing = LazyModule('not_installed_module')
+
+        # When
+        missing = LazyModule.load_all()
+
+        # Then
+        self.assertIn('(loaded)', repr(lazy_csv))
+        self.assertIn('not_installed_module', missing)
+        self.assertNotIn('(loaded)', repr(lazy_missing))
+
+    def test_entry_points_do_not_import_heavy_modules(self):
+        # Given
+        heavy_modules = ['pandas', 'numpy', 'googleapiclient.discovery', 'googleapiclient.http',
+                         'google.cloud.storage', 'google.oauth2', 'ruamel.yaml']
+        script = 'import sys, main, batch_runner; print(",".join(name for name in ' + repr(heavy_modules) + \
+                 ' if name in sys.modules))'
+
+        # When
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=PACKAGE_DIR)
+
+        # Then
+        self.assertEqual(output.decode('utf-8').strip(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,11 @@
+import os
+import tempfile
 import unittest
+import pandas
 import main
+from export_cache import ExportCache
+from google_doc_api_mgmt import GoogleDocAPIMGMT
+from bigquery_loader import LocalBigQueryLoader
 from unittest.mock import MagicMock, patch, mock_open
 from argparse import Namespace
 
@@ -8,6 +14,14 @@ def create_mock_arguments(profile: str, mode: str):
     options = MagicMock()
     options.profile = profile
     options.mode = mode
+    options.clean_sheet = 'False'
+    options.metrics_json = None
+    options.metrics_textfile = None
+    options.metrics_pushgateway = None
+    options.io_engine = 'sync'
+    options.replay_cache = False
+    options.profile_run = None
+    options.io_concurrency = 16
     return options
 
 
@@ -40,6 +54,19 @@ def create_mock_profile_item(mode: str, clean_flag: str):
     profile_item_obj.gcs_destination_schema_path_daily = 'gs://bucket_staging/file_name_20180809.schema'
     profile_item_obj.google_sheet_id = '123456789'
     profile_item_obj.google_sheet_timestamp_format = '%m/%d/%Y %H:%M:%S'
+    profile_item_obj.google_sheets_chunk_rows = None
+    profile_item_obj.google_sheet_typed_fetch = False
+    profile_item_obj.google_drive_download_chunk_mb = None
+    profile_item_obj.gcs_upload_mode = 'file'
+    profile_item_obj.incremental = False
+    profile_item_obj.export_state_path = None
+    profile_item_obj.skip_unchanged = False
+    profile_item_obj.gcs_staged_publish = False
+    profile_item_obj.clean_sheet_verified = False
+    profile_item_obj.export_cache_dir = None
+    profile_item_obj.bigquery_table = None
+    profile_item_obj.sheet_exports = []
+    profile_item_obj.gcs_output_format = 'csv'
     if clean_flag.lower() == 'false':
         profile_item_obj.is_clean_sheet = False
     elif clean_flag.lower() == 'true':
@@ -115,6 +142,7 @@ class TestMain(unittest.TestCase):
         gcs_file_destination = 'gs://destination.csv'
         gcs_schema_destination = 'gs://destination.schema'
         mock_doc_api.download_sheets_ranges_csv.return_value = 'file_output_path', 1
+        mock_profile_item.gcs_output_format = 'csv'
 
         # When
         self.application.extract_data_to_gcs(profile=mock_profile_item, drive_mgmt=mock_doc_api,
@@ -158,6 +186,7 @@ class TestMain(unittest.TestCase):
         # Given
         mock_profile_item_obj = create_mock_profile_item('daily', "True")
         mock_profile_item.return_value = mock_profile_item_obj
+        mock_read_args.return_value = create_mock_arguments(profile='profile.yaml', mode='daily')
 
         # When
         self.application.main()
@@ -166,7 +195,8 @@ class TestMain(unittest.TestCase):
         mock_create_schema_file.assert_called_once()
         mock_exract_data_to_gcs.assert_called_once()
         mock_google_api.assert_called_with(scopes=mock_profile_item_obj.credential_scopes,
-                                                service_account_file=mock_profile_item_obj.service_account_file_path)
+                                                service_account_file=mock_profile_item_obj.service_account_file_path,
+                                                download_chunk_size=None)
         mock_clean_sheets.assert_called_once()
         mock_transform_intpus.assert_called_once()
 
@@ -187,6 +217,7 @@ class TestMain(unittest.TestCase):
         # Given
         mock_profile_item_obj = create_mock_profile_item('hourly', "False")
         mock_profile_item.return_value = mock_profile_item_obj
+        mock_read_args.return_value = create_mock_arguments(profile='profile.yaml', mode='hourly')
 
         # When
         self.application.main()
@@ -195,10 +226,216 @@ class TestMain(unittest.TestCase):
         mock_create_schema_file.assert_called_once()
         mock_exract_data_to_gcs.assert_called_once()
         mock_google_api.assert_called_once_with(scopes=mock_profile_item_obj.credential_scopes,
-                                                service_account_file=mock_profile_item_obj.service_account_file_path)
+                                                service_account_file=mock_profile_item_obj.service_account_file_path,
+                                                download_chunk_size=None)
         mock_clean_sheets.assert_not_called()
         mock_transform_intpus.assert_called_once()
 
+    @patch('main.ArgumentParser')
+    @patch('main.read_args')
+    @patch('main.ProfileItem')
+    @patch('main.create_output_folder')
+    @patch('main.create_schema_file')
+    @patch('main.GoogleDocAPIMGMT')
+    @patch('main.extract_data_to_gcs')
+    @patch('main.extract_data_to_gcs_in_memory')
+    @patch('main.TransformInputs')
+    def test_main_upload_mode_memory(self, mock_transform_intpus, mock_extract_data_to_gcs_in_memory,
+                                     mock_exract_data_to_gcs, mock_google_api, mock_create_schema_file,
+                                     mock_create_output, mock_profile_item, mock_read_args, mock_argument_parser):
+        # Given
+        mock_profile_item_obj = create_mock_profile_item('hourly', "False")
+        mock_profile_item_obj.gcs_upload_mode = 'memory'
+        mock_profile_item.return_value = mock_profile_item_obj
+        mock_read_args.return_value = create_mock_arguments(profile='profile.yaml', mode='hourly')
+        mock_extract_data_to_gcs_in_memory.return_value = 11, 2048
+
+        # When
+        self.application.main()
+
+        # Then
+        mock_extract_data_to_gcs_in_memory.assert_called_once()
+        mock_exract_data_to_gcs.assert_not_called()
+        mock_create_schema_file.assert_not_called()
+        mock_create_output.assert_not_called()
+
+
+    @patch('main.ArgumentParser')
+    @patch('main.read_args')
+    @patch('main.ProfileItem')
+    @patch('main.GoogleDocAPIMGMT')
+    @patch('main.extract_data_to_gcs')
+    @patch('main.ExportStateStore')
+    @patch('main.ChangeDetector')
+    @patch('main.deleted_rows_google_sheets')
+    @patch('main.TransformInputs')
+    def test_main_skip_unchanged(self, mock_transform_intpus, mock_clean_sheets, mock_change_detector,
+                                 mock_export_state_store, mock_exract_data_to_gcs, mock_google_api, mock_profile_item,
+                                 mock_read_args, mock_argument_parser):
+        # Given
+        mock_profile_item_obj = create_mock_profile_item('hourly', "True")
+        mock_profile_item_obj.skip_unchanged = True
+        mock_profile_item_obj.export_state_path = '/tmp/export_state'
+        mock_profile_item.return_value = mock_profile_item_obj
+        mock_read_args.return_value = create_mock_arguments(profile='profile.yaml', mode='hourly')
+        mock_change_detector.return_value.is_revision_unchanged.return_value = True
+
+        # When
+        self.application.main()
+
+        # Then
+        mock_exract_data_to_gcs.assert_not_called()
+        mock_clean_sheets.assert_not_called()
+        mock_change_detector.return_value.save.assert_not_called()
+
+    @patch('main.ArgumentParser')
+    @patch('main.read_args')
+    @patch('main.ProfileItem')
+    @patch('main.GoogleDocAPIMGMT')
+    @patch('main.extract_data_to_gcs')
+    @patch('main.StagedPublish')
+    @patch('main.GoogleCloudStorageClient')
+    @patch('main.deleted_rows_google_sheets')
+    @patch('main.TransformInputs')
+    def test_main_staged_publish_already_published(self, mock_transform_intpus, mock_clean_sheets,
+                                                   mock_google_storage, mock_staged_publish, mock_exract_data_to_gcs,
+                                                   mock_google_api, mock_profile_item, mock_read_args,
+                                                   mock_argument_parser):
+        # Given
+        mock_profile_item_obj = create_mock_profile_item('hourly', "True")
+        mock_profile_item_obj.gcs_staged_publish = True
+        mock_profile_item.return_value = mock_profile_item_obj
+        mock_read_args.return_value = create_mock_arguments(profile='profile.yaml', mode='hourly')
+        mock_staged_publish.return_value.is_published.return_value = True
+
+        # When
+        self.application.main()
+
+        # Then
+        mock_exract_data_to_gcs.assert_not_called()
+        mock_clean_sheets.assert_not_called()
+        mock_staged_publish.return_value.promote.assert_not_called()
+
+    @patch('main.GoogleCloudStorageClient')
+    @patch('main.deleted_rows_google_sheets')
+    def test_replay_cached_exports_uploads_and_cleans_pending_slots(self, mock_clean_sheets, mock_google_storage):
+        # Given
+        mock_profile_item_obj = create_mock_profile_item('hourly', "True")
+        mock_profile_item_obj.is_clean_sheet = True
+        mock_profile_item_obj.incremental = False
+        mock_profile_item_obj.profile_path = 'profile.yaml'
+        export_cache = ExportCache(cache_dir=tempfile.mkdtemp())
+        output_path = os.path.join(tempfile.mkdtemp(), 'temp_file_name')
+        with open(output_path, 'wt') as output_file:
+            output_file.write('a,b\n')
+        export_cache.store(profile_key=ExportCache.profile_key('profile.yaml'), slot_name='gcs/file.csv',
+                           uploads=[{'bucket': 'bucket', 'name': 'gcs/file.csv', 'local_path': output_path,
+                                     'content_type': 'text/csv'}],
+                           metadata={'gcs_file_destination': 'gcs/file.csv', 'gcs_schema_destination': 'gcs/file.schema',
+                                     'row_delete_index': 2, 'is_clean_sheet': True, 'clean_sheet_verified': False})
+
+        # When
+        replayed = main.replay_cached_exports(profile_item=mock_profile_item_obj, export_cache=export_cache)
+        replayed_again = main.replay_cached_exports(profile_item=mock_profile_item_obj, export_cache=export_cache)
+
+        # Then
+        self.assertEqual((replayed, replayed_again), (1, 0))
+        upload_kwargs = mock_google_storage.return_value.upload_file_to_gcs.call_args[1]
+        self.assertEqual(upload_kwargs['gcs_file_name'], 'gcs/file.csv')
+        with open(upload_kwargs['local_file_path'], 'rt') as cached_file:
+            self.assertEqual(cached_file.read(), 'a,b\n')
+        mock_clean_sheets.assert_called_once_with(profile_item=mock_profile_item_obj, delete_index_end=2)
+
+    @patch('main.deleted_rows_google_sheets')
+    @patch('main.extract_data_to_gcs')
+    @patch('main.create_schema_file')
+    @patch('main.create_output_folder')
+    def test_skip_unchanged_after_clean_skips_empty_sheet(self, mock_create_output, mock_create_schema,
+                                                          mock_exract_data_to_gcs, mock_clean_sheets):
+        # Given
+        mock_profile_item_obj = create_mock_profile_item('hourly', "True")
+        mock_profile_item_obj.profile_path = 'profile.yaml'
+        mock_profile_item_obj.skip_unchanged = True
+        mock_profile_item_obj.export_state_path = tempfile.mkdtemp()
+        mock_profile_item_obj.google_sheets_range = 'A2:A'
+        mock_profile_item_obj.columns_transform_mobile_number = []
+        mock_profile_item_obj.columns_transform_timestamp = []
+        mock_create_output.return_value = tempfile.mkdtemp()
+        mock_exract_data_to_gcs.return_value = 3
+        sheet_values = [['2018-08-09 01:02:03'], ['2018-08-09 01:02:04']]
+        service = MagicMock()
+        service.spreadsheets().values().batchGet.side_effect = lambda spreadsheetId, ranges, **kwargs: MagicMock(
+            execute=MagicMock(return_value={'valueRanges': [dict({'range': 'A2:A3'}, **(
+                {'values': list(sheet_values)} if sheet_values else {}))]}))
+        service.files().get().execute.return_value = {'version': '1', 'modifiedTime': '2018-08-09T01:00:00.000Z'}
+
+        # When
+        with patch.object(GoogleDocAPIMGMT, '_create_api_service', return_value=service):
+            cleaning_result = main.run_profile(mock_profile_item_obj)
+            # The clean deleted the exported rows and created a new revision.
+            sheet_values.clear()
+            service.files().get().execute.return_value = {'version': '2',
+                                                          'modifiedTime': '2018-08-09T02:00:00.000Z'}
+            quiet_result = main.run_profile(mock_profile_item_obj)
+            unchanged_result = main.run_profile(mock_profile_item_obj)
+
+        # Then
+        self.assertFalse(cleaning_result.skipped)
+        self.assertTrue(quiet_result.skipped)
+        self.assertTrue(unchanged_result.skipped)
+        mock_exract_data_to_gcs.assert_called_once()
+        mock_clean_sheets.assert_called_once()
+        # The quiet run saved the revision, the next run skips without reading the sheet.
+        self.assertEqual(service.spreadsheets().values().batchGet.call_count, 2)
+
+    @patch('main.GoogleCloudStorageClient')
+    def test_extract_sheet_exports_to_gcs_skips_empty_tabs(self, mock_google_storage):
+        # Given
+        mock_profile_item_obj = create_mock_profile_item('hourly', "True")
+        orders = create_mock_profile_item('hourly', "True")
+        refunds = create_mock_profile_item('hourly', "True")
+        refunds.gcs_destination_file_path = 'refunds_20180809_010203_1.csv'
+        mock_profile_item_obj.sheet_exports = [orders, refunds]
+        drive_mgmt = MagicMock()
+        drive_mgmt.fetch_sheets_multi_ranges_dataframes.return_value = [
+            (pandas.DataFrame([['2018-08-09 01:02:03']], index=[2]), 2), (pandas.DataFrame(), 1)]
+        mock_google_storage.return_value.upload_data_to_gcs.return_value = 20
+
+        # When
+        row_delete_indices, output_bytes = main.extract_sheet_exports_to_gcs(profile=mock_profile_item_obj,
+                                                                             drive_mgmt=drive_mgmt)
+
+        # Then
+        self.assertEqual(row_delete_indices, [2, 1])
+        self.assertEqual(output_bytes, 20)
+        uploaded_names = [call[1]['gcs_file_name']
+                          for call in mock_google_storage.return_value.upload_data_to_gcs.call_args_list]
+        self.assertEqual(sorted(uploaded_names), ['file_name_20180809_010203_1.csv',
+                                                  'gs://bucket_staging/file_name_20180809_010203.schema'])
+
+    def test_load_to_bigquery_loads_uploaded_object(self):
+        # Given
+        mock_profile_item_obj = create_mock_profile_item('hourly', "False")
+        mock_profile_item_obj.bigquery_table = 'staging.sheets.orders'
+        mock_profile_item_obj.bigquery_write_disposition = 'WRITE_TRUNCATE'
+        mock_profile_item_obj.bigquery_partition_type = None
+        mock_profile_item_obj.bigquery_partition_field = None
+        mock_profile_item_obj.gcs_output_format = 'ndjson'
+        bigquery_loader = LocalBigQueryLoader()
+
+        # When
+        main.load_to_bigquery(mock_profile_item_obj, bigquery_loader, 'sheets/orders_1.json')
+        main.load_to_bigquery(mock_profile_item_obj, None, 'sheets/orders_2.json')
+
+        # Then
+        load_request = bigquery_loader.load_requests[0]
+        self.assertEqual(len(bigquery_loader.load_requests), 1)
+        self.assertEqual(load_request.source_uri, 'gs://bucket_staging/sheets/orders_1.json')
+        self.assertEqual(load_request.source_format, 'NEWLINE_DELIMITED_JSON')
+        self.assertEqual(load_request.write_disposition, 'WRITE_TRUNCATE')
+        self.assertEqual(load_request.skip_leading_rows, 0)
+        self.assertEqual(load_request.schema[0]['name'], 'col1')
+
 
 if __name__ == '__main__':
     unittest.main()
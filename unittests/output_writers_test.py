@@ -0,0 +1,94 @@
+import gzip
+import importlib.util
+import io
+import json
+import unittest
+import pandas
+from output_writers import OutputWriter, AvroOutputWriter, apply_schema_types, parse_schema
+
+SCHEMA_CONTENT = json.dumps([{'mode': 'NULLABLE', 'name': 'created_at', 'type': 'TIMESTAMP'},
+                             {'mode': 'NULLABLE', 'name': 'mobile', 'type': 'STRING'},
+                             {'mode': 'NULLABLE', 'name': 'amount', 'type': 'INTEGER'},
+                             {'mode': 'NULLABLE', 'name': 'price', 'type': 'FLOAT'},
+                             {'mode': 'NULLABLE', 'name': 'is_paid', 'type': 'BOOLEAN'}])
+
+
+def create_chunks():
+    return [pandas.DataFrame([['2018-08-09 01:02:03', '0812345678', '3', '9.5', 'TRUE']]),
+            pandas.DataFrame([['2018-08-10 04:05:06', '0898765432', '', 'abc', 'false']], index=[3])]
+
+
+class TestOutputWriters(unittest.TestCase):
+
+    def test_apply_schema_types(self):
+        # When
+        typed = apply_schema_types(pandas.concat(create_chunks()), parse_schema(SCHEMA_CONTENT))
+
+        # Then
+        self.assertEqual(list(typed.columns), ['created_at', 'mobile', 'amount', 'price', 'is_paid'])
+        self.assertEqual(typed['created_at'].iloc[1], pandas.Timestamp('2018-08-10 04:05:06'))
+        self.assertEqual(typed['mobile'].tolist(), ['0812345678', '0898765432'])
+        self.assertEqual(typed['amount'].iloc[0], 3)
+        self.assertTrue(pandas.isnull(typed['amount'].iloc[1]))
+        self.assertTrue(pandas.isnull(typed['price'].iloc[1]))
+        self.assertEqual(typed['is_paid'].tolist(), [True, False])
+
+    def test_csv_gzip_chunks_form_one_gzip_stream(self):
+        # Given
+        output_writer = OutputWriter.for_format('csv_gzip')
+
+        # When
+        content = b''.join(output_writer.serialize_chunks(create_chunks(), schema=[]))
+
+        # Then
+        self.assertEqual(output_writer.content_encoding, 'gzip')
+        self.assertEqual(gzip.decompress(content).decode('utf-8'),
+                         '0,1,2,3,4\n2018-08-09 01:02:03,0812345678,3,9.5,TRUE\n'
+                         '2018-08-10 04:05:06,0898765432,,abc,false\n')
+
+    def test_ndjson_keeps_types(self):
+        # When
+        content = b''.join(OutputWriter.for_format('ndjson').serialize_chunks(create_chunks(),
+                                                                              parse_schema(SCHEMA_CONTENT)))
+
+        # Then
+        records = [json.loads(line) for line in content.decode('utf-8').splitlines()]
+        self.assertEqual(records[0], {'created_at': '2018-08-09 01:02:03.000000', 'mobile': '0812345678',
+                                      'amount': 3, 'price': 9.5, 'is_paid': True})
+        self.assertEqual(records[1]['amount'], None)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_parquet_keeps_types(self):
+        # Given
+        import pyarrow.parquet
+
+        # When
+        content = b''.join(OutputWriter.for_format('parquet').serialize_chunks(create_chunks(),
+                                                                               parse_schema(SCHEMA_CONTENT)))
+
+        # Then
+        table = pyarrow.parquet.read_table(io.BytesIO(content))
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(str(table.schema.field('amount').type), 'int64')
+        self.assertEqual(str(table.schema.field('is_paid').type), 'bool')
+
+    @unittest.skipUnless(importlib.util.find_spec('fastavro'), 'fastavro is not installed')
+    def test_avro_keeps_types(self):
+        # Given
+        import fastavro
+
+        # When
+        content = b''.join(AvroOutputWriter().serialize_chunks(create_chunks(), parse_schema(SCHEMA_CONTENT)))
+
+        # Then
+        records = list(fastavro.reader(io.BytesIO(content)))
+        self.assertEqual(records[0]['amount'], 3)
+        self.assertEqual(records[1]['created_at'].year, 2018)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            OutputWriter.for_format('xlsx')
+
+
+if __name__ == '__main__':
+    unittest.main()
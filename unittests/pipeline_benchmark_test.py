@@ -0,0 +1,53 @@
+import unittest
+from argparse import Namespace
+from api_rate_limiter import ApiRateLimiter
+from benchmarks.fake_backends import SyntheticSheet, FakeSheetsService
+from benchmarks.pipeline_benchmark import benchmark_size, find_regressions, STAGES
+
+
+class TestPipelineBenchmark(unittest.TestCase):
+
+    def tearDown(self):
+        ApiRateLimiter.shared().configure(api='sheets',
+                                          requests_per_minute=ApiRateLimiter.DEFAULT_REQUESTS_PER_MINUTE['sheets'])
+
+    def test_fake_sheets_service_batch_get(self):
+        # Given
+        service = FakeSheetsService(SyntheticSheet(row_count=5, column_count=3))
+
+        # When
+        response = service.spreadsheets().values().batchGet(spreadsheetId='file_id', ranges='A2:B3').execute()
+
+        # Then
+        self.assertEqual(response['valueRanges'][0]['range'], 'A2:B3')
+        self.assertEqual([len(row) for row in response['valueRanges'][0]['values']], [2, 2])
+        self.assertEqual(service.call_counts, {'batchGet': 1})
+
+    def test_benchmark_size(self):
+        # Given
+        args = Namespace(columns=5, mobile_columns=[1], timestamp_columns=[0], dirty_ratio=0.1, chunk_rows=50,
+                         output_format='csv')
+
+        # When
+        result = benchmark_size(200, args)
+
+        # Then
+        self.assertEqual(sorted(result['seconds']), sorted(STAGES))
+        self.assertGreater(result['output_bytes'], 0)
+        self.assertGreater(result['peak_rss_mb'], 0)
+
+    def test_find_regressions(self):
+        # Given
+        baseline = [{'rows': 100, 'rows_per_second': {'fetch': 1000.0, 'transform': 1000.0}}]
+        results = [{'rows': 100, 'rows_per_second': {'fetch': 700.0, 'transform': 950.0}}]
+
+        # When
+        regressions = find_regressions(results, baseline, tolerance=0.2)
+
+        # Then
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('fetch', regressions[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
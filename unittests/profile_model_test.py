@@ -0,0 +1,122 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+import pytz
+from profile_model import ProfileModel, ProfileCache, ProfileValidationError
+
+PROFILE_CONTENT = """timezone: Asia/Bangkok
+gsc_file_pattern: orders_
+date_time_format: '%Y%m%d_%H%M%S'
+date_format: '%Y%m%d'
+gsc_file_type: csv
+credential_api_scope: ['https://www.googleapis.com/auth/spreadsheets']
+service_account_file_path: service_account.json
+google_doc_id: doc_1
+mime_type: text/csv
+gcs_project: staging
+gcs_bucket_name: bucket_staging
+gcs_bucket_destination: sheets/orders
+goolge_data_range: A2:Z
+schema_content: '[{"name": "created", "type": "TIMESTAMP"}]'
+google_sheet_id: '123'
+google_sheet_timestamp_format: '%m/%d/%Y %H:%M:%S'
+google_sheet_column_transform_mobile_number: [1]
+google_sheet_column_transform_timestamp: [0]
+google_sheet_exports:
+  - goolge_data_range: "'Refunds'!A2:H"
+    google_sheet_id: 456
+    gsc_file_pattern: refunds_
+"""
+
+
+def write_profile(content: str = PROFILE_CONTENT) -> str:
+    profile_path = os.path.join(tempfile.mkdtemp(), 'orders.yaml')
+    with open(profile_path, 'w') as profile_file:
+        profile_file.write(content)
+    return profile_path
+
+
+class TestProfileModel(unittest.TestCase):
+
+    def test_rendered_paths_match_concatenated_paths(self):
+        # Given
+        profile_model = ProfileModel.load(write_profile())
+        settings = profile_model.settings
+        current_time = pytz.timezone('Asia/Bangkok').localize(datetime(2018, 8, 9, 1, 2, 3))
+
+        # When
+        paths = profile_model.path_templates.render(current_time)
+
+        # Then
+        file_name = settings['gsc_file_pattern'] + current_time.strftime(settings['date_time_format']) + '_1.' + \
+            settings['gsc_file_type']
+        file_name_daily = settings['gsc_file_pattern'] + datetime.strftime(current_time - timedelta(1),
+                                                                           settings['date_format']) + '_1.csv'
+        self.assertEqual(paths['file_name'], file_name)
+        self.assertEqual(paths['gcs_destination_file_path'], 'sheets/orders/2018/08/' + file_name)
+        self.assertEqual(paths['gcs_destination_daily_file_path'], 'sheets/orders/2018/' + file_name_daily)
+        self.assertEqual(paths['gcs_destination_schema_path'], 'sheets/orders/2018/08/orders_20180809_010203.schema')
+        self.assertEqual(paths['gcs_destination_schema_path_daily'], 'sheets/orders/2018/orders_20180808.schema')
+        self.assertEqual(profile_model.google_sheet_id, 123)
+        self.assertEqual(profile_model.sheet_exports[0].path_templates.render(current_time)['file_name'],
+                         'refunds_20180809_010203_1.csv')
+        self.assertEqual(profile_model.sheet_exports[0].google_doc_id, 'doc_1')
+
+    def test_validation_reports_every_error(self):
+        # Given
+        content = PROFILE_CONTENT.replace('timezone: Asia/Bangkok', 'timezone: Mars/Olympus') \
+            .replace("google_sheet_id: '123'", 'google_sheet_id: abc').replace('mime_type: text/csv\n', '') + \
+            'skip_unchanged: true\nincremental: true\ngcs_output_format: xlsx\n' + \
+            'export_cache_dir: /tmp/exports\ngcs_upload_mode: memory\ngoogle_drive_download_chunk_mb: 0\n'
+
+        # When
+        with self.assertRaises(ProfileValidationError) as validation_error:
+            ProfileModel.load(write_profile(content))
+
+        # Then
+        errors = validation_error.exception.errors
+        self.assertIn('missing key mime_type', errors)
+        self.assertIn('unknown timezone Mars/Olympus', errors)
+        self.assertIn('google_sheet_id is not a number : abc', errors)
+        self.assertIn('skip_unchanged needs export_state_path to remember the last exported revision', errors)
+        self.assertTrue(any('xlsx' in error for error in errors))
+        self.assertIn('export_cache_dir needs gcs_upload_mode file', errors)
+        self.assertIn('incremental cannot be used with google_sheet_exports', errors)
+        self.assertIn('google_drive_download_chunk_mb must be a number greater than 0', errors)
+
+    def test_empty_transform_columns_are_accepted(self):
+        # Given
+        content = PROFILE_CONTENT.replace('google_sheet_column_transform_mobile_number: [1]',
+                                          'google_sheet_column_transform_mobile_number:') \
+            .replace('google_sheet_column_transform_timestamp: [0]', 'google_sheet_column_transform_timestamp: null')
+
+        # When
+        profile_model = ProfileModel.load(write_profile(content))
+
+        # Then
+        self.assertEqual(profile_model.columns_transform_mobile_number, [])
+        self.assertEqual(profile_model.columns_transform_timestamp, [])
+        self.assertEqual(profile_model.sheet_exports[0].columns_transform_timestamp, [])
+
+    def test_profile_cache_reloads_changed_file(self):
+        # Given
+        profile_path = write_profile()
+        profile_cache = ProfileCache()
+        first = profile_cache.load(profile_path)
+
+        # When
+        cached = profile_cache.load(profile_path)
+        with open(profile_path, 'w') as profile_file:
+            profile_file.write(PROFILE_CONTENT.replace('doc_1', 'doc_2'))
+        os.utime(profile_path, (time.time() + 10, time.time() + 10))
+        reloaded = profile_cache.load(profile_path)
+
+        # Then
+        self.assertIs(cached, first)
+        self.assertEqual(reloaded.google_doc_id, 'doc_2')
+
+
+if __name__ == '__main__':
+    unittest.main()
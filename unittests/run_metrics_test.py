@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from api_rate_limiter import ApiRateLimiter
+from run_metrics import RunMetrics, STATUS_SUCCESS, format_prometheus, export_run_reports
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def test_nested_stages(self):
+        # Given
+        clock = FakeClock()
+        run_metrics = RunMetrics(name='profile.yaml', clock=clock)
+
+        # When
+        with run_metrics.activate():
+            with RunMetrics.current().stage('upload', bytes=100):
+                clock.now += 1.0
+                with RunMetrics.current().stage('serialize'):
+                    clock.now += 2.0
+                RunMetrics.current().record('serialize', rows=5, bytes=80)
+        run_metrics.finish(status=STATUS_SUCCESS)
+
+        # Then
+        report = run_metrics.to_dict()
+        self.assertEqual(report['stages']['upload']['seconds'], 3.0)
+        self.assertEqual(report['stages']['upload']['self_seconds'], 1.0)
+        self.assertEqual(report['stages']['upload']['bytes'], 100)
+        self.assertEqual(report['stages']['serialize']['seconds'], 2.0)
+        self.assertEqual(report['stages']['serialize']['rows'], 5)
+        self.assertEqual(report['elapsed_seconds'], 3.0)
+        self.assertIs(RunMetrics.current().enabled, False)
+
+    def test_api_calls_are_counted_on_the_current_stage(self):
+        # Given
+        run_metrics = RunMetrics(name='profile.yaml')
+        limiter = ApiRateLimiter(requests_per_minute={'sheets': None})
+
+        def fetch():
+            with RunMetrics.current().stage('fetch'):
+                return limiter.execute(api='sheets', credential_key='service_account.json', call=lambda: 'values')
+
+        # When
+        with run_metrics.activate():
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(lambda _: run_metrics.bind(fetch)(), range(3)))
+
+        # Then
+        self.assertEqual(results, ['values'] * 3)
+        self.assertEqual(run_metrics.to_dict()['stages']['fetch']['api_calls'], {'sheets': {'calls': 3}})
+
+    def test_format_prometheus(self):
+        # Given
+        run_metrics = RunMetrics(name='profiles/sheet "a".yaml', labels={'mode': 'hourly'})
+        run_metrics.record('fetch', calls=1, seconds=1.5, self_seconds=1.5, rows=10, cells=30)
+        run_metrics.finish(status=STATUS_SUCCESS)
+
+        # When
+        text = format_prometheus([run_metrics.to_dict()])
+
+        # Then
+        self.assertIn('# TYPE sheet_export_stage_rows gauge', text)
+        self.assertIn('sheet_export_stage_rows{mode="hourly",profile="profiles/sheet \\"a\\".yaml",stage="fetch"} 10.0',
+                      text)
+        self.assertIn('sheet_export_run_success{mode="hourly",profile="profiles/sheet \\"a\\".yaml"} 1.0', text)
+
+    def test_export_run_reports(self):
+        # Given
+        output_dir = tempfile.mkdtemp()
+        run_metrics = RunMetrics(name='profile.yaml')
+        run_metrics.record('upload', bytes=2048)
+        run_metrics.finish(status=STATUS_SUCCESS)
+        json_path = os.path.join(output_dir, 'report.json')
+        textfile_path = os.path.join(output_dir, 'export.prom')
+
+        # When
+        export_run_reports([run_metrics.to_dict()], json_path=json_path, textfile_path=textfile_path,
+                           pushgateway_url='http://127.0.0.1:1')
+
+        # Then
+        with open(json_path) as report_file:
+            self.assertEqual(json.load(report_file)['runs'][0]['stages']['upload']['bytes'], 2048)
+        with open(textfile_path) as textfile:
+            self.assertIn('sheet_export_stage_bytes{profile="profile.yaml",stage="upload"} 2048.0', textfile.read())
+        self.assertEqual(sorted(os.listdir(output_dir)), ['export.prom', 'report.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
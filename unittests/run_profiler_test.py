@@ -0,0 +1,54 @@
+import json
+import os
+import pstats
+import tempfile
+import time
+import unittest
+from run_metrics import RunMetrics, STATUS_SUCCESS
+from run_profiler import RunProfiler
+
+ALLOCATION_BYTES = 8 * 1024 * 1024
+
+
+def busy_wait(seconds: float):
+    end_time = time.perf_counter() + seconds
+    while time.perf_counter() < end_time:
+        pass
+
+
+class TestRunProfiler(unittest.TestCase):
+
+    def test_profile_writes_stats_stacks_and_stage_peaks(self):
+        # Given
+        output_dir = tempfile.mkdtemp()
+        run_profiler = RunProfiler(output_dir=output_dir, name='orders', sample_interval=0.001)
+        run_metrics = RunMetrics(name='orders.yaml')
+
+        # When
+        with run_profiler.profile(run_metrics), run_metrics.activate():
+            with RunMetrics.current().stage('upload'):
+                with RunMetrics.current().stage('transform'):
+                    data = bytearray(ALLOCATION_BYTES)
+                    busy_wait(0.05)
+                    del data
+                with RunMetrics.current().stage('serialize'):
+                    busy_wait(0.02)
+            run_metrics.finish(status=STATUS_SUCCESS)
+
+        # Then
+        stats = pstats.Stats(run_profiler.output_path('.pstats'))
+        self.assertTrue(any(function_name == 'busy_wait' for _, _, function_name in stats.stats))
+        with open(run_profiler.output_path('.collapsed')) as collapsed_file:
+            stack_lines = collapsed_file.read().splitlines()
+        self.assertTrue(any(line.startswith('MainThread;') and 'busy_wait' in line for line in stack_lines))
+        with open(run_profiler.output_path('.stages.json')) as stages_file:
+            stages = json.load(stages_file)['stages']
+        self.assertGreaterEqual(stages['transform']['peak_memory_bytes'], ALLOCATION_BYTES)
+        self.assertGreaterEqual(stages['upload']['peak_memory_bytes'], ALLOCATION_BYTES)
+        self.assertLess(stages['serialize']['peak_memory_bytes'], ALLOCATION_BYTES)
+        self.assertIsNone(run_metrics.memory_tracker)
+        self.assertEqual(sorted(os.listdir(output_dir)), ['orders.collapsed', 'orders.pstats', 'orders.stages.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+import pytz
+from batch_runner import ProfileRunResult
+from scheduler_daemon import ScheduleEntry, SchedulerDaemon
+
+PROFILE_TEMPLATE = """timezone: Asia/Bangkok
+gsc_file_pattern: orders_
+date_time_format: '%Y%m%d_%H%M%S'
+date_format: '%Y%m%d'
+gsc_file_type: csv
+credential_api_scope: ['https://www.googleapis.com/auth/spreadsheets']
+service_account_file_path: missing_service_account.json
+google_doc_id: doc_1
+mime_type: text/csv
+gcs_project: staging
+gcs_bucket_name: bucket_staging
+gcs_bucket_destination: sheets/orders
+goolge_data_range: A2:Z
+schema_content: '[{{"name": "created", "type": "TIMESTAMP"}}]'
+google_sheet_id: '{sheet_id}'
+google_sheet_timestamp_format: '%m/%d/%Y %H:%M:%S'
+google_sheet_column_transform_mobile_number: []
+google_sheet_column_transform_timestamp: [0]
+schedule:
+  - mode: hourly
+    minute: {minute}
+"""
+
+
+class FakeClock:
+
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def write_profile(profile_dir: str, file_name: str, sheet_id: str = '1', minute: int = 5) -> str:
+    profile_path = os.path.join(profile_dir, file_name)
+    with open(profile_path, 'w') as profile_file:
+        profile_file.write(PROFILE_TEMPLATE.format(sheet_id=sheet_id, minute=minute))
+    return profile_path
+
+
+class TestSchedulerDaemon(unittest.TestCase):
+
+    def test_next_run_time_in_profile_timezone(self):
+        # Given
+        bangkok = pytz.timezone('Asia/Bangkok')
+        berlin = pytz.timezone('Europe/Berlin')
+        after = datetime(2018, 3, 24, 22, 30, tzinfo=pytz.utc)
+
+        # When
+        hourly = ScheduleEntry(mode='hourly', minute=5).next_run_time(after, bangkok)
+        daily = ScheduleEntry(mode='daily', hour=1, minute=0).next_run_time(after, bangkok)
+        daily_across_dst = ScheduleEntry(mode='daily', hour=3).next_run_time(after, berlin)
+
+        # Then
+        self.assertEqual(hourly, datetime(2018, 3, 24, 23, 5, tzinfo=pytz.utc))
+        self.assertEqual(daily, datetime(2018, 3, 25, 18, 0, tzinfo=pytz.utc))
+        # 03:00 in Berlin is 01:00 UTC after the switch to summer time on 2018-03-25.
+        self.assertEqual(daily_across_dst, datetime(2018, 3, 25, 1, 0, tzinfo=pytz.utc))
+
+    def test_runs_due_profiles_without_overlapping_the_same_sheet(self):
+        # Given
+        profile_dir = tempfile.mkdtemp()
+        write_profile(profile_dir, 'a.yaml', sheet_id='1', minute=5)
+        write_profile(profile_dir, 'b.yaml', sheet_id='1', minute=5)
+        write_profile(profile_dir, 'c.yaml', sheet_id='2', minute=5)
+        clock = FakeClock(datetime(2018, 8, 9, 1, 0, tzinfo=pytz.utc))
+        release = threading.Event()
+        calls = []
+
+        def run_profile(profile_path, mode, is_clean_sheet, profile_model):
+            calls.append((os.path.basename(profile_path), mode, profile_model.google_sheet_id))
+            release.wait(5)
+            return ProfileRunResult(profile_path=profile_path, status='SUCCESS')
+
+        daemon = SchedulerDaemon(profiles=[profile_dir], run_profile=run_profile, clock=clock)
+
+        # When
+        daemon.tick()
+        clock.now += timedelta(minutes=5)
+        daemon.tick()
+        release.set()
+        daemon.executor.shutdown(wait=True)
+
+        # Then
+        self.assertEqual(sorted(calls), [('a.yaml', 'hourly', 1), ('c.yaml', 'hourly', 2)])
+        self.assertEqual(daemon.skipped_runs, 1)
+        self.assertEqual(daemon.running_sheets, set())
+
+    def test_reloads_changed_profiles(self):
+        # Given
+        profile_dir = tempfile.mkdtemp()
+        profile_path = write_profile(profile_dir, 'a.yaml', minute=5)
+        clock = FakeClock(datetime(2018, 8, 9, 1, 0, tzinfo=pytz.utc))
+        daemon = SchedulerDaemon(profiles=[profile_dir], poll_seconds=30, clock=clock,
+                                 run_profile=lambda *args: None)
+        daemon.tick()
+
+        # When
+        write_profile(profile_dir, 'a.yaml', minute=45)
+        os.utime(profile_path, (time.time() + 10, time.time() + 10))
+        clock.now += timedelta(seconds=30)
+        daemon.tick()
+
+        # Then
+        self.assertEqual(daemon.scheduled_profiles[profile_path].next_run_times,
+                         [datetime(2018, 8, 9, 1, 45, tzinfo=pytz.utc)])
+        daemon.executor.shutdown(wait=True)
+
+    def test_rejects_invalid_profile_at_reload(self):
+        # Given
+        profile_dir = tempfile.mkdtemp()
+        profile_path = write_profile(profile_dir, 'a.yaml', minute=5)
+        clock = FakeClock(datetime(2018, 8, 9, 1, 0, tzinfo=pytz.utc))
+        daemon = SchedulerDaemon(profiles=[profile_dir], poll_seconds=30, clock=clock,
+                                 run_profile=lambda *args: None)
+        daemon.tick()
+
+        # When
+        with open(profile_path, 'w') as profile_file:
+            profile_file.write(PROFILE_TEMPLATE.format(sheet_id='abc', minute=45))
+        os.utime(profile_path, (time.time() + 10, time.time() + 10))
+        clock.now += timedelta(seconds=30)
+        with self.assertLogs(level='ERROR') as logs:
+            daemon.tick()
+
+        # Then
+        self.assertIn('google_sheet_id is not a number : abc', logs.output[0])
+        self.assertEqual(daemon.scheduled_profiles[profile_path].next_run_times,
+                         [datetime(2018, 8, 9, 1, 5, tzinfo=pytz.utc)])
+        daemon.executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
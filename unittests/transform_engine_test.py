@@ -0,0 +1,117 @@
+import unittest
+import pandas
+from google_doc_api_mgmt import GoogleDocAPIMGMT
+from transform_engine import VectorizedTransformEngine, TransformReport
+from transform_inputs import TransformInputs
+
+SHEET_TIMESTAMP_FORMAT = '%m/%d/%Y %H:%M:%S'
+
+
+def create_mobile_series():
+    return pandas.Series(['812345678', '0812345678', ' 812345678 ', '+66812345678', '-1', '1_000', '81-234-5678',
+                          '', 'abc', '12.5', '١٢٣', None])
+
+
+def create_timestamp_series():
+    return pandas.Series(['08/09/2018 01:02:03', '12/31/2018 23:59:59', '1/2/2018 3:04:05', '02/29/2020 00:00:00'])
+
+
+class TestVectorizedTransformEngine(unittest.TestCase):
+
+    def test_mobile_parity_with_convert_mobile_number(self):
+        # Given
+        series = create_mobile_series()
+
+        # When
+        expected = series.apply(GoogleDocAPIMGMT.convert_mobile_number)
+        result = VectorizedTransformEngine.transform_mobile_series(series)
+
+        # Then
+        self.assertEqual(result.tolist(), expected.tolist())
+
+    def test_timestamp_parity_with_convert_date_time(self):
+        # Given
+        series = create_timestamp_series()
+        engine = VectorizedTransformEngine(sheet_timestamp=SHEET_TIMESTAMP_FORMAT)
+
+        # When
+        expected = series.apply(GoogleDocAPIMGMT.convert_date_time, input_format=SHEET_TIMESTAMP_FORMAT)
+        result = engine.transform_timestamp_series(series)
+
+        # Then
+        self.assertEqual(result.tolist(), expected.tolist())
+
+    def test_transform_dataframe_parity(self):
+        # Given
+        rows = [[str(index), '8' + str(index).zfill(8), '08/09/2018 01:02:' + str(index % 60).zfill(2)]
+                for index in range(200)]
+        rows[7][1] = 'n/a'
+        transform_inputs = TransformInputs()
+        transform_inputs.convert_transform_inputs(mobile_column_inputs=[1], timestamp_column_inputs=[2])
+        engine = VectorizedTransformEngine(sheet_timestamp=SHEET_TIMESTAMP_FORMAT)
+
+        # When
+        expected = pandas.DataFrame(rows)
+        expected[1] = expected[1].apply(GoogleDocAPIMGMT.convert_mobile_number)
+        expected[2] = expected[2].apply(GoogleDocAPIMGMT.convert_date_time, input_format=SHEET_TIMESTAMP_FORMAT)
+        result, report = engine.transform(data=pandas.DataFrame(rows), transform_inputs=transform_inputs)
+
+        # Then
+        self.assertEqual(result.values.tolist(), expected.values.tolist())
+        self.assertEqual(report.mobile_unconverted_rows, {1: [7]})
+        self.assertFalse(report.has_timestamp_failures())
+
+    def test_timestamp_failures_raise_in_strict_mode(self):
+        # Given
+        series = pandas.Series(['08/09/2018 01:02:03', '2018-08-09'])
+        with self.assertRaises(ValueError):
+            series.apply(GoogleDocAPIMGMT.convert_date_time, input_format=SHEET_TIMESTAMP_FORMAT)
+        transform_inputs = TransformInputs()
+        transform_inputs.convert_transform_inputs(mobile_column_inputs=[], timestamp_column_inputs=[0])
+        engine = VectorizedTransformEngine(sheet_timestamp=SHEET_TIMESTAMP_FORMAT)
+
+        # When
+        with self.assertRaises(ValueError):
+            engine.transform(data=pandas.DataFrame({0: series}), transform_inputs=transform_inputs)
+
+    def test_timestamp_failures_reported_in_lenient_mode(self):
+        # Given
+        series = pandas.Series(['08/09/2018 01:02:03', '2018-08-09', '08/10/2018 01:02:03'])
+        engine = VectorizedTransformEngine(sheet_timestamp=SHEET_TIMESTAMP_FORMAT, strict=False)
+        report = TransformReport()
+
+        # When
+        result = engine.transform_timestamp_series(series, column=4, report=report)
+
+        # Then
+        self.assertEqual(result.tolist(), ['2018-08-09 01:02:03', '2018-08-09', '2018-08-10 01:02:03'])
+        self.assertEqual(report.timestamp_failed_rows, {4: [1]})
+
+    def test_transform_typed_values(self):
+        # Given
+        rows = [[43321 + 3723 / 86400, 812345678, '0812345678', '12', 'TRUE', 43322],
+                ['08/10/2018 01:02:03', '0812345679', 812345679.0, 7, False, 43323.5],
+                [43322.999999999, 'n/a', None, '', True, None]]
+        schema = [{'name': 'created', 'type': 'TIMESTAMP'}, {'name': 'mobile', 'type': 'STRING'},
+                  {'name': 'mobile_2', 'type': 'STRING'}, {'name': 'count', 'type': 'INTEGER'},
+                  {'name': 'flag', 'type': 'BOOLEAN'}, {'name': 'day', 'type': 'DATE'}]
+        transform_inputs = TransformInputs()
+        transform_inputs.convert_transform_inputs(mobile_column_inputs=[1, 2], timestamp_column_inputs=[])
+        transform_inputs.set_typed_schema(schema)
+        engine = VectorizedTransformEngine(sheet_timestamp=SHEET_TIMESTAMP_FORMAT)
+
+        # When
+        result, report = engine.transform(data=pandas.DataFrame(rows), transform_inputs=transform_inputs)
+
+        # Then
+        self.assertEqual(result[0].tolist(), ['2018-08-09 01:02:03', '2018-08-10 01:02:03', '2018-08-11 00:00:00'])
+        self.assertEqual(result[1].tolist(), ['0812345678', '0812345679', 'n/a'])
+        self.assertEqual(result[2].tolist(), ['0812345678', '0812345679', None])
+        self.assertEqual(result[3].tolist(), [12, 7, pandas.NA])
+        self.assertEqual(result[4].tolist(), [True, False, True])
+        self.assertEqual(result[5].tolist(), ['2018-08-10', '2018-08-11', None])
+        self.assertEqual(report.mobile_unconverted_rows, {1: [2]})
+
+
+if __name__ == '__main__':
+    unittest.main()